@@ -1,20 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import asyncio
+import hmac
 import jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
 from .models import User, UserRole
-from .database import find_one
+from .database import find_one, update_one
+from .cache import TTLCache
 
 # Security configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+# EventSource cannot send headers, so /events takes a short-lived ticket in
+# the URL instead of the access token; it is only good for opening the stream
+STREAM_TICKET_SCOPE = "stream"
+STREAM_TICKET_TTL = int(os.getenv("STREAM_TICKET_TTL", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with a different cost are transparently upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Static bearer token for Prometheus scrapers, which cannot log in
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# bcrypt is CPU-bound; run it off the event loop with bounded concurrency
+password_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "4")),
+    thread_name_prefix="password-hash",
+)
+
+# Short-lived cache of active users keyed by token subject (username)
+principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "30")),
+)
+
+# Sequence number of the last eviction per username. A token lookup only
+# caches its user if the username was not evicted after the lookup began,
+# so a read that raced a deactivation cannot put the active user back.
+principal_invalidations = TTLCache(maxsize=principal_cache.maxsize, ttl=60)
+_principal_seq = 0
+
+def evict_principal(username: Optional[str]) -> None:
+    """Forget a cached principal and fence off lookups already in flight"""
+    global _principal_seq
+    if username:
+        _principal_seq += 1
+        principal_invalidations.set(username, _principal_seq)
+        principal_cache.pop(username)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
@@ -24,6 +70,16 @@ def hash_password(password: str) -> str:
     """Hash a password"""
     return pwd_context.hash(password)
 
+async def hash_password_async(password: str) -> str:
+    """Hash a password on the password worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify on the password worker pool; also returns a new hash if the stored one is outdated"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token"""
     to_encode = data.copy()
@@ -36,6 +92,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_stream_ticket(username: str) -> str:
+    """Create a stream-only token for opening /events"""
+    return create_access_token(
+        data={"sub": username, "scope": STREAM_TICKET_SCOPE},
+        expires_delta=timedelta(seconds=STREAM_TICKET_TTL)
+    )
+
 def verify_token(token: str) -> Optional[dict]:
     """Verify and decode JWT token"""
     try:
@@ -54,32 +117,83 @@ async def authenticate_user(username: str, password: str) -> Optional[User]:
         return None
     
     user = User(**user_data)
-    if not verify_password(password, user.password_hash):
+    valid, new_hash = await verify_and_update_password(password, user.password_hash)
+    if not valid:
         return None
     
+    if new_hash:
+        await update_one("users", {"id": user.id}, {"password_hash": new_hash})
+        user.password_hash = new_hash
+    
     return user
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    """Get current authenticated user"""
+async def user_from_token(token: str, scope: Optional[str] = None) -> User:
+    """Resolve a token to its active user; scope must match the token's (None for access tokens)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    token_data = verify_token(credentials.credentials)
-    if token_data is None:
+    token_data = verify_token(token)
+    if token_data is None or token_data.get("scope") != scope:
         raise credentials_exception
     
     username = token_data.get("sub")
     if username is None:
         raise credentials_exception
     
+    user = principal_cache.get(username)
+    if user is not None:
+        return user
+    
+    mark = _principal_seq
     user_data = await find_one("users", {"username": username, "active": True})
     if user_data is None:
         raise credentials_exception
     
-    return User(**user_data)
+    user = User(**user_data)
+    if principal_invalidations.get(username, 0) <= mark:
+        principal_cache.set(username, user)
+    return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+    """Get current authenticated user"""
+    return await user_from_token(credentials.credentials)
+
+async def get_stream_user(
+    ticket: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> User:
+    """Like get_current_user, but also accepts a stream ticket as ?ticket= since EventSource cannot send headers"""
+    if credentials:
+        return await user_from_token(credentials.credentials)
+    if ticket:
+        return await user_from_token(ticket, scope=STREAM_TICKET_SCOPE)
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def get_metrics_reader(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> None:
+    """Allow the METRICS_TOKEN bearer token, or an admin's access token"""
+    if not credentials:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if METRICS_TOKEN and hmac.compare_digest(credentials.credentials, METRICS_TOKEN):
+        return
+    user = await user_from_token(credentials.credentials)
+    if user.role != UserRole.admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
 
 async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
     """Get current user if they are admin"""
@@ -103,7 +217,7 @@ def create_admin_user_if_not_exists():
             # Create default admin
             admin_data = {
                 "username": "admin",
-                "password_hash": hash_password("admin123"),
+                "password_hash": await hash_password_async("admin123"),
                 "full_name": "İbrahim Usta",
                 "email": "admin@elektrikdukkani.com",
                 "role": "admin",
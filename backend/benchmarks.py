@@ -0,0 +1,418 @@
+"""Before/after benchmarks for optimizations whose original code is gone.
+
+Each benchmark times a copy of the code it replaced next to the current
+implementation on the same data, and prints latency percentiles plus
+MongoDB round trips per call as JSON:
+
+    python -m backend.benchmarks checkout --basket-sizes 1,10,50
+    python -m backend.benchmarks dashboard --products 5000 --sales 50000
+    python -m backend.benchmarks login-lag --logins 20
+    python -m backend.benchmarks rows --rows 1000
+
+Like backend.loadtest it works on a throwaway ``<DB_NAME>_bench`` database
+that is dropped afterwards (``--keep-db`` to inspect it), or with
+``--in-memory`` on mongomock-motor, whose timings only show relative
+round-trip costs, not what a real mongod would do.
+"""
+from dotenv import load_dotenv
+from pathlib import Path
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import time
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from . import auth, database
+from .database import aggregate, count_documents, find_many, find_one, insert_one, insert_many, model_projection, update_one
+from .loadtest import connect_in_memory, git_commit, percentile, product_docs
+from .metrics import count_db_calls
+from .models import (
+    DashboardStats, Product, Sale, SaleCreate, SaleItem, StockMovement, StockMovementType, User, UserRole
+)
+from .services import DashboardService, ProductService, SalesRollupService, SalesService, StockService
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def scratch_database(args):
+    """Connect to an empty database for one benchmark run, dropping it afterwards"""
+    base_name = os.environ.get("DB_NAME", "elektrik_dukkani")
+    os.environ["DB_NAME"] = args.db_name or f"{base_name}_bench"
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    if args.in_memory:
+        await connect_in_memory()
+    else:
+        probe = database.AsyncIOMotorClient(os.environ["MONGO_URL"])
+        existing = await probe[os.environ["DB_NAME"]].list_collection_names()
+        probe.close()
+        if existing:
+            raise SystemExit(f"Database {os.environ['DB_NAME']} is not empty; drop it or pass another --db-name")
+        await database.connect_to_mongo()
+    try:
+        yield
+    finally:
+        if not args.keep_db:
+            await database.db.client.drop_database(os.environ["DB_NAME"])
+        await database.close_mongo_connection()
+
+async def measure(call: Callable[[], Awaitable[Any]], repeat: int, warmup: int) -> Dict[str, Any]:
+    """Latency percentiles and mean MongoDB round trips of repeated awaits of call()"""
+    for _ in range(warmup):
+        await call()
+    latencies: List[float] = []
+    round_trips = 0
+    for _ in range(repeat):
+        with count_db_calls() as stats:
+            started = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - started) * 1000)
+        round_trips += stats.calls
+    latencies.sort()
+    return {
+        "runs": repeat,
+        "mean_ms": round(sum(latencies) / repeat, 3),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "db_round_trips": round(round_trips / repeat, 1),
+    }
+
+def compare(legacy: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "legacy": legacy,
+        "current": current,
+        "speedup": round(legacy["mean_ms"] / current["mean_ms"], 2) if current["mean_ms"] else None,
+    }
+
+# Original checkout (before batching and transactions): one read per line,
+# then a read-modify-write-read per line for the stock
+async def _legacy_get_product(product_id: str):
+    product_data = await find_one("products", {"id": product_id})
+    return Product(**product_data) if product_data else None
+
+async def _legacy_update_stock(product_id: str, quantity_change: int):
+    product = await _legacy_get_product(product_id)
+    if not product:
+        return None
+    update_dict = {"stock": max(0, product.stock + quantity_change), "updated_at": datetime.utcnow()}
+    await update_one("products", {"id": product_id}, update_dict)
+    return await _legacy_get_product(product_id)
+
+async def legacy_create_sale(sale_data: SaleCreate, cashier_id: str) -> Sale:
+    subtotal = 0
+    tax_amount = 0
+    items = []
+    for item_data in sale_data.items:
+        product = await _legacy_get_product(item_data.product_id)
+        if not product:
+            raise ValueError(f"Product not found: {item_data.product_id}")
+        if product.stock < item_data.quantity:
+            raise ValueError(f"Insufficient stock for {product.name}")
+        gross_total = item_data.quantity * item_data.unit_price
+        rate = (item_data.tax_rate or 0) / 100
+        net_total = gross_total / (1 + rate) if rate > 0 else gross_total
+        items.append(SaleItem(**item_data.dict(), total_price=gross_total))
+        subtotal += net_total
+        tax_amount += gross_total - net_total
+    sale = Sale(
+        cashier_id=cashier_id,
+        items=items,
+        subtotal=subtotal,
+        tax_amount=tax_amount,
+        total=subtotal + tax_amount,
+        payment_method=sale_data.payment_method
+    )
+    await insert_one("sales", sale.dict())
+    for item in items:
+        await _legacy_update_stock(item.product_id, -item.quantity)
+    return sale
+
+async def checkout(args) -> Dict[str, Any]:
+    """SalesService.create_sale against the per-line original, by basket size"""
+    sizes = [int(size) for size in args.basket_sizes.split(",")]
+    rng = random.Random(args.seed)
+    docs = product_docs(max(args.products, max(sizes)), rng)
+    await insert_many("products", docs)
+
+    results = {}
+    for size in sizes:
+        def basket() -> SaleCreate:
+            return SaleCreate(items=[{
+                "product_id": doc["id"],
+                "barcode": doc["barcode"],
+                "product_name": doc["name"],
+                "quantity": 1,
+                "unit_price": doc["sell_price"],
+                "tax_rate": doc["tax_rate"],
+            } for doc in rng.sample(docs, size)], payment_method="cash")
+
+        legacy = await measure(lambda: legacy_create_sale(basket(), "bench"), args.repeat, args.warmup)
+        current = await measure(lambda: SalesService.create_sale(basket(), "bench"), args.repeat, args.warmup)
+        results[f"basket={size}"] = compare(legacy, current)
+    return results
+
+# Original dashboard: five sequential round trips, the low-stock count
+# taken as len() of up to 100 full products, daily totals from raw sales
+async def _legacy_daily_stats() -> Dict[str, Any]:
+    start_of_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    result = await aggregate("sales", [
+        {"$match": {"created_at": {"$gte": start_of_day, "$lt": start_of_day + timedelta(days=1)}}},
+        {"$group": {
+            "_id": None,
+            "total_sales": {"$sum": 1},
+            "total_revenue": {"$sum": "$total"},
+            "total_items": {"$sum": {"$sum": "$items.quantity"}}
+        }}
+    ])
+    stats = result[0] if result else {}
+    return {"total_revenue": stats.get("total_revenue", 0.0), "total_items_sold": stats.get("total_items", 0)}
+
+async def legacy_dashboard_stats() -> DashboardStats:
+    total_products = await count_documents("products")
+    stock_result = await aggregate("products", [{"$group": {"_id": None, "total_stock": {"$sum": "$stock"}}}])
+    daily_stats = await _legacy_daily_stats()
+    low_stock = await find_many(
+        "products", {"$expr": {"$lte": ["$stock", "$min_stock"]}}, limit=100, sort={"updated_at": -1}
+    )
+    low_stock_products = [Product(**doc) for doc in low_stock]
+    total_sales = await count_documents("sales")
+    return DashboardStats(
+        total_products=total_products,
+        total_stock=stock_result[0]["total_stock"] if stock_result else 0,
+        daily_revenue=daily_stats["total_revenue"],
+        low_stock_count=len(low_stock_products),
+        daily_items_sold=daily_stats["total_items_sold"],
+        total_sales=total_sales
+    )
+
+def sale_docs(count: int, products: List[dict], rng: random.Random) -> List[dict]:
+    """Sales spread over the last 30 days, a tenth of them today"""
+    now = datetime.utcnow()
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    docs = []
+    for i in range(count):
+        if i % 10 == 0:
+            created_at = start_of_day + (now - start_of_day) * rng.random()
+        else:
+            created_at = now - timedelta(days=rng.uniform(1, 30))
+        items = [
+            SaleItem(
+                product_id=doc["id"], barcode=doc["barcode"], product_name=doc["name"], quantity=rng.randint(1, 3),
+                unit_price=doc["sell_price"], tax_rate=doc["tax_rate"], total_price=doc["sell_price"]
+            )
+            for doc in rng.sample(products, rng.randint(1, 5))
+        ]
+        total = sum(item.total_price * item.quantity for item in items)
+        docs.append(Sale(
+            cashier_id="bench", items=items, subtotal=total / 1.2, tax_amount=total - total / 1.2,
+            total=total, payment_method=rng.choice(["cash", "card"]), created_at=created_at
+        ).dict())
+    return docs
+
+async def dashboard(args) -> Dict[str, Any]:
+    """DashboardService.get_dashboard_stats against the sequential original"""
+    rng = random.Random(args.seed)
+    docs = product_docs(args.products, rng)
+    for doc in rng.sample(docs, len(docs) // 5):
+        doc["stock"] = rng.randint(0, doc["min_stock"])
+        doc["is_low"] = True
+    await insert_many("products", docs)
+    for start in range(0, args.sales, 1000):
+        await insert_many("sales", sale_docs(min(1000, args.sales - start), docs, rng))
+    await SalesRollupService.rebuild()
+
+    legacy = await measure(legacy_dashboard_stats, args.repeat, args.warmup)
+    current = await measure(DashboardService.get_dashboard_stats, args.repeat, args.warmup)
+    return {
+        "products": args.products,
+        "low_stock_products": len(docs) // 5,
+        "sales": args.sales,
+        "dashboard": compare(legacy, current),
+    }
+
+# Original login: bcrypt verified inline on the event loop
+async def legacy_authenticate_user(username: str, password: str):
+    user_data = await find_one("users", {"username": username, "active": True})
+    if not user_data:
+        return None
+    user = User(**user_data)
+    if not auth.verify_password(password, user.password_hash):
+        return None
+    return user
+
+async def loop_lag(logins: Callable[[], Awaitable[Any]], interval: float = 0.005) -> Dict[str, Any]:
+    """Run logins() while a ticker records how late each of its wakeups is"""
+    lags: List[float] = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append((time.perf_counter() - started - interval) * 1000)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(interval * 2)
+    started = time.perf_counter()
+    await logins()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    lags.sort()
+    return {
+        "wall_ms": round(elapsed * 1000, 3),
+        "ticks": len(lags),
+        "lag_p50_ms": round(percentile(lags, 0.50), 3),
+        "lag_p95_ms": round(percentile(lags, 0.95), 3),
+        "lag_max_ms": round(lags[-1], 3),
+    }
+
+async def login_lag(args) -> Dict[str, Any]:
+    """Event-loop lag while --logins users log in at once, inline bcrypt vs the password pool"""
+    password = "bench-password"
+    await insert_one("users", User(
+        username="bench", full_name="Benchmark", role=UserRole.cashier,
+        password_hash=await auth.hash_password_async(password)
+    ).dict())
+
+    async def burst(authenticate):
+        users = await asyncio.gather(*(authenticate("bench", password) for _ in range(args.logins)))
+        assert all(users), "login failed"
+
+    return {
+        "logins": args.logins,
+        "bcrypt_rounds": auth.BCRYPT_ROUNDS,
+        "password_workers": int(os.getenv("PASSWORD_HASH_WORKERS", "4")),
+        "legacy": await loop_lag(lambda: burst(legacy_authenticate_user)),
+        "current": await loop_lag(lambda: burst(auth.authenticate_user)),
+    }
+
+# Original list endpoints: full models from the service, then FastAPI's
+# response path (dump, validate against response_model, JSON-mode
+# serialize) and the stdlib encoder of JSONResponse
+def legacy_render(models: List[Any], model) -> bytes:
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    adapter = TypeAdapter(List[model])
+    value = adapter.validate_python([item.dict(by_alias=True) for item in models])
+    return JSONResponse(adapter.dump_python(value, mode="json")).body
+
+async def rows(args) -> Dict[str, Any]:
+    """Per-row cost of list pages: models plus response_model plus stdlib JSON vs projected rows plus orjson"""
+    from .server import lean_response
+    rng = random.Random(args.seed)
+    docs = product_docs(args.rows, rng)
+    await insert_many("products", docs)
+    await insert_many("sales", sale_docs(args.rows, docs, rng))
+    await insert_many("stock_movements", [StockMovement(
+        product_id=doc["id"], type=rng.choice(list(StockMovementType)), quantity=rng.randint(1, 20),
+        unit_price=doc["buy_price"], supplier="Toptanci", created_by="bench"
+    ).dict() for doc in docs])
+
+    pages = {
+        "products": (
+            Product,
+            lambda: ProductService.get_products(limit=args.rows),
+            lambda: ProductService.get_products(limit=args.rows, projection=model_projection(Product)),
+        ),
+        "sales": (
+            Sale,
+            lambda: SalesService.get_sales(limit=args.rows),
+            lambda: SalesService.get_sales(limit=args.rows, projection=model_projection(Sale)),
+        ),
+        "movements": (
+            StockMovement,
+            lambda: StockService.get_movements(limit=args.rows),
+            lambda: StockService.get_movements(limit=args.rows, projection=model_projection(StockMovement)),
+        ),
+    }
+    results = {}
+    for name, (model, full, lean) in pages.items():
+        async def legacy():
+            return legacy_render(await full(), model)
+
+        async def current():
+            return lean_response(await lean()).body
+
+        # The same encoding work on rows fetched once, without the database
+        models, lean_rows = await full(), await lean()
+
+        async def legacy_render_only():
+            return legacy_render(models, model)
+
+        async def current_render_only():
+            return lean_response(lean_rows).body
+
+        results[name] = {
+            "page": compare(
+                await measure(legacy, args.repeat, args.warmup),
+                await measure(current, args.repeat, args.warmup),
+            ),
+            "render": compare(
+                await measure(legacy_render_only, args.repeat, args.warmup),
+                await measure(current_render_only, args.repeat, args.warmup),
+            ),
+        }
+        for result in results[name].values():
+            for variant in ("legacy", "current"):
+                result[variant]["us_per_row"] = round(result[variant]["mean_ms"] * 1000 / args.rows, 2)
+    return {"rows": args.rows, "pages": results}
+
+BENCHMARKS: Dict[str, Callable[[Any], Awaitable[Dict[str, Any]]]] = {
+    "checkout": checkout,
+    "dashboard": dashboard,
+    "login-lag": login_lag,
+    "rows": rows,
+}
+
+async def run(args) -> Dict[str, Any]:
+    async with scratch_database(args):
+        results = await BENCHMARKS[args.benchmark](args)
+    return {
+        "meta": {
+            "benchmark": args.benchmark,
+            "commit": git_commit(),
+            "started_at": datetime.utcnow().isoformat(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "backend": "mongomock" if args.in_memory else "mongod",
+            "transactions": database.db.supports_transactions,
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m backend.benchmarks", description=__doc__.split("\n\n")[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=50, help="Measured calls per variant")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured calls per variant")
+    parser.add_argument("--products", type=int, default=500, help="Catalog size to seed")
+    parser.add_argument("--basket-sizes", default="1,10,50", help="checkout: comma-separated line counts")
+    parser.add_argument("--sales", type=int, default=20000, help="dashboard: sales to seed over the last 30 days")
+    parser.add_argument("--logins", type=int, default=20, help="login-lag: concurrent logins per variant")
+    parser.add_argument("--rows", type=int, default=1000, help="rows: rows seeded and fetched per page")
+    parser.add_argument("--seed", type=int, default=42, help="RNG seed")
+    parser.add_argument("--db-name", help="Database to create and drop (default: <DB_NAME>_bench)")
+    parser.add_argument("--keep-db", action="store_true", help="Do not drop the database afterwards")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock-motor instead of MONGO_URL")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Catalog version counter for delta sync and ETags.
+
+Every product or stock write allocates the next version from the
+``counters`` collection and stamps it on the documents it touches. The
+allocation is recorded as pending until the write (and its transaction,
+if any) finishes, and ``catalog_version()`` never reports past the oldest
+pending one. A client that synced up to the reported version therefore
+cannot miss a write that was still in flight when it read.
+
+The counter lives outside transactions so concurrent sales do not
+conflict on it; allocate with ``catalog_write()`` before opening one.
+
+Releasing a finished version does not cost its own round trip: released
+versions are dropped from the pending list by the next allocation, or
+after CATALOG_RELEASE_DELAY seconds in one batched update when no write
+follows. Until then ``catalog_version()`` lags slightly, which only makes
+clients sync a little later.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
+import asyncio
+import logging
+import os
+
+from pymongo import ReturnDocument
+
+from .database import get_collection
+from .metrics import db_call
+
+COUNTER_ID = "catalog"
+# Pending allocations older than this belong to a crashed writer
+PENDING_TIMEOUT = timedelta(seconds=int(os.getenv("CATALOG_PENDING_TIMEOUT", "60")))
+RELEASE_DELAY = float(os.getenv("CATALOG_RELEASE_DELAY", "0.05"))
+
+logger = logging.getLogger(__name__)
+
+# Finished versions still listed as pending on the counter
+_released: List[int] = []
+_flusher: Optional[asyncio.Task] = None
+
+def _take_released() -> List[int]:
+    released = list(_released)
+    _released.clear()
+    return released
+
+async def flush_releases() -> None:
+    """Drop every released version from the pending list now"""
+    released = _take_released()
+    if not released:
+        return
+    counters = await get_collection("counters")
+    try:
+        with db_call("counters", "update_one"):
+            await counters.update_one({"_id": COUNTER_ID}, {"$pull": {"pending": {"v": {"$in": released}}}})
+    except Exception as e:
+        # Retried with the next allocation; PENDING_TIMEOUT is the backstop
+        _released.extend(released)
+        logger.error(f"Releasing catalog versions failed: {e}")
+
+async def _flush_later() -> None:
+    await asyncio.sleep(RELEASE_DELAY)
+    await flush_releases()
+
+def _release(version: int) -> None:
+    global _flusher
+    _released.append(version)
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.create_task(_flush_later())
+
+@asynccontextmanager
+async def catalog_write():
+    """Allocate a catalog version for the writes made inside the block"""
+    counters = await get_collection("counters")
+    now = datetime.utcnow()
+    released = _take_released()
+    live = {"$filter": {
+        "input": {"$ifNull": ["$pending", []]},
+        "cond": {"$and": [
+            {"$gt": ["$$this.at", now - PENDING_TIMEOUT]},
+            {"$not": {"$in": ["$$this.v", released]}},
+        ]}
+    }}
+    # Same as [{"v": "$value", "at": now}]; mongomock only evaluates it this way
+    allocated = {"$map": {"input": [now], "in": {"v": "$value", "at": "$$this"}}}
+    try:
+        with db_call("counters", "find_one_and_update"):
+            doc = await counters.find_one_and_update(
+                {"_id": COUNTER_ID},
+                [
+                    {"$set": {"value": {"$add": [{"$ifNull": ["$value", 0]}, 1]}}},
+                    {"$set": {"pending": {"$concatArrays": [live, allocated]}}},
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+    except BaseException:
+        _released.extend(released)
+        raise
+    version = doc["value"]
+    try:
+        yield version
+    finally:
+        _release(version)
+
+async def catalog_version() -> int:
+    """Highest version below which every write has finished"""
+    counters = await get_collection("counters")
+    with db_call("counters", "find_one"):
+        doc = await counters.find_one({"_id": COUNTER_ID})
+    if not doc:
+        return 0
+    cutoff = datetime.utcnow() - PENDING_TIMEOUT
+    pending = [entry["v"] for entry in doc.get("pending", []) if entry["at"] > cutoff]
+    return min(pending) - 1 if pending else doc["value"]
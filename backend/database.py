@@ -1,14 +1,30 @@
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import base64
+import json
 import os
+import random
 from datetime import datetime
 import logging
 
+from .metrics import db_call, timed_iter
+
 logger = logging.getLogger(__name__)
 
+# Attempts for a transaction that hits write conflicts, and the base of
+# the jittered backoff between them (seconds)
+TRANSACTION_ATTEMPTS = int(os.getenv("TRANSACTION_ATTEMPTS", "5"))
+TRANSACTION_BACKOFF = float(os.getenv("TRANSACTION_BACKOFF", "0.01"))
+# Documents per server batch for cursors read through timed_iter
+BATCH_SIZE = 1000
+
 class Database:
     client: Optional[AsyncIOMotorClient] = None
     database: Optional[AsyncIOMotorDatabase] = None
+    supports_transactions: bool = False
 
 # Database instance
 db = Database()
@@ -26,6 +42,12 @@ async def connect_to_mongo():
         await db.client.admin.command('ping')
         logger.info("Successfully connected to MongoDB")
         
+        # Transactions need a replica set or mongos
+        hello = await db.client.admin.command('hello')
+        db.supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+        if not db.supports_transactions:
+            logger.warning("MongoDB is standalone; multi-document writes run without transactions")
+        
         # Create indexes
         await create_indexes()
         
@@ -40,34 +62,11 @@ async def close_mongo_connection():
         logger.info("Disconnected from MongoDB")
 
 async def create_indexes():
-    """Create database indexes for better performance"""
+    """Create database indexes by applying pending schema migrations"""
+    from .migrations import run_migrations
     try:
-        database = await get_database()
-        
-        # Users collection indexes
-        await database.users.create_index("username", unique=True)
-        await database.users.create_index("email")
-        await database.users.create_index("role")
-        
-        # Products collection indexes
-        await database.products.create_index("barcode", unique=True)
-        await database.products.create_index("name")
-        await database.products.create_index("category")
-        await database.products.create_index("brand")
-        await database.products.create_index("stock")
-        
-        # Stock movements collection indexes
-        await database.stock_movements.create_index("product_id")
-        await database.stock_movements.create_index("type")
-        await database.stock_movements.create_index("created_at")
-        await database.stock_movements.create_index("created_by")
-        
-        # Sales collection indexes
-        await database.sales.create_index("cashier_id")
-        await database.sales.create_index("created_at")
-        await database.sales.create_index("total")
-        
-        logger.info("Database indexes created successfully")
+        applied = await run_migrations()
+        logger.info(f"Database migrations up to date (applied now: {applied or 'none'})")
         
     except Exception as e:
         logger.error(f"Error creating indexes: {e}")
@@ -78,26 +77,140 @@ async def get_collection(collection_name: str):
     database = await get_database()
     return database[collection_name]
 
+async def run_in_transaction(body: Callable[[Any], Awaitable[Any]], attempts: int = TRANSACTION_ATTEMPTS) -> Any:
+    """Run ``await body(session)`` in a transaction and return its result.
+
+    Callers pass the session as ``session=`` to the helpers below. Write
+    conflicts with concurrent transactions (TransientTransactionError) rerun
+    the whole body, up to attempts times with a short jittered backoff, and a
+    commit with an unknown outcome is retried; anything else aborts and
+    propagates. On standalone servers body runs once with session=None.
+    """
+    if not db.supports_transactions:
+        return await body(None)
+    async with await db.client.start_session() as session:
+        for attempt in range(1, attempts + 1):
+            session.start_transaction()
+            try:
+                result = await body(session)
+            except BaseException as e:
+                if session.in_transaction:
+                    await session.abort_transaction()
+                if _retryable(e, "TransientTransactionError") and attempt < attempts:
+                    await asyncio.sleep(random.uniform(0, TRANSACTION_BACKOFF * attempt))
+                    continue
+                raise
+            try:
+                await _commit_with_retry(session)
+                return result
+            except PyMongoError as e:
+                if _retryable(e, "TransientTransactionError") and attempt < attempts:
+                    await asyncio.sleep(random.uniform(0, TRANSACTION_BACKOFF * attempt))
+                    continue
+                raise
+
+def _retryable(error: BaseException, label: str) -> bool:
+    return isinstance(error, PyMongoError) and error.has_error_label(label)
+
+async def _commit_with_retry(session, attempts: int = TRANSACTION_ATTEMPTS) -> None:
+    for attempt in range(1, attempts + 1):
+        try:
+            await session.commit_transaction()
+            return
+        except PyMongoError as e:
+            if _retryable(e, "UnknownTransactionCommitResult") and attempt < attempts:
+                continue
+            raise
+
+# Keyset (cursor) pagination
+def encode_cursor(value: Any, doc_id: str) -> str:
+    """Build an opaque cursor pointing just past (value, id)"""
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps([value, doc_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Inverse of encode_cursor; raises ValueError on malformed input"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, doc_id = json.loads(raw)
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        return value, str(doc_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def keyset_filter(filter_dict: dict, sort_field: str, cursor: Optional[str]) -> dict:
+    """Restrict a descending (sort_field, id) query to documents after the cursor"""
+    if not cursor:
+        return filter_dict
+    value, doc_id = decode_cursor(cursor)
+    after = {"$or": [
+        {sort_field: {"$lt": value}},
+        {sort_field: value, "id": {"$lt": doc_id}},
+    ]}
+    return {"$and": [filter_dict, after]} if filter_dict else after
+
 # Generic CRUD operations
-async def insert_one(collection_name: str, document: dict) -> str:
+async def insert_one(collection_name: str, document: dict, session=None) -> str:
     """Insert a single document"""
     collection = await get_collection(collection_name)
-    result = await collection.insert_one(document)
+    with db_call(collection_name, "insert_one"):
+        result = await collection.insert_one(document, session=session)
     return str(result.inserted_id)
 
-async def find_one(collection_name: str, filter_dict: dict) -> Optional[dict]:
-    """Find a single document"""
+async def insert_many(collection_name: str, documents: list, ordered: bool = True, session=None) -> int:
+    """Insert several documents in one round trip"""
+    if not documents:
+        return 0
     collection = await get_collection(collection_name)
-    result = await collection.find_one(filter_dict)
-    if result:
+    with db_call(collection_name, "insert_many"):
+        result = await collection.insert_many(documents, ordered=ordered, session=session)
+    return len(result.inserted_ids)
+
+async def bulk_write(collection_name: str, operations: list, ordered: bool = True, session=None):
+    """Send a batch of write operations in one round trip"""
+    collection = await get_collection(collection_name)
+    with db_call(collection_name, "bulk_write"):
+        return await collection.bulk_write(operations, ordered=ordered, session=session)
+
+async def find_one(collection_name: str, filter_dict: dict, projection: dict = None) -> Optional[dict]:
+    """Find a single document, optionally returning only the projected fields"""
+    collection = await get_collection(collection_name)
+    with db_call(collection_name, "find_one"):
+        result = await collection.find_one(filter_dict, projection)
+    if result and "_id" in result:
         result["_id"] = str(result["_id"])
     return result
 
-async def find_many(collection_name: str, filter_dict: dict = None, skip: int = 0, limit: int = None, sort: dict = None) -> list:
-    """Find multiple documents"""
+def model_projection(model) -> dict:
+    """Projection returning exactly the fields of a response model"""
+    projection = {field: 1 for field in model.model_fields}
+    projection["_id"] = 0
+    return projection
+
+def fields_projection(model, fields: Optional[str], default=None, required: tuple = ("id",)) -> dict:
+    """Projection for a comma-separated ``fields=`` parameter.
+
+    Requested names must be fields of model; without any, the fields of
+    default (or model) are returned. ``required`` fields are always kept.
+    """
+    if not fields:
+        return model_projection(default or model)
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    projection = {name: 1 for name in requested.union(required)}
+    projection["_id"] = 0
+    return projection
+
+async def find_many(collection_name: str, filter_dict: dict = None, skip: int = 0, limit: int = None, sort: dict = None, projection: dict = None) -> list:
+    """Find multiple documents, optionally returning only the projected fields"""
     collection = await get_collection(collection_name)
     
-    cursor = collection.find(filter_dict or {})
+    cursor = collection.find(filter_dict or {}, projection, batch_size=BATCH_SIZE)
     
     if sort:
         cursor = cursor.sort(list(sort.items()))
@@ -109,8 +222,9 @@ async def find_many(collection_name: str, filter_dict: dict = None, skip: int =
         cursor = cursor.limit(limit)
     
     results = []
-    async for document in cursor:
-        document["_id"] = str(document["_id"])
+    async for document in timed_iter(collection_name, "find", cursor, BATCH_SIZE):
+        if "_id" in document:
+            document["_id"] = str(document["_id"])
         results.append(document)
     
     return results
@@ -119,25 +233,77 @@ async def update_one(collection_name: str, filter_dict: dict, update_dict: dict)
     """Update a single document"""
     collection = await get_collection(collection_name)
     update_dict["updated_at"] = datetime.utcnow()
-    result = await collection.update_one(filter_dict, {"$set": update_dict})
+    with db_call(collection_name, "update_one"):
+        result = await collection.update_one(filter_dict, {"$set": update_dict})
     return result.modified_count > 0
 
+async def update_many(collection_name: str, filter_dict: dict, update_dict: dict) -> int:
+    """Update every matching document; returns how many changed"""
+    collection = await get_collection(collection_name)
+    update_dict["updated_at"] = datetime.utcnow()
+    with db_call(collection_name, "update_many"):
+        result = await collection.update_many(filter_dict, {"$set": update_dict})
+    return result.modified_count
+
+async def find_one_and_update(collection_name: str, filter_dict: dict, update: dict, session=None) -> Optional[dict]:
+    """Atomically update a single document and return it after the update"""
+    collection = await get_collection(collection_name)
+    with db_call(collection_name, "find_one_and_update"):
+        result = await collection.find_one_and_update(
+            filter_dict, update, return_document=ReturnDocument.AFTER, session=session
+        )
+    if result:
+        result["_id"] = str(result["_id"])
+    return result
+
 async def delete_one(collection_name: str, filter_dict: dict) -> bool:
     """Delete a single document"""
     collection = await get_collection(collection_name)
-    result = await collection.delete_one(filter_dict)
+    with db_call(collection_name, "delete_one"):
+        result = await collection.delete_one(filter_dict)
     return result.deleted_count > 0
 
+async def delete_many(collection_name: str, filter_dict: dict) -> int:
+    """Delete every matching document"""
+    collection = await get_collection(collection_name)
+    with db_call(collection_name, "delete_many"):
+        result = await collection.delete_many(filter_dict)
+    return result.deleted_count
+
 async def count_documents(collection_name: str, filter_dict: dict = None) -> int:
     """Count documents"""
     collection = await get_collection(collection_name)
-    return await collection.count_documents(filter_dict or {})
+    with db_call(collection_name, "count_documents"):
+        return await collection.count_documents(filter_dict or {})
+
+async def estimated_count(collection_name: str) -> int:
+    """Collection size from metadata, without scanning"""
+    collection = await get_collection(collection_name)
+    with db_call(collection_name, "estimated_count"):
+        return await collection.estimated_document_count()
+
+async def iter_find(collection_name: str, filter_dict: dict = None, projection: dict = None, sort: dict = None, batch_size: int = BATCH_SIZE):
+    """Yield matching documents one by one, fetching batch_size at a time"""
+    collection = await get_collection(collection_name)
+    cursor = collection.find(filter_dict or {}, projection, batch_size=batch_size)
+    if sort:
+        cursor = cursor.sort(list(sort.items()))
+    async for document in timed_iter(collection_name, "find", cursor, batch_size):
+        yield document
+
+async def iter_aggregate(collection_name: str, pipeline: list, batch_size: int = BATCH_SIZE):
+    """Yield aggregation results one by one without materializing the whole result"""
+    collection = await get_collection(collection_name)
+    cursor = collection.aggregate(pipeline, batchSize=batch_size)
+    async for document in timed_iter(collection_name, "aggregate", cursor, batch_size):
+        yield document
 
 async def aggregate(collection_name: str, pipeline: list) -> list:
     """Perform aggregation"""
     collection = await get_collection(collection_name)
     results = []
-    async for document in collection.aggregate(pipeline):
+    cursor = collection.aggregate(pipeline, batchSize=BATCH_SIZE)
+    async for document in timed_iter(collection_name, "aggregate", cursor, BATCH_SIZE):
         if "_id" in document:
             document["_id"] = str(document["_id"])
         results.append(document)
@@ -0,0 +1,167 @@
+"""In-process pub/sub hub behind the /api/events SSE stream.
+
+Services publish product, stock and sale events after their writes
+commit; every connected client has a bounded queue. A client that falls
+behind is not allowed to grow memory: its queue is dropped and it gets a
+single ``resync`` event, after which the stream closes and the client
+reconnects and refreshes (cheaply, via the catalog ETag/delta endpoints).
+
+With EVENTS_CHANGE_STREAM=1 events are written to the ``events``
+collection instead and every worker dispatches them from a change stream,
+so clients connected to any worker see writes made on all of them. This
+needs a replica set.
+"""
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, Optional, Set
+import asyncio
+import logging
+import os
+
+import orjson
+
+from .database import get_collection, insert_one
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+CHANGE_STREAM = os.getenv("EVENTS_CHANGE_STREAM", "0").lower() in ("1", "true", "yes")
+
+# Queued in place of the backlog when a subscriber overflows
+RESYNC = {"type": "resync", "data": {"reason": "Client fell behind; refetch and reconnect"}}
+
+class Subscriber:
+    def __init__(self, user: User, types: Optional[Set[str]] = None, maxsize: int = QUEUE_SIZE):
+        self.user = user
+        self.types = types
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def wants(self, event: dict) -> bool:
+        if self.types and event["type"] not in self.types:
+            return False
+        roles = event.get("roles")
+        if roles and self.user.role.value not in roles:
+            return event.get("user_id") == self.user.id
+        return True
+
+    def offer(self, event: dict) -> None:
+        """Queue without waiting; on overflow replace the backlog with a resync"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+class EventHub:
+    def __init__(self, change_stream: bool = CHANGE_STREAM):
+        self.change_stream = change_stream
+        self.subscribers: Set[Subscriber] = set()
+        self.dropped = 0
+        self._watcher: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        """Whether anyone (here or, with fan-out, on another worker) may be listening"""
+        return self.change_stream or bool(self.subscribers)
+
+    def subscribe(self, user: User, types: Optional[Iterable[str]] = None) -> Subscriber:
+        subscriber = Subscriber(user, set(types) if types else None)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+        if subscriber.overflowed:
+            self.dropped += 1
+
+    def dispatch(self, event: dict) -> None:
+        for subscriber in list(self.subscribers):
+            if subscriber.wants(event):
+                subscriber.offer(event)
+
+    async def publish(self, event_type: str, data: dict, roles: Optional[Iterable[str]] = None, user_id: Optional[str] = None) -> None:
+        """Announce a committed change; never raises into the caller's request.
+
+        ``roles`` limits delivery to those roles, plus ``user_id`` itself.
+        """
+        if not self.active:
+            return
+        event = {
+            "type": event_type,
+            "data": data,
+            "roles": list(roles) if roles else None,
+            "user_id": user_id,
+            "created_at": datetime.utcnow(),
+        }
+        if not self.change_stream:
+            self.dispatch(event)
+            return
+        try:
+            await insert_one("events", event)
+        except Exception as e:
+            logger.error(f"Publishing {event_type} event failed: {e}")
+
+    async def _watch(self) -> None:
+        collection = await get_collection("events")
+        while True:
+            try:
+                async with collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                    async for change in stream:
+                        event = change["fullDocument"]
+                        event.pop("_id", None)
+                        self.dispatch(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event change stream failed, retrying: {e}")
+                await asyncio.sleep(5)
+
+    def start(self) -> None:
+        if self.change_stream and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watcher:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribers": len(self.subscribers),
+            "dropped": self.dropped,
+            "change_stream": self.change_stream,
+        }
+
+hub = EventHub()
+
+def format_event(event: dict) -> str:
+    data = orjson.dumps(event["data"]).decode()
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+async def event_stream(subscriber: Subscriber, is_disconnected) -> AsyncIterator[str]:
+    """SSE body for one subscriber, with heartbeats and a resync on overflow"""
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            yield format_event(event)
+            if event is RESYNC:
+                break
+    finally:
+        hub.unsubscribe(subscriber)
@@ -0,0 +1,135 @@
+"""Streaming CSV/NDJSON exports.
+
+Rows are read from a projected cursor and encoded as they arrive, so an
+export of any size holds only one cursor batch in memory and the first
+bytes go out before the query finishes.
+"""
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator, Dict, List, Optional
+import csv
+import io
+import json
+
+from .database import iter_find, iter_aggregate
+from .models import ExportFormat
+
+# Flush the encoder buffer once it holds this many bytes
+CHUNK_SIZE = 64 * 1024
+
+SALE_COLUMNS = ["id", "created_at", "cashier_id", "payment_method", "subtotal", "tax_amount", "total", "item_count"]
+SALE_ITEM_COLUMNS = [
+    "sale_id", "created_at", "cashier_id", "payment_method", "product_id", "barcode",
+    "product_name", "quantity", "unit_price", "tax_rate", "total_price",
+]
+MOVEMENT_COLUMNS = [
+    "id", "created_at", "product_id", "type", "quantity", "unit_price", "total_price",
+    "supplier", "note", "created_by", "receipt_id",
+]
+FINANCE_COLUMNS = ["id", "date", "type", "amount", "category", "description", "person", "created_by", "created_by_name"]
+
+MEDIA_TYPES = {
+    ExportFormat.csv: "text/csv; charset=utf-8",
+    ExportFormat.ndjson: "application/x-ndjson",
+}
+
+def _date_range(field: str, start_date: Optional[datetime], end_date: Optional[datetime]) -> dict:
+    date_filter = {}
+    if start_date:
+        date_filter["$gte"] = start_date
+    if end_date:
+        date_filter["$lte"] = end_date
+    return {field: date_filter} if date_filter else {}
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+async def encode_rows(rows: AsyncIterator[dict], columns: List[str], fmt: ExportFormat) -> AsyncIterator[bytes]:
+    """Encode rows into CSV (with header) or NDJSON chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == ExportFormat.csv:
+        # BOM so Excel opens Turkish text as UTF-8
+        buffer.write("\ufeff")
+        writer.writerow(columns)
+
+    def flush() -> bytes:
+        chunk = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    # Header first, so the download starts before the query returns
+    if buffer.tell():
+        yield flush()
+
+    async for row in rows:
+        values = [_plain(row.get(column)) for column in columns]
+        if fmt == ExportFormat.csv:
+            writer.writerow(["" if value is None else value for value in values])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False, default=str))
+            buffer.write("\n")
+        if buffer.tell() >= CHUNK_SIZE:
+            yield flush()
+    if buffer.tell():
+        yield flush()
+
+def sale_rows(start_date: datetime = None, end_date: datetime = None) -> AsyncIterator[dict]:
+    """One row per sale; item_count is units sold, as on the irsaliye and in the rollups"""
+    pipeline = [
+        {"$match": _date_range("created_at", start_date, end_date)},
+        {"$sort": {"created_at": 1, "id": 1}},
+        {"$project": {
+            "_id": 0, "id": 1, "created_at": 1, "cashier_id": 1, "payment_method": 1,
+            "subtotal": 1, "tax_amount": 1, "total": 1, "item_count": {"$sum": "$items.quantity"},
+        }},
+    ]
+    return iter_aggregate("sales", pipeline)
+
+def sale_item_rows(start_date: datetime = None, end_date: datetime = None) -> AsyncIterator[dict]:
+    """One row per sold line, flattened server-side with $unwind"""
+    pipeline = [
+        {"$match": _date_range("created_at", start_date, end_date)},
+        {"$sort": {"created_at": 1, "id": 1}},
+        {"$project": {"_id": 0, "id": 1, "created_at": 1, "cashier_id": 1, "payment_method": 1, "items": 1}},
+        {"$unwind": "$items"},
+        {"$project": {
+            "sale_id": "$id", "created_at": 1, "cashier_id": 1, "payment_method": 1,
+            "product_id": "$items.product_id", "barcode": "$items.barcode",
+            "product_name": "$items.product_name", "quantity": "$items.quantity",
+            "unit_price": "$items.unit_price", "tax_rate": "$items.tax_rate",
+            "total_price": "$items.total_price",
+        }},
+    ]
+    return iter_aggregate("sales", pipeline)
+
+def movement_rows(
+    start_date: datetime = None,
+    end_date: datetime = None,
+    product_id: str = None,
+    movement_type: str = None
+) -> AsyncIterator[dict]:
+    filter_dict: Dict = _date_range("created_at", start_date, end_date)
+    if product_id:
+        filter_dict["product_id"] = product_id
+    if movement_type:
+        filter_dict["type"] = movement_type
+    projection = {c: 1 for c in MOVEMENT_COLUMNS}
+    projection["_id"] = 0
+    return iter_find("stock_movements", filter_dict, projection, sort={"created_at": 1, "id": 1})
+
+def finance_rows(start_date: datetime = None, end_date: datetime = None, finance_type: str = None) -> AsyncIterator[dict]:
+    filter_dict: Dict = _date_range("date", start_date, end_date)
+    if finance_type:
+        filter_dict["type"] = finance_type
+    projection = {c: 1 for c in FINANCE_COLUMNS}
+    projection["_id"] = 0
+    return iter_find("finance", filter_dict, projection, sort={"date": 1, "id": 1})
+
+def filename(name: str, fmt: ExportFormat) -> str:
+    return f"{name}_{datetime.utcnow().strftime('%Y%m%d')}.{fmt.value}"
@@ -0,0 +1,137 @@
+"""Idempotency-Key support for retried POST requests.
+
+The first request with a key reserves it with a "pending" document in
+``idempotency_keys``; the finished response is stored on the same document
+and in an in-memory cache, so retries get it back without repeating the
+work. A TTL index expires keys after IDEMPOTENCY_TTL seconds.
+
+The record the operation creates carries the reservation id in a
+uniquely indexed ``idempotency_id`` field, written in the same insert
+(and transaction) as the record itself. A reservation left pending by a
+request that crashed after committing is completed from that record
+instead of being taken over, and if a taken-over request does commit
+late, the second insert hits the unique index and the first result is
+replayed.
+"""
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional, Type, TypeVar
+import hashlib
+import json
+import os
+
+from pydantic import BaseModel
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .cache import TTLCache
+from .database import insert_one, find_one, get_collection, delete_one
+from .metrics import db_call
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# A pending key older than this belongs to a request that never finished
+PENDING_TIMEOUT = timedelta(seconds=int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "60")))
+MAX_KEY_LENGTH = 255
+
+# (scope, user_id, key) -> (fingerprint, response dict)
+response_cache = TTLCache(
+    maxsize=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=IDEMPOTENCY_TTL
+)
+
+Model = TypeVar("Model", bound=BaseModel)
+
+class IdempotencyConflict(Exception):
+    """The key is in use by a different or still-running request"""
+
+def fingerprint(payload: dict) -> str:
+    body = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def _replay(doc_fingerprint: str, request_fingerprint: str, response: dict, model: Type[Model]) -> Model:
+    if doc_fingerprint != request_fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+    return model(**response)
+
+async def _committed(collection_name: str, doc_id: str, model: Type[Model]) -> Optional[Model]:
+    """The record an operation run under this reservation committed, if any"""
+    doc = await find_one(collection_name, {"idempotency_id": doc_id})
+    return model(**doc) if doc else None
+
+async def _complete(doc_id: str, response: dict) -> None:
+    collection = await get_collection("idempotency_keys")
+    with db_call("idempotency_keys", "update_one"):
+        await collection.update_one({"_id": doc_id}, {"$set": {"status": "done", "response": response}})
+
+async def _reserve(doc_id: str, request_fingerprint: str, collection_name: str) -> dict:
+    """Insert the pending key; returns None if reserved, else the existing document"""
+    doc = {"_id": doc_id, "fingerprint": request_fingerprint, "status": "pending", "created_at": datetime.utcnow()}
+    for _ in range(2):
+        try:
+            await insert_one("idempotency_keys", doc)
+            return None
+        except DuplicateKeyError:
+            pass
+        existing = await find_one("idempotency_keys", {"_id": doc_id})
+        if existing is None:
+            continue
+        if existing["status"] == "pending" and existing["created_at"] < datetime.utcnow() - PENDING_TIMEOUT:
+            if await find_one(collection_name, {"idempotency_id": doc_id}, {"_id": 1}):
+                # It committed, then died before recording the response
+                return existing
+            # Take over a key whose request died mid-flight
+            await delete_one("idempotency_keys", {"_id": doc_id, "status": "pending", "created_at": existing["created_at"]})
+            continue
+        return existing
+    raise IdempotencyConflict("A request with this Idempotency-Key is still in progress")
+
+async def run_once(
+    scope: str,
+    user_id: str,
+    key: str,
+    payload: dict,
+    operation: Callable[[str], Awaitable[Model]],
+    model: Type[Model],
+    collection_name: str
+) -> Model:
+    """Run operation at most once per (scope, user, key) and replay its result.
+
+    operation receives the reservation id and must store it as
+    ``idempotency_id`` on the record it inserts into collection_name.
+    A failed operation releases the key so the client can retry it.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+    cache_key = (scope, user_id, key)
+    request_fingerprint = fingerprint(payload)
+
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return _replay(cached[0], request_fingerprint, cached[1], model)
+
+    doc_id = f"{scope}:{user_id}:{key}"
+    existing = await _reserve(doc_id, request_fingerprint, collection_name)
+    if existing is not None:
+        if existing["status"] == "pending":
+            committed = await _committed(collection_name, doc_id, model)
+            if committed is None:
+                raise IdempotencyConflict("A request with this Idempotency-Key is still in progress")
+            existing["response"] = committed.dict()
+            await _complete(doc_id, existing["response"])
+        response_cache.set(cache_key, (existing["fingerprint"], existing["response"]))
+        return _replay(existing["fingerprint"], request_fingerprint, existing["response"], model)
+
+    try:
+        result = await operation(doc_id)
+    except (DuplicateKeyError, BulkWriteError):
+        # A request we took over committed after all: replay its result
+        result = await _committed(collection_name, doc_id, model)
+        if result is None:
+            await delete_one("idempotency_keys", {"_id": doc_id, "status": "pending"})
+            raise
+    except BaseException:
+        await delete_one("idempotency_keys", {"_id": doc_id, "status": "pending"})
+        raise
+
+    response = result.dict()
+    await _complete(doc_id, response)
+    response_cache.set(cache_key, (request_fingerprint, response))
+    return result
@@ -0,0 +1,115 @@
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+import codecs
+import csv
+import re
+
+from .search import fold
+
+# Turkish spreadsheet headings accepted next to the API field names
+HEADER_ALIASES = {
+    "barkod": "barcode",
+    "ad": "name",
+    "urun": "name",
+    "urun_adi": "name",
+    "isim": "name",
+    "kategori": "category",
+    "marka": "brand",
+    "stok": "stock",
+    "min_stok": "min_stock",
+    "minimum_stok": "min_stock",
+    "alis_fiyati": "buy_price",
+    "satis_fiyati": "sell_price",
+    "kdv": "tax_rate",
+    "kdv_orani": "tax_rate",
+    "tedarikci": "supplier",
+}
+
+TEXT_FIELDS = {"barcode", "name", "category", "brand", "supplier"}
+DECIMAL_FIELDS = {"buy_price", "sell_price"}
+
+def normalize_header(header: Any) -> str:
+    key = re.sub(r"[^a-z0-9]+", "_", fold(str(header or ""))).strip("_")
+    return HEADER_ALIASES.get(key, key)
+
+def clean_cell(field: str, value: Any) -> Any:
+    """Turn a raw cell into something ProductCreate can validate"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value == "":
+            return None
+        # Turkish decimal comma: "12,50"
+        if field in DECIMAL_FIELDS and "," in value and "." not in value:
+            value = value.replace(",", ".")
+        return value
+    if field in TEXT_FIELDS:
+        # Spreadsheets store barcodes as numbers
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+    return value
+
+class RowReader:
+    """Reads an uploaded CSV or XLSX file in batches of product rows.
+
+    Each row is yielded as (row_number, fields) where row_number is the
+    1-based line in the sheet, counting the header row.
+    """
+
+    def __init__(self, fileobj: BinaryIO, filename: str):
+        name = (filename or "").lower()
+        if name.endswith(".xlsx"):
+            self._rows = self._xlsx_rows(fileobj)
+        elif name.endswith(".csv") or not name:
+            self._rows = self._csv_rows(fileobj)
+        else:
+            raise ValueError("Unsupported file type; upload a .csv or .xlsx file")
+        self._header: Optional[List[str]] = None
+        self._row_number = 0
+
+    @staticmethod
+    def _csv_rows(fileobj: BinaryIO) -> Iterator[List[Any]]:
+        text = codecs.getreader("utf-8-sig")(fileobj)
+        sample = text.readline()
+        if not sample:
+            return
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield next(csv.reader([sample], dialect))
+        yield from csv.reader(text, dialect)
+
+    @staticmethod
+    def _xlsx_rows(fileobj: BinaryIO) -> Iterator[List[Any]]:
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("XLSX import requires openpyxl")
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            workbook.close()
+
+    def read_batch(self, size: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Return up to size parsed rows; an empty list means the file is done"""
+        batch = []
+        for raw in self._rows:
+            self._row_number += 1
+            if self._header is None:
+                self._header = [normalize_header(h) for h in raw]
+                continue
+            fields = {}
+            for field, value in zip(self._header, raw):
+                value = clean_cell(field, value)
+                if field and value is not None:
+                    fields[field] = value
+            if not fields:
+                continue
+            batch.append((self._row_number, fields))
+            if len(batch) >= size:
+                break
+        return batch
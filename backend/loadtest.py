@@ -0,0 +1,402 @@
+"""Load benchmark for the scan, checkout, dashboard and report flows.
+
+Boots the app in-process and calls it through ASGI directly (no sockets,
+no HTTP client dependency) against a throwaway database. Concurrent
+virtual tills run a weighted mix of requests for a fixed duration, and
+the results are printed as JSON with throughput and p50/p95/p99 latency
+per endpoint, so runs on different commits can be diffed:
+
+    python -m backend.loadtest --duration 30 --concurrency 8 --output bench.json
+
+By default it uses MONGO_URL with a fresh ``<DB_NAME>_loadtest`` database
+that is dropped afterwards (``--keep-db`` to inspect it). ``--in-memory``
+runs against mongomock-motor instead of a server when that package is
+installed. That is handy for smoke-testing the harness, but its timings
+say nothing about a real mongod, and endpoints that rely on aggregation
+expressions in updates (the catalog version behind /api/products) fail
+under it.
+
+The process exits non-zero when any request failed.
+"""
+from dotenv import load_dotenv
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Default request mix (relative weights)
+DEFAULT_MIX = {
+    "scan": 40,
+    "autocomplete": 10,
+    "checkout": 20,
+    "catalog": 5,
+    "dashboard": 10,
+    "top_products": 5,
+    "daily_report": 5,
+    "export_sales": 3,
+    "irsaliye": 2,
+}
+BASKET_SIZES = [1, 1, 2, 3, 5, 10]
+NAME_WORDS = ["LED Ampul", "Avize", "Sigorta", "Kablo", "Priz", "Anahtar", "Spot", "Aplik", "Şalter", "Duy"]
+BRANDS = ["Philips", "Osram", "ABB", "Schneider", "Viko", "Legrand"]
+
+# Default users created at startup by server.create_default_admin
+ADMIN_LOGIN = {"username": "admin", "password": "admin123"}
+CASHIER_LOGIN = {"username": "kasiyer1", "password": "kasiyer123"}
+
+class ASGIClient:
+    """Minimal HTTP client that calls an ASGI app in-process"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict] = None,
+        json_body: Any = None,
+        token: Optional[str] = None
+    ) -> Tuple[int, bytes]:
+        body = orjson.dumps(json_body) if json_body is not None else b""
+        headers = [
+            (b"host", b"loadtest"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        if token:
+            headers.append((b"authorization", f"Bearer {token}".encode()))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": urlencode(params or {}).encode(),
+            "headers": headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("loadtest", 80),
+        }
+        finished = asyncio.Event()
+        request_sent = False
+        status = 0
+        chunks: List[bytes] = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    finished.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+        return status, b"".join(chunks)
+
+class Context:
+    """Per-till state: its own RNG, the shared catalog sample and tokens"""
+
+    def __init__(self, client: ASGIClient, rng: random.Random, products: List[dict], tokens: Dict[str, str]):
+        self.client = client
+        self.rng = rng
+        self.products = products
+        self.tokens = tokens
+
+    async def get(self, path: str, role: str, params: Optional[dict] = None) -> int:
+        status, _ = await self.client.request("GET", path, params=params, token=self.tokens[role])
+        return status
+
+    async def post(self, path: str, role: str, body: Any) -> int:
+        status, _ = await self.client.request("POST", path, json_body=body, token=self.tokens[role])
+        return status
+
+# Each scenario returns (endpoint label, HTTP status)
+Scenario = Callable[[Context], Awaitable[Tuple[str, int]]]
+
+async def scan(ctx: Context):
+    product = ctx.rng.choice(ctx.products)
+    return "GET /api/products/barcode/{barcode}", await ctx.get(f"/api/products/barcode/{product['barcode']}", "cashier")
+
+async def autocomplete(ctx: Context):
+    word = ctx.rng.choice(NAME_WORDS).split()[0]
+    query = word[:ctx.rng.randint(2, len(word))]
+    return "GET /api/products/autocomplete", await ctx.get("/api/products/autocomplete", "cashier", {"q": query})
+
+async def checkout(ctx: Context):
+    size = ctx.rng.choice(BASKET_SIZES)
+    items = [{
+        "product_id": product["id"],
+        "barcode": product["barcode"],
+        "product_name": product["name"],
+        "quantity": ctx.rng.randint(1, 3),
+        "unit_price": product["sell_price"],
+        "tax_rate": product["tax_rate"],
+    } for product in ctx.rng.sample(ctx.products, size)]
+    body = {"items": items, "payment_method": ctx.rng.choice(["cash", "card"])}
+    return f"POST /api/sales [basket={size}]", await ctx.post("/api/sales", "cashier", body)
+
+async def catalog(ctx: Context):
+    return "GET /api/products?limit=1000", await ctx.get("/api/products", "cashier", {"limit": 1000})
+
+async def dashboard(ctx: Context):
+    return "GET /api/dashboard/stats", await ctx.get("/api/dashboard/stats", "admin")
+
+async def top_products(ctx: Context):
+    return "GET /api/dashboard/top-products", await ctx.get("/api/dashboard/top-products", "admin")
+
+async def daily_report(ctx: Context):
+    return "GET /api/sales/reports/daily", await ctx.get("/api/sales/reports/daily", "admin")
+
+async def export_sales(ctx: Context):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    params = {"format": "csv", "items": "true", "start_date": today.isoformat()}
+    return "GET /api/exports/sales", await ctx.get("/api/exports/sales", "admin", params)
+
+async def irsaliye(ctx: Context):
+    return "GET /api/sales/reports/irsaliye", await ctx.get("/api/sales/reports/irsaliye", "admin")
+
+SCENARIOS: Dict[str, Scenario] = {
+    "scan": scan,
+    "autocomplete": autocomplete,
+    "checkout": checkout,
+    "catalog": catalog,
+    "dashboard": dashboard,
+    "top_products": top_products,
+    "daily_report": daily_report,
+    "export_sales": export_sales,
+    "irsaliye": irsaliye,
+}
+
+def parse_mix(text: Optional[str]) -> Dict[str, int]:
+    """``scan=40,checkout=20`` -> weights; omitted scenarios are not run"""
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(samples: Dict[str, List[Tuple[float, int]]], elapsed: float) -> Dict[str, Any]:
+    endpoints = {}
+    total = errors = 0
+    for label in sorted(samples):
+        latencies = sorted(ms for ms, _ in samples[label])
+        failed = sum(1 for _, status in samples[label] if status >= 400)
+        total += len(latencies)
+        errors += failed
+        endpoints[label] = {
+            "count": len(latencies),
+            "errors": failed,
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "max_ms": round(latencies[-1], 3),
+        }
+    return {
+        "totals": {"requests": total, "errors": errors, "throughput_rps": round(total / elapsed, 2)},
+        "endpoints": endpoints,
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def product_docs(count: int, rng: random.Random) -> List[dict]:
+    """Synthetic catalog shaped like ProductService.create_product output"""
+    from .models import Product
+    from .search import search_tokens
+    docs = []
+    for i in range(count):
+        product = Product(
+            barcode=f"LT{i:010d}",
+            name=f"{rng.choice(NAME_WORDS)} {i}",
+            category=rng.choice(["Aydınlatma", "Elektrik", "Sigortalar", "Kablolar"]),
+            brand=rng.choice(BRANDS),
+            # Deep enough that checkouts never run out during a run
+            stock=10_000_000,
+            min_stock=5,
+            buy_price=round(rng.uniform(5, 400), 2),
+            sell_price=round(rng.uniform(10, 600), 2),
+            tax_rate=rng.choice([1, 10, 20]),
+            catalog_version=1,
+        )
+        doc = product.dict()
+        doc["search_tokens"] = search_tokens(product.name, product.brand, product.barcode)
+        doc["is_low"] = False
+        docs.append(doc)
+    return docs
+
+async def connect_in_memory():
+    """Stand-in for database.connect_to_mongo backed by mongomock-motor"""
+    from . import database
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("--in-memory needs mongomock-motor (pip install mongomock-motor)")
+    database.db.client = AsyncMongoMockClient()
+    database.db.database = database.db.client[os.environ["DB_NAME"]]
+    database.db.supports_transactions = False
+    await database.create_indexes()
+
+async def login(client: ASGIClient, credentials: dict) -> str:
+    status, body = await client.request("POST", "/api/auth/login", json_body=credentials)
+    if status != 200:
+        raise SystemExit(f"Login as {credentials['username']} failed ({status}): {body[:200]!r}")
+    return orjson.loads(body)["access_token"]
+
+async def till(
+    index: int,
+    client: ASGIClient,
+    args,
+    products: List[dict],
+    tokens: Dict[str, str],
+    mix: Dict[str, int],
+    record_from: float,
+    deadline: float,
+    samples: Dict[str, List[Tuple[float, int]]]
+) -> None:
+    ctx = Context(client, random.Random(args.seed + index), products, tokens)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.perf_counter() < deadline:
+        scenario = SCENARIOS[ctx.rng.choices(names, weights)[0]]
+        started = time.perf_counter()
+        try:
+            label, status = await scenario(ctx)
+        except Exception as e:
+            logger.error(f"{scenario.__name__} raised {e!r}")
+            label, status = f"{scenario.__name__} (exception)", 599
+        if started >= record_from:
+            samples.setdefault(label, []).append(((time.perf_counter() - started) * 1000, status))
+
+async def run(args) -> Dict[str, Any]:
+    base_name = os.environ.get("DB_NAME", "elektrik_dukkani")
+    os.environ["DB_NAME"] = args.db_name or f"{base_name}_loadtest"
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+    from . import database, server
+    if args.in_memory:
+        server.connect_to_mongo = connect_in_memory
+    else:
+        probe = database.AsyncIOMotorClient(os.environ["MONGO_URL"])
+        existing = await probe[os.environ["DB_NAME"]].list_collection_names()
+        probe.close()
+        if existing:
+            raise SystemExit(f"Database {os.environ['DB_NAME']} is not empty; drop it or pass another --db-name")
+
+    app = server.app
+    client = ASGIClient(app)
+    await app.router.startup()
+    try:
+        rng = random.Random(args.seed)
+        docs = product_docs(args.products, rng)
+        await database.insert_many("products", docs)
+        products = [{k: doc[k] for k in ("id", "barcode", "name", "sell_price", "tax_rate")} for doc in docs]
+        tokens = {"admin": await login(client, ADMIN_LOGIN), "cashier": await login(client, CASHIER_LOGIN)}
+
+        mix = parse_mix(args.mix)
+        samples: Dict[str, List[Tuple[float, int]]] = {}
+        started = time.perf_counter()
+        record_from = started + args.warmup
+        deadline = record_from + args.duration
+        await asyncio.gather(*(
+            till(i, client, args, products, tokens, mix, record_from, deadline, samples)
+            for i in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - record_from
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "started_at": datetime.utcnow().isoformat(),
+                "duration_s": round(elapsed, 3),
+                "warmup_s": args.warmup,
+                "concurrency": args.concurrency,
+                "products": args.products,
+                "seed": args.seed,
+                "mix": mix,
+                "backend": "mongomock" if args.in_memory else "mongod",
+                "transactions": database.db.supports_transactions,
+                "python": platform.python_version(),
+            },
+        }
+        report.update(summarize(samples, elapsed))
+        return report
+    finally:
+        if not args.keep_db:
+            await database.db.client.drop_database(os.environ["DB_NAME"])
+        await app.router.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m backend.loadtest", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to measure (after warmup)")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds to run before recording")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent virtual tills")
+    parser.add_argument("--products", type=int, default=2000, help="Catalog size to seed")
+    parser.add_argument("--seed", type=int, default=42, help="RNG seed for a reproducible request sequence")
+    parser.add_argument("--mix", help=f"Scenario weights, e.g. scan=40,checkout=20 (default: {DEFAULT_MIX})")
+    parser.add_argument("--db-name", help="Database to create and drop (default: <DB_NAME>_loadtest)")
+    parser.add_argument("--keep-db", action="store_true", help="Do not drop the database afterwards")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock-motor instead of MONGO_URL")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+    sys.exit(1 if report["totals"]["errors"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Maintenance commands.
+
+Usage:
+    python -m backend.manage rebuild-rollups [--since YYYY-MM-DD]
+    python -m backend.manage backfill-search-tokens
+    python -m backend.manage migrate
+    python -m backend.manage check-indexes
+"""
+from dotenv import load_dotenv
+from pathlib import Path
+from datetime import datetime
+import argparse
+import asyncio
+import logging
+import sys
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from .database import connect_to_mongo, close_mongo_connection
+from .services import ProductService, SalesRollupService
+from .migrations import find_collection_scans
+
+logger = logging.getLogger(__name__)
+
+async def rebuild_rollups(args):
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    count = await SalesRollupService.rebuild(since)
+    print(f"Rebuilt sales rollups from {count} sales")
+
+async def backfill_search_tokens(args):
+    count = await ProductService.backfill_search_tokens()
+    print(f"Indexed {count} products for autocomplete")
+
+async def migrate(args):
+    # connect_to_mongo already applied pending migrations
+    print("Migrations are up to date")
+
+async def check_indexes(args):
+    problems = await find_collection_scans()
+    for problem in problems:
+        print(f"COLLSCAN {problem}")
+    if problems:
+        sys.exit(1)
+    print("Every registered query shape uses an index")
+
+COMMANDS = {
+    "rebuild-rollups": rebuild_rollups,
+    "backfill-search-tokens": backfill_search_tokens,
+    "migrate": migrate,
+    "check-indexes": check_indexes,
+}
+
+async def run(args):
+    await connect_to_mongo()
+    try:
+        await COMMANDS[args.command](args)
+    finally:
+        await close_mongo_connection()
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m backend.manage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = subparsers.add_parser("rebuild-rollups", help="Regenerate sales_rollups from raw sales")
+    rebuild.add_argument("--since", help="Only rebuild buckets from this day on (YYYY-MM-DD)")
+
+    subparsers.add_parser("backfill-search-tokens", help="Add autocomplete tokens to existing products")
+    subparsers.add_parser("migrate", help="Apply pending schema migrations")
+    subparsers.add_parser("check-indexes", help="Explain service queries and fail on any collection scan")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
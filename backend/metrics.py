@@ -0,0 +1,242 @@
+"""In-process request and MongoDB metrics, exported in Prometheus text format.
+
+``MetricsMiddleware`` times every request by route template (so
+``/api/products/{product_id}`` is one series, not one per product),
+counts status codes and tracks requests in flight. The database helpers
+report each round trip through ``db_call``/``timed_iter``; those are
+aggregated per collection and operation, and also per request, so the
+``http_request_db_operations`` histogram shows which endpoints make many
+round trips.
+
+Values live in the worker process: with several workers, scrape each one
+(or run one worker per port) rather than a shared load-balanced address.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+import bisect
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DB_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 40, 80, 160)
+
+# Requests that matched no route share one label, so scans cannot add series
+UNMATCHED_ROUTE = "unmatched"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {_number(value)}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(float(bound))}"'
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {count}"
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "Time until the response body was sent", ("method", "route")))
+http_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requests currently being served"))
+request_db_calls = registry.register(Histogram(
+    "http_request_db_operations", "MongoDB round trips made while serving one request",
+    ("method", "route"), DB_CALL_BUCKETS))
+request_db_time = registry.register(Histogram(
+    "http_request_db_seconds", "Time one request spent waiting on MongoDB",
+    ("method", "route"), LATENCY_BUCKETS))
+db_operations = registry.register(Counter(
+    "db_operations_total", "MongoDB operations by collection and operation", ("collection", "operation")))
+db_errors = registry.register(Counter(
+    "db_operation_errors_total", "MongoDB operations that raised", ("collection", "operation")))
+db_latency = registry.register(Histogram(
+    "db_operation_duration_seconds", "MongoDB operation latency",
+    ("collection", "operation"), DB_LATENCY_BUCKETS))
+
+class RequestStats:
+    __slots__ = ("calls", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+# Set by the middleware; database calls made while serving a request add to it
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_db_stats", default=None)
+
+def _record(collection: str, operation: str, elapsed: float, failed: bool, round_trips: int = 1) -> None:
+    db_operations.inc(collection, operation)
+    db_latency.observe(elapsed, collection, operation)
+    if failed:
+        db_errors.inc(collection, operation)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.calls += round_trips
+        stats.seconds += elapsed
+
+@contextmanager
+def db_call(collection: str, operation: str):
+    """Time one MongoDB round trip made by a database helper"""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _record(collection, operation, time.perf_counter() - started, failed)
+
+async def timed_iter(collection: str, operation: str, cursor, batch_size: int) -> AsyncIterator[dict]:
+    """Iterate a Motor cursor, counting only the time spent waiting on the server.
+
+    The cursor must have been opened with the same batch_size: documents
+    are then read one server batch per ``to_list`` call, and each call after
+    the first (a getMore) counts as a further round trip of the request.
+    """
+    elapsed = 0.0
+    round_trips = 0
+    failed = False
+    try:
+        while True:
+            round_trips += 1
+            started = time.perf_counter()
+            try:
+                batch = await cursor.to_list(batch_size)
+            finally:
+                elapsed += time.perf_counter() - started
+            for document in batch:
+                yield document
+            if len(batch) < batch_size or not cursor.alive:
+                break
+    except GeneratorExit:
+        # The consumer stopped early (e.g. a client left mid-export)
+        raise
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _record(collection, operation, elapsed, failed, round_trips)
+
+@contextmanager
+def count_db_calls():
+    """Collect the MongoDB round trips made inside the block into a RequestStats"""
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and DB use per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or UNMATCHED_ROUTE
+            method = scope["method"]
+            http_requests.inc(method, path, str(status_code))
+            http_latency.observe(elapsed, method, path)
+            request_db_calls.observe(stats.calls, method, path)
+            request_db_time.observe(stats.seconds, method, path)
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,273 @@
+"""Versioned schema migrations (indexes and data backfills).
+
+Each migration runs once per database and is recorded in the
+``schema_migrations`` collection. Append new migrations with the next
+version number; never edit one that has shipped.
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional
+import logging
+import os
+
+from pymongo import ASCENDING as ASC, DESCENDING as DESC
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from .database import get_database
+
+logger = logging.getLogger(__name__)
+
+# A "running" claim older than this is assumed to belong to a crashed worker
+STALE_CLAIM = timedelta(minutes=30)
+
+async def _baseline_indexes(database):
+    # Users collection indexes
+    await database.users.create_index("username", unique=True)
+    await database.users.create_index("email")
+    await database.users.create_index("role")
+
+    # Products collection indexes
+    await database.products.create_index("barcode", unique=True)
+    await database.products.create_index("id", unique=True)
+    await database.products.create_index("name")
+    await database.products.create_index("category")
+    await database.products.create_index("brand")
+    await database.products.create_index("stock")
+    await database.products.create_index("search_tokens")
+
+    # Stock movements collection indexes
+    await database.stock_movements.create_index("product_id")
+    await database.stock_movements.create_index("type")
+    await database.stock_movements.create_index("created_at")
+    await database.stock_movements.create_index("created_by")
+
+    # Keyset pagination: newest first with id as tie-breaker
+    await database.stock_movements.create_index([("created_at", DESC), ("id", DESC)])
+    await database.stock_movements.create_index([("product_id", ASC), ("created_at", DESC), ("id", DESC)])
+
+    # Sales collection indexes
+    await database.sales.create_index("cashier_id")
+    await database.sales.create_index("created_at")
+    await database.sales.create_index("total")
+    await database.sales.create_index([("created_at", DESC), ("id", DESC)])
+    await database.sales.create_index([("cashier_id", ASC), ("created_at", DESC), ("id", DESC)])
+
+    # Sales rollups: one document per day/hour bucket, _id is the bucket key
+    await database.sales_rollups.create_index([("granularity", ASC), ("period", ASC)])
+
+    # Finance collection indexes
+    await database.finance.create_index([("date", DESC), ("id", DESC)])
+    await database.finance.create_index([("type", ASC), ("date", DESC), ("id", DESC)])
+
+async def _id_and_compound_indexes(database):
+    # Every find_one({"id": ...}) in services.py
+    await database.users.create_index("id", unique=True)
+    await database.sales.create_index("id", unique=True)
+    await database.stock_movements.create_index("id", unique=True)
+    await database.finance.create_index("id", unique=True)
+    await database.report_jobs.create_index("id", unique=True)
+
+    # Sorted listings
+    await database.users.create_index([("created_at", DESC)])
+    await database.products.create_index([("updated_at", DESC)])
+    await database.products.create_index([("category", ASC), ("updated_at", DESC)])
+    await database.stock_movements.create_index([("type", ASC), ("created_at", DESC), ("id", DESC)])
+
+    # Report job de-duplication
+    await database.report_jobs.create_index([("artifact_key", ASC), ("status", ASC)])
+
+async def _backfill_search_tokens(database):
+    from .services import ProductService
+    count = await ProductService.backfill_search_tokens()
+    logger.info(f"Backfilled search tokens for {count} products")
+
+async def _rebuild_sales_rollups(database):
+    from .services import SalesRollupService
+    count = await SalesRollupService.rebuild()
+    logger.info(f"Rebuilt sales rollups from {count} sales")
+
+async def _low_stock_flag(database):
+    # Denormalized flag so low-stock listings and counts are index seeks
+    await database.products.update_many({}, [{"$set": {"is_low": {"$lte": ["$stock", "$min_stock"]}}}])
+    await database.products.create_index(
+        [("is_low", ASC), ("updated_at", DESC)],
+        partialFilterExpression={"is_low": True}
+    )
+
+async def _sale_client_ids(database):
+    # Offline tills tag each queued sale; synced ids must stay unique.
+    # Partial on $type so regular sales (client_id null) are not indexed.
+    await database.sales.create_index(
+        "client_id",
+        unique=True,
+        partialFilterExpression={"client_id": {"$type": "string"}}
+    )
+
+async def _idempotency_keys(database):
+    # Keys lookup by _id; this only expires them
+    ttl = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    await database.idempotency_keys.create_index("created_at", expireAfterSeconds=ttl)
+
+async def _catalog_versions(database):
+    # Existing products predate the counter; version 1 puts them in the first delta
+    await database.products.update_many({"catalog_version": {"$exists": False}}, {"$set": {"catalog_version": 1}})
+    await database.counters.update_one({"_id": "catalog"}, {"$max": {"value": 1}}, upsert=True)
+    await database.products.create_index("catalog_version")
+    await database.product_tombstones.create_index("id", unique=True)
+    await database.product_tombstones.create_index("catalog_version")
+
+async def _events_ttl(database):
+    # Only used with EVENTS_CHANGE_STREAM; workers read events as they are inserted
+    await database.events.create_index("created_at", expireAfterSeconds=3600)
+
+async def _autocomplete_index(database):
+    # Token equality plus a name sort, so autocomplete reads its candidate
+    # window in name order straight off the index
+    await database.products.create_index([("search_tokens", ASC), ("name", ASC)])
+
+async def _sale_client_ids_per_cashier(database):
+    # Tills number their offline queues independently, so the same client_id
+    # from two cashiers is two different sales
+    try:
+        await database.sales.drop_index("client_id_1")
+    except OperationFailure:
+        pass
+    await database.sales.create_index(
+        [("cashier_id", ASC), ("client_id", ASC)],
+        unique=True,
+        partialFilterExpression={"client_id": {"$type": "string"}}
+    )
+
+async def _idempotency_ids(database):
+    # A record created under an Idempotency-Key carries its reservation id;
+    # unique so a second run of the same request cannot commit
+    for collection in (database.sales, database.stock_movements):
+        await collection.create_index(
+            "idempotency_id",
+            unique=True,
+            partialFilterExpression={"idempotency_id": {"$type": "string"}}
+        )
+
+MIGRATIONS = [
+    (1, "Baseline indexes", _baseline_indexes),
+    (2, "Indexes for id lookups and compound query shapes", _id_and_compound_indexes),
+    (3, "Backfill product search tokens", _backfill_search_tokens),
+    (4, "Rebuild sales rollups from raw sales", _rebuild_sales_rollups),
+    (5, "Backfill and index the low-stock flag", _low_stock_flag),
+    (6, "Unique index on offline sale client ids", _sale_client_ids),
+    (7, "Expire idempotency keys with a TTL index", _idempotency_keys),
+    (8, "Catalog versions and product tombstones for delta sync", _catalog_versions),
+    (9, "Expire fanned-out events", _events_ttl),
+    (10, "Compound index for name-ordered autocomplete", _autocomplete_index),
+    (11, "Scope offline sale client ids to the cashier", _sale_client_ids_per_cashier),
+    (12, "Unique idempotency ids on sales and stock movements", _idempotency_ids),
+]
+
+async def _claim(ledger, version: int, description: str) -> bool:
+    claim = {"_id": version, "description": description, "status": "running", "started_at": datetime.utcnow()}
+    try:
+        await ledger.insert_one(claim)
+        return True
+    except DuplicateKeyError:
+        pass
+    stale = await ledger.delete_one({"_id": version, "status": "running", "started_at": {"$lt": datetime.utcnow() - STALE_CLAIM}})
+    if not stale.deleted_count:
+        return False
+    try:
+        await ledger.insert_one(claim)
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def run_migrations() -> List[int]:
+    """Apply pending migrations in order; returns the versions applied here.
+
+    A version is claimed by inserting its ledger entry first, so concurrent
+    workers starting together never run the same migration twice.
+    """
+    database = await get_database()
+    ledger = database.schema_migrations
+    done = {doc["_id"] async for doc in ledger.find({"status": "done"}, {"_id": 1})}
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        if not await _claim(ledger, version, description):
+            logger.info(f"Migration {version} is being applied by another worker")
+            break
+        try:
+            await migrate(database)
+        except Exception as e:
+            logger.error(f"Migration {version} ({description}) failed: {e}")
+            await ledger.delete_one({"_id": version})
+            break
+        await ledger.update_one({"_id": version}, {"$set": {"status": "done", "applied_at": datetime.utcnow()}})
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+# Representative queries issued by services.py: (collection, filter, sort).
+# `python -m backend.manage check-indexes` explains each one against a live
+# database and fails on a collection scan. tests/test_query_plans.py checks
+# the filters the services actually build, so a missing shape shows up there.
+QUERY_SHAPES = [
+    ("users", {"username": "x", "active": True}, None),
+    ("users", {"id": "x"}, None),
+    ("users", {"role": "admin"}, None),
+    ("users", {}, {"created_at": -1}),
+    ("products", {"id": "x"}, None),
+    ("products", {"barcode": "x"}, None),
+    ("products", {"id": {"$in": ["x", "y"]}}, None),
+    ("products", {"search_tokens": {"$all": ["x"]}}, {"name": 1}),
+    ("products", {}, {"updated_at": -1}),
+    ("products", {"category": "x"}, {"updated_at": -1}),
+    ("products", {"is_low": True}, {"updated_at": -1}),
+    ("products", {"catalog_version": {"$gt": 1}}, {"catalog_version": 1}),
+    ("product_tombstones", {"catalog_version": {"$gt": 1}}, {"catalog_version": 1}),
+    ("stock_movements", {}, {"created_at": -1, "id": -1}),
+    ("stock_movements", {"product_id": "x"}, {"created_at": -1, "id": -1}),
+    ("stock_movements", {"type": "in"}, {"created_at": -1, "id": -1}),
+    ("stock_movements", {"created_at": {"$gte": datetime(2024, 1, 1)}}, {"created_at": 1, "id": 1}),
+    ("sales", {"id": "x"}, None),
+    ("sales", {"idempotency_id": "x"}, None),
+    ("stock_movements", {"idempotency_id": "x"}, None),
+    ("sales", {}, {"created_at": -1, "id": -1}),
+    ("sales", {"created_at": {"$gte": datetime(2024, 1, 1), "$lte": datetime(2024, 2, 1)}}, {"created_at": -1, "id": -1}),
+    ("sales", {"cashier_id": "x"}, {"created_at": -1, "id": -1}),
+    ("sales", {"cashier_id": "x", "client_id": {"$type": "string", "$in": ["x", "y"]}}, None),
+    ("sales_rollups", {"_id": "day:2024-01-01"}, None),
+    ("sales_rollups", {"granularity": "hour", "period": {"$gte": datetime(2024, 1, 1)}}, {"period": 1}),
+    ("finance", {"id": "x"}, None),
+    ("finance", {}, {"date": -1, "id": -1}),
+    ("finance", {"type": "income"}, {"date": -1, "id": -1}),
+    ("finance", {"date": {"$gte": datetime(2024, 1, 1)}}, {"date": 1, "id": 1}),
+    ("report_jobs", {"id": "x"}, None),
+    ("report_jobs", {"artifact_key": "x", "$or": [
+        {"status": "pending", "created_at": {"$gte": datetime(2024, 1, 1)}},
+        {"status": "running", "started_at": {"$gte": datetime(2024, 1, 1)}},
+    ]}, None),
+]
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+async def scans_collection(collection_name: str, filter_dict: dict, sort: Optional[dict] = None) -> bool:
+    """Whether the winning plan for a find scans the whole collection"""
+    database = await get_database()
+    cursor = database[collection_name].find(filter_dict).limit(1)
+    if sort:
+        cursor = cursor.sort(list(sort.items()))
+    explain = await cursor.explain()
+    return "COLLSCAN" in set(_stages(explain["queryPlanner"]["winningPlan"]))
+
+async def find_collection_scans() -> List[str]:
+    """Explain every registered query shape and describe those that scan a collection"""
+    problems = []
+    for collection_name, filter_dict, sort in QUERY_SHAPES:
+        if await scans_collection(collection_name, filter_dict, sort):
+            problems.append(f"{collection_name}: filter={filter_dict} sort={sort}")
+    return problems
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, Field, EmailStr, model_validator
+from typing import Optional, List, Union
 from datetime import datetime
 from enum import Enum
 import uuid
@@ -21,6 +21,25 @@ class FinanceType(str, Enum):
     income = "income"
     expense = "expense"
 
+class SaleSyncStatus(str, Enum):
+    accepted = "accepted"
+    insufficient_stock = "insufficient_stock"
+    duplicate = "duplicate"
+    invalid = "invalid"
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+class ReportType(str, Enum):
+    irsaliye = "irsaliye"
+
+class ReportJobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
 # Base Models
 class BaseDBModel(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -91,6 +110,38 @@ class ProductUpdate(BaseModel):
 
 class Product(ProductBase, BaseDBModel):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    catalog_version: int = 0
+
+class CashierProduct(BaseDBModel):
+    """Product as listed on till screens, without cost price or supplier"""
+    barcode: str
+    name: str
+    category: str
+    brand: str
+    stock: int
+    min_stock: int
+    sell_price: float
+    tax_rate: int
+    updated_at: datetime
+    catalog_version: int = 0
+
+class CatalogDelta(BaseModel):
+    """Products changed and ids deleted since a catalog version"""
+    version: int
+    products: List[Union[Product, CashierProduct]]
+    deleted: List[str]
+
+class ProductImportError(BaseModel):
+    row: int
+    barcode: Optional[str] = None
+    errors: List[str]
+
+class ProductImportResult(BaseModel):
+    total_rows: int = 0
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[ProductImportError] = []
 
 # Stock Movement Models
 class StockMovementBase(BaseModel):
@@ -107,11 +158,30 @@ class StockMovementCreate(StockMovementBase):
 class StockMovement(StockMovementBase, BaseDBModel):
     created_by: str
     total_price: Optional[float] = None
+    receipt_id: Optional[str] = None
     
-    def __init__(self, **data):
-        super().__init__(**data)
+    @model_validator(mode="after")
+    def compute_total_price(self):
         if self.unit_price:
             self.total_price = self.unit_price * self.quantity
+        return self
+
+# Goods Receipt Models (multi-line stock-in)
+class GoodsReceiptLine(BaseModel):
+    product_id: str
+    quantity: int = Field(..., gt=0)
+    unit_price: Optional[float] = Field(None, ge=0)
+
+class GoodsReceiptCreate(BaseModel):
+    supplier: Optional[str] = Field(None, max_length=200)
+    note: Optional[str] = Field(None, max_length=500)
+    lines: List[GoodsReceiptLine] = Field(..., min_length=1, max_length=1000)
+
+class GoodsReceipt(BaseDBModel):
+    supplier: Optional[str] = None
+    note: Optional[str] = None
+    created_by: str
+    movements: List[StockMovement]
 
 # Sale Models
 class SaleItemBase(BaseModel):
@@ -140,6 +210,35 @@ class Sale(BaseDBModel):
     tax_amount: float
     total: float
     payment_method: Optional[PaymentMethod] = None
+    client_id: Optional[str] = None
+
+class SaleSummary(BaseDBModel):
+    """Sale totals without line items"""
+    cashier_id: str
+    subtotal: float
+    tax_amount: float
+    total: float
+    payment_method: Optional[PaymentMethod] = None
+
+# Offline sale sync models
+class QueuedSale(SaleBase):
+    client_id: str = Field(..., min_length=1, max_length=100)
+    created_at: Optional[datetime] = None
+
+class SaleSyncRequest(BaseModel):
+    sales: List[QueuedSale] = Field(..., min_length=1, max_length=1000)
+
+class SaleSyncResult(BaseModel):
+    client_id: str
+    status: SaleSyncStatus
+    sale_id: Optional[str] = None
+    error: Optional[str] = None
+
+class SaleSyncResponse(BaseModel):
+    accepted: int = 0
+    rejected: int = 0
+    duplicates: int = 0
+    results: List[SaleSyncResult] = []
 
 # Dashboard Models
 class DashboardStats(BaseModel):
@@ -175,6 +274,24 @@ class StockReportItem(BaseModel):
     movements_count: int
     last_movement: Optional[datetime] = None
 
+# Report Job Models
+class ReportJobCreate(BaseModel):
+    type: ReportType = ReportType.irsaliye
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+
+class ReportJob(BaseDBModel):
+    type: ReportType
+    start_date: datetime
+    end_date: datetime
+    cashier_id: Optional[str] = None
+    status: ReportJobStatus = ReportJobStatus.pending
+    artifact_key: str
+    error: Optional[str] = None
+    created_by: str
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Response Models
 class ApiResponse(BaseModel):
     success: bool
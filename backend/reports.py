@@ -0,0 +1,453 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import time
+import logging
+
+from .database import iter_aggregate, aggregate, find_one, insert_one, update_one, update_many
+from .models import ReportJob, ReportJobCreate, ReportJobStatus, ReportType, User, UserRole
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched and drawn per chunk
+RENDER_CHUNK_SIZE = 500
+
+# Finished artifacts, keyed by report type, period, scope and data version
+REPORTS_DIR = Path(os.getenv("REPORTS_DIR", Path(__file__).parent / "report_cache"))
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+# Artifacts rendered while their period was still open are deleted after
+# this long; once a period has closed its artifact is final and kept
+REPORT_ARTIFACT_TTL = float(os.getenv("REPORT_ARTIFACT_TTL", str(7 * 24 * 3600)))
+# A job pending or running for longer than this belongs to a dead process
+REPORT_JOB_TIMEOUT = timedelta(seconds=int(os.getenv("REPORT_JOB_TIMEOUT", "900")))
+
+# Period end as written into artifact keys
+PERIOD_END_FORMAT = "%Y%m%dT%H%M%S"
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Running job tasks by job id; the event loop only keeps weak references to them
+_tasks: Dict[str, asyncio.Task] = {}
+
+def fmt_tr(amount: float) -> str:
+    try:
+        return f"{amount:,.2f}"
+    except Exception:
+        return str(round(amount, 2))
+
+def payment_label(method: Optional[str]) -> str:
+    if method == "cash":
+        return "Nakit"
+    if method == "card":
+        return "Kredi Kartı"
+    return "-"
+
+def default_period(start_date: Optional[datetime], end_date: Optional[datetime]) -> Tuple[datetime, datetime]:
+    """Fill in a missing range with the current month"""
+    now = datetime.utcnow()
+    if not start_date:
+        start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if not end_date:
+        # End of month
+        if start_date.month == 12:
+            end_date = start_date.replace(year=start_date.year + 1, month=1)
+        else:
+            end_date = start_date.replace(month=start_date.month + 1)
+        end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start_date, end_date
+
+def irsaliye_pipeline(start_date: datetime, end_date: datetime, cashier_id: Optional[str] = None) -> list:
+    """Projected sales query for the İrsaliye report: one small row per sale"""
+    match: Dict[str, Any] = {"created_at": {"$gte": start_date, "$lte": end_date}}
+    if cashier_id:
+        match["cashier_id"] = cashier_id
+    return [
+        {"$match": match},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "created_at": 1,
+            "payment_method": 1,
+            "subtotal": 1,
+            "tax_amount": 1,
+            "total": 1,
+            "item_count": {"$sum": "$items.quantity"},
+        }},
+    ]
+
+class IrsaliyeRenderer:
+    """Draws the İrsaliye table page by page straight onto a reportlab canvas.
+
+    Rows are written as they arrive and only running totals are kept, so
+    the number of sales does not change how much row data is held.
+    """
+
+    headers = ["Tarih", "Satış No", "Ödeme", "Ürün Adedi", "Ara Toplam", "KDV", "Toplam"]
+    # Column widths in mm; numeric columns from "Ürün Adedi" on are right-aligned
+    widths_mm = [32, 24, 26, 22, 26, 24, 26]
+    first_numeric = 3
+    row_height_mm = 5.5
+
+    def __init__(self, path: str, start_date: datetime, end_date: datetime):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.units import mm
+        from reportlab.pdfgen import canvas
+
+        self.mm = mm
+        self.page_width, self.page_height = A4
+        self.canvas = canvas.Canvas(path, pagesize=A4)
+        self.left = 15 * mm
+        self.bottom = 12 * mm
+        self.top = self.page_height - 12 * mm
+        self.col_x = [self.left]
+        for w in self.widths_mm:
+            self.col_x.append(self.col_x[-1] + w * mm)
+        self.company_name = os.getenv("COMPANY_NAME", "Malatya Avize Aydınlatma")
+        self.company_address = os.getenv("COMPANY_ADDRESS", "Malatya, Türkiye")
+        self.period_text = f"Dönem: {start_date.strftime('%d.%m.%Y')} - {(end_date - timedelta(seconds=1)).strftime('%d.%m.%Y')}"
+        self.total_sub = 0.0
+        self.total_tax = 0.0
+        self.total_sum = 0.0
+        self.row_count = 0
+        self._start_page(first=True)
+
+    def _start_page(self, first: bool = False):
+        c = self.canvas
+        y = self.top
+        if first:
+            c.setFont("Helvetica-Bold", 16)
+            c.drawCentredString(self.page_width / 2, y - 16, self.company_name)
+            c.setFont("Helvetica", 9)
+            c.drawString(self.left, y - 32, self.company_address)
+            c.setFont("Helvetica-Bold", 12)
+            c.drawString(self.left, y - 50, "Sevk İrsaliyesi (Aylık Rapor)")
+            c.setFont("Helvetica", 9)
+            c.drawString(self.left, y - 64, self.period_text)
+            y -= 76
+        self._y = y
+        self._draw_row(self.headers, header=True)
+
+    def _draw_row(self, cells: List[Any], header: bool = False, bold: bool = False):
+        c = self.canvas
+        h = self.row_height_mm * self.mm
+        if not header and self._y - h < self.bottom:
+            c.showPage()
+            self._start_page()
+        y = self._y - h
+        if header:
+            c.setFillColorRGB(0.83, 0.83, 0.83)
+            c.rect(self.left, y, self.col_x[-1] - self.left, h, stroke=0, fill=1)
+            c.setFillColorRGB(0, 0, 0)
+        c.setFont("Helvetica-Bold" if header or bold else "Helvetica", 8)
+        c.setStrokeColorRGB(0.5, 0.5, 0.5)
+        c.setLineWidth(0.25)
+        c.rect(self.left, y, self.col_x[-1] - self.left, h, stroke=1, fill=0)
+        for i, value in enumerate(cells):
+            text = str(value)
+            if i:
+                c.line(self.col_x[i], y, self.col_x[i], y + h)
+            if not header and i >= self.first_numeric:
+                c.drawRightString(self.col_x[i + 1] - 2, y + 4.5, text)
+            else:
+                c.drawString(self.col_x[i] + 2, y + 4.5, text)
+        self._y = y
+
+    def add_rows(self, rows: Iterable[dict]):
+        """Render a chunk of projected sale rows and update running totals"""
+        for s in rows:
+            subtotal = s.get("subtotal") or 0.0
+            tax_amount = s.get("tax_amount") or 0.0
+            total = s.get("total") or 0.0
+            self._draw_row([
+                s["created_at"].strftime('%d.%m.%Y %H:%M'),
+                str(s.get("id", ""))[-8:],
+                payment_label(s.get("payment_method")),
+                s.get("item_count") or 0,
+                fmt_tr(subtotal),
+                fmt_tr(tax_amount),
+                fmt_tr(total),
+            ])
+            self.total_sub += subtotal
+            self.total_tax += tax_amount
+            self.total_sum += total
+            self.row_count += 1
+
+    def finish(self):
+        """Draw the totals row and footnote, then write the file"""
+        self._draw_row(["", "TOPLAMLAR", "", "", fmt_tr(self.total_sub), fmt_tr(self.total_tax), fmt_tr(self.total_sum)], bold=True)
+        c = self.canvas
+        if self._y - 20 < self.bottom:
+            c.showPage()
+            self._y = self.top
+        c.setFont("Helvetica-Oblique", 8)
+        c.drawString(self.left, self._y - 16, "Not: Bu çıktı sevk irsaliyesi formatında aylık satış özetidir.")
+        c.save()
+
+def render_irsaliye_file(mongo_url: str, db_name: str, start_date: datetime, end_date: datetime, cashier_id: Optional[str], path: str) -> int:
+    """Render the İrsaliye report to path with a synchronous client.
+
+    Runs inside a worker process, so it opens its own connection instead of
+    sharing the server's Motor client. Returns the number of sales rendered.
+    """
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_url)
+    try:
+        cursor = client[db_name].sales.aggregate(irsaliye_pipeline(start_date, end_date, cashier_id), batchSize=RENDER_CHUNK_SIZE)
+        renderer = IrsaliyeRenderer(path, start_date, end_date)
+        chunk: List[dict] = []
+        for row in cursor:
+            chunk.append(row)
+            if len(chunk) >= RENDER_CHUNK_SIZE:
+                renderer.add_rows(chunk)
+                chunk = []
+        renderer.add_rows(chunk)
+        renderer.finish()
+        return renderer.row_count
+    finally:
+        client.close()
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: forking a process that runs an event loop and Motor threads is unsafe
+        _executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+class ReportJobService:
+    @staticmethod
+    async def data_version(start_date: datetime, end_date: datetime, cashier_id: Optional[str] = None) -> str:
+        """Cheap fingerprint of the sales a report covers"""
+        match: Dict[str, Any] = {"created_at": {"$gte": start_date, "$lte": end_date}}
+        if cashier_id:
+            match["cashier_id"] = cashier_id
+        result = await aggregate("sales", [
+            {"$match": match},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "last": {"$max": "$created_at"}, "total": {"$sum": "$total"}}},
+        ])
+        if not result:
+            return "empty"
+        r = result[0]
+        return f"{r['count']}:{r['last'].isoformat()}:{r['total']:.2f}"
+
+    @staticmethod
+    def artifact_key(report_type: ReportType, start_date: datetime, end_date: datetime, cashier_id: Optional[str], version: str) -> str:
+        """``<report>-<period end>-<data version>``; the report part is shared by every version of the same report"""
+        raw = "|".join([report_type.value, start_date.isoformat(), end_date.isoformat(), cashier_id or "all"])
+        report = hashlib.sha256(raw.encode()).hexdigest()[:16]
+        return f"{report}-{end_date.strftime(PERIOD_END_FORMAT)}-{hashlib.sha256(version.encode()).hexdigest()[:16]}"
+
+    @staticmethod
+    def artifact_path(key: str) -> Path:
+        return REPORTS_DIR / f"{key}.pdf"
+
+    @staticmethod
+    def open_artifact(key: str) -> Optional[BinaryIO]:
+        """Open a cached artifact for sending, or None if there is none.
+
+        Responses stream from the open handle, so a newer version replacing
+        (and unlinking) this one mid-download does not cut the download off.
+        """
+        try:
+            return open(ReportJobService.artifact_path(key), "rb")
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def store_artifact(rendered: str, key: str) -> Path:
+        """Swap a rendered file into the cache, replacing older versions of the same report.
+
+        rendered must be inside REPORTS_DIR: os.replace is atomic there, so
+        readers see either no artifact or a complete one. While a period is
+        open every sale changes its data version, so without the cleanup
+        each request would leave another PDF behind.
+        """
+        path = ReportJobService.artifact_path(key)
+        REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        os.replace(rendered, path)
+        report = key.split("-", 1)[0]
+        for other in REPORTS_DIR.glob(f"{report}-*.pdf"):
+            if other != path:
+                other.unlink(missing_ok=True)
+        ReportJobService.prune_artifacts()
+        return path
+
+    @staticmethod
+    def prune_artifacts(max_age: float = REPORT_ARTIFACT_TTL) -> int:
+        """Delete open-period artifacts and leftover temp files older than max_age seconds.
+
+        An artifact rendered after its period ended is final and never
+        pruned, so a closed period is rendered only once. Returns how many
+        files were removed.
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        for path in [*REPORTS_DIR.glob("*.pdf"), *REPORTS_DIR.glob("*.tmp")]:
+            try:
+                modified = path.stat().st_mtime
+                if modified >= cutoff:
+                    continue
+                if path.suffix == ".pdf" and ReportJobService._rendered_after_close(path.stem, modified):
+                    continue
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    @staticmethod
+    def _rendered_after_close(key: str, modified: float) -> bool:
+        parts = key.split("-")
+        if len(parts) != 3:
+            return False
+        try:
+            period_end = datetime.strptime(parts[1], PERIOD_END_FORMAT)
+        except ValueError:
+            return False
+        return datetime.utcfromtimestamp(modified) >= period_end
+
+    @staticmethod
+    def _live_filter(cutoff: datetime) -> dict:
+        """Jobs still pending or running within the timeout"""
+        return {"$or": [
+            {"status": ReportJobStatus.pending.value, "created_at": {"$gte": cutoff}},
+            {"status": ReportJobStatus.running.value, "started_at": {"$gte": cutoff}},
+        ]}
+
+    @staticmethod
+    async def expire_stale_jobs(filter_dict: dict) -> int:
+        """Fail matching jobs whose worker died (pending or running past REPORT_JOB_TIMEOUT)"""
+        now = datetime.utcnow()
+        cutoff = now - REPORT_JOB_TIMEOUT
+        stale = {"$and": [filter_dict, {"$or": [
+            {"status": ReportJobStatus.pending.value, "created_at": {"$lt": cutoff}},
+            {"status": ReportJobStatus.running.value, "started_at": {"$lt": cutoff}},
+        ]}]}
+        return await update_many("report_jobs", stale, {
+            "status": ReportJobStatus.failed.value, "error": "Timed out", "finished_at": now
+        })
+
+    @staticmethod
+    async def resolve(report_type: ReportType, start_date: Optional[datetime], end_date: Optional[datetime], current_user: User) -> Tuple[datetime, datetime, Optional[str], str]:
+        """Normalize the request and compute the artifact key for it"""
+        start_date, end_date = default_period(start_date, end_date)
+        # Cashiers only ever see their own sales
+        cashier_id = None if current_user.role == UserRole.admin else current_user.id
+        version = await ReportJobService.data_version(start_date, end_date, cashier_id)
+        key = ReportJobService.artifact_key(report_type, start_date, end_date, cashier_id, version)
+        return start_date, end_date, cashier_id, key
+
+    @staticmethod
+    async def submit(data: ReportJobCreate, current_user: User) -> ReportJob:
+        """Queue a report, reusing a cached artifact or an identical job in flight"""
+        start_date, end_date, cashier_id, key = await ReportJobService.resolve(data.type, data.start_date, data.end_date, current_user)
+        return await ReportJobService._submit_resolved(data.type, start_date, end_date, cashier_id, key, current_user)
+
+    @staticmethod
+    async def _submit_resolved(report_type: ReportType, start_date: datetime, end_date: datetime, cashier_id: Optional[str], key: str, current_user: User) -> ReportJob:
+        if ReportJobService.artifact_path(key).exists():
+            job = ReportJob(
+                type=report_type, start_date=start_date, end_date=end_date, cashier_id=cashier_id,
+                artifact_key=key, created_by=current_user.id,
+                status=ReportJobStatus.done, finished_at=datetime.utcnow()
+            )
+            await insert_one("report_jobs", job.dict())
+            return job
+
+        cutoff = datetime.utcnow() - REPORT_JOB_TIMEOUT
+        in_flight = await find_one("report_jobs", {"artifact_key": key, **ReportJobService._live_filter(cutoff)})
+        if in_flight:
+            return ReportJob(**in_flight)
+        await ReportJobService.expire_stale_jobs({"artifact_key": key})
+
+        job = ReportJob(
+            type=report_type, start_date=start_date, end_date=end_date, cashier_id=cashier_id,
+            artifact_key=key, created_by=current_user.id
+        )
+        await insert_one("report_jobs", job.dict())
+        task = asyncio.create_task(ReportJobService._run(job))
+        _tasks[job.id] = task
+        task.add_done_callback(lambda _: _tasks.pop(job.id, None))
+        return job
+
+    @staticmethod
+    async def wait(job: ReportJob, poll: float = 0.25) -> ReportJob:
+        """Wait until a job is done or failed; jobs run by other workers are polled"""
+        task = _tasks.get(job.id)
+        if task is not None:
+            # A client hanging up must not cancel a render others may share
+            await asyncio.shield(task)
+        deadline = time.monotonic() + REPORT_JOB_TIMEOUT.total_seconds()
+        while True:
+            data = await find_one("report_jobs", {"id": job.id})
+            if data is None:
+                raise RuntimeError(f"Report job {job.id} disappeared")
+            job = ReportJob(**data)
+            if job.status in (ReportJobStatus.done, ReportJobStatus.failed):
+                return job
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Report job {job.id} did not finish")
+            await asyncio.sleep(poll)
+
+    @staticmethod
+    async def _run(job: ReportJob):
+        await update_one("report_jobs", {"id": job.id}, {"status": ReportJobStatus.running.value, "started_at": datetime.utcnow()})
+        # Rendered next to the cache so store_artifact can swap it in atomically
+        tmp_path = REPORTS_DIR / f"{job.artifact_key}.{job.id}.tmp"
+        try:
+            REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                get_executor(), render_irsaliye_file,
+                os.environ["MONGO_URL"], os.environ["DB_NAME"],
+                job.start_date, job.end_date, job.cashier_id, str(tmp_path)
+            )
+            ReportJobService.store_artifact(str(tmp_path), job.artifact_key)
+            await update_one("report_jobs", {"id": job.id}, {"status": ReportJobStatus.done.value, "finished_at": datetime.utcnow()})
+        except Exception as e:
+            logger.error(f"Report job {job.id} failed: {e}")
+            if tmp_path.exists():
+                tmp_path.unlink()
+            await update_one("report_jobs", {"id": job.id}, {"status": ReportJobStatus.failed.value, "error": str(e), "finished_at": datetime.utcnow()})
+
+    @staticmethod
+    async def get_job(job_id: str, current_user: User) -> Optional[ReportJob]:
+        """Get a job; users other than admins only see their own"""
+        filter_dict = {"id": job_id}
+        if current_user.role != UserRole.admin:
+            filter_dict["created_by"] = current_user.id
+        await ReportJobService.expire_stale_jobs(filter_dict)
+        data = await find_one("report_jobs", filter_dict)
+        return ReportJob(**data) if data else None
+
+    @staticmethod
+    async def render_now(start_date: Optional[datetime], end_date: Optional[datetime], current_user: User) -> Tuple[BinaryIO, datetime]:
+        """Open the cached artifact for the period, waiting for a render job if missing.
+
+        Rendering goes through the same worker processes as queued jobs,
+        so a synchronous download never draws on the event loop's process
+        and concurrent downloads of the same data share one job.
+        """
+        start_date, end_date, cashier_id, key = await ReportJobService.resolve(ReportType.irsaliye, start_date, end_date, current_user)
+        handle = ReportJobService.open_artifact(key)
+        if handle is not None:
+            return handle, start_date
+        job = await ReportJobService._submit_resolved(ReportType.irsaliye, start_date, end_date, cashier_id, key, current_user)
+        job = await ReportJobService.wait(job)
+        if job.status != ReportJobStatus.done:
+            raise RuntimeError(job.error or "Report failed")
+        handle = ReportJobService.open_artifact(key)
+        if handle is None:
+            raise RuntimeError("Report artifact was removed before it could be sent")
+        return handle, start_date
@@ -0,0 +1,57 @@
+from typing import Iterable, List
+import re
+import unicodedata
+
+# Turkish-aware case folding: İ/I/ı/i all fold to "i", and the other
+# Turkish letters fold to their ASCII base so "şalter" matches "SALTER".
+_TR_FOLD = str.maketrans({
+    "İ": "i", "I": "i", "ı": "i",
+    "Ş": "s", "ş": "s",
+    "Ğ": "g", "ğ": "g",
+    "Ü": "u", "ü": "u",
+    "Ö": "o", "ö": "o",
+    "Ç": "c", "ç": "c",
+})
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Longest indexed prefix; longer query terms are truncated to match
+MAX_PREFIX = 15
+
+def fold(text: str) -> str:
+    """Lowercase text the way product search compares it"""
+    text = unicodedata.normalize("NFKD", (text or "").translate(_TR_FOLD))
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+def words(text: str) -> List[str]:
+    return _WORD_RE.findall(fold(text))
+
+def prefixes(word: str) -> Iterable[str]:
+    return (word[:i] for i in range(1, min(len(word), MAX_PREFIX) + 1))
+
+def search_tokens(name: str, brand: str, barcode: str) -> List[str]:
+    """Prefix tokens stored on a product for indexed autocomplete"""
+    tokens = set()
+    for word in words(name) + words(brand):
+        tokens.update(prefixes(word))
+    tokens.update(prefixes(fold(barcode).strip()))
+    return sorted(tokens)
+
+def query_terms(query: str) -> List[str]:
+    """Folded query words, each usable as an exact token match"""
+    return [word[:MAX_PREFIX] for word in words(query)]
+
+def rank(product: dict, query: str, terms: List[str]) -> int:
+    """Score a candidate: barcode hits first, then name prefix matches"""
+    barcode = str(product.get("barcode", ""))
+    name = fold(product.get("name", ""))
+    name_words = words(name)
+    score = 0
+    if barcode == query.strip():
+        score += 100
+    elif barcode.startswith(query.strip()):
+        score += 50
+    if name.startswith(fold(query).strip()):
+        score += 40
+    score += 10 * sum(1 for term in terms if any(w.startswith(term) for w in name_words))
+    return score
@@ -1,19 +1,26 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query, Header, Request, Response, UploadFile, File
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from pathlib import Path
 import uuid
 import os
 import logging
-from datetime import datetime, timedelta
-from typing import List, Optional
+from datetime import datetime
+from typing import List, Optional, Union
 
 # Import our modules
 from .models import *
-from .database import connect_to_mongo, close_mongo_connection
-from .auth import authenticate_user, create_access_token, get_current_user, get_current_admin_user, create_admin_user_if_not_exists
-from .services import UserService, ProductService, StockService, SalesService, DashboardService, FinanceService
+from .database import connect_to_mongo, close_mongo_connection, encode_cursor, fields_projection, model_projection
+from .catalog import catalog_version, flush_releases
+from .auth import authenticate_user, create_access_token, get_current_user, get_current_admin_user, get_stream_user, get_metrics_reader, create_stream_ticket, STREAM_TICKET_TTL, create_admin_user_if_not_exists
+from .services import UserService, ProductService, StockService, SalesService, SalesRollupService, DashboardService, FinanceService
+from .reports import ReportJobService, shutdown_executor
+from .imports import RowReader
+from .idempotency import IdempotencyConflict
+from . import exports
+from .events import hub as event_hub, event_stream
+from . import metrics
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
@@ -42,11 +49,42 @@ app.add_middleware(
     allow_origins=allow_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Catalog-Version"],
 )
+# Outermost, so latency includes CORS handling and preflights are counted
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Create API router
 api_router = APIRouter(prefix="/api")
 
+def set_next_cursor(response: Response, items: list, limit: int, sort_field: str = "created_at"):
+    """Expose a keyset cursor for the next page when this page is full"""
+    if items and len(items) == limit:
+        last = items[-1]
+        if isinstance(last, dict):
+            response.headers["X-Next-Cursor"] = encode_cursor(last[sort_field], last["id"])
+        else:
+            response.headers["X-Next-Cursor"] = encode_cursor(getattr(last, sort_field), last.id)
+
+# Sparse fieldsets: ?fields=id,name,stock
+FIELDS_HELP = "Comma-separated fields to return; defaults to the full model for the caller's role"
+# Paged listings always return what X-Next-Cursor is built from
+KEYSET_FIELDS = ("id", "created_at")
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def lean_response(rows: List[dict], limit: int = None, sort_field: str = "created_at") -> ORJSONResponse:
+    """Send projected DB rows as-is: no model building, no response_model pass, orjson encoding"""
+    response = ORJSONResponse(rows)
+    if limit:
+        set_next_cursor(response, rows, limit, sort_field)
+    return response
+
 # Health check
 @api_router.get("/")
 async def root():
@@ -119,23 +157,59 @@ async def delete_user(
     return {"message": "User deleted successfully"}
 
 # Product management endpoints
-@api_router.get("/products", response_model=List[Product])
+@api_router.get("/products", response_model=List[Union[Product, CashierProduct]])
 async def get_products(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = Query(None),
     category: Optional[str] = Query(None),
     low_stock: bool = Query(False),
+    fields: Optional[str] = Query(None, description=FIELDS_HELP),
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user)
 ):
+    # Till screens never show cost price or supplier unless asked for
+    default = CashierProduct if current_user.role == UserRole.cashier else Product
+    try:
+        projection = fields_projection(Product, fields, default=default)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # The listing only changes when the catalog version does
+    version = await catalog_version()
+    headers = {
+        "ETag": f'W/"catalog-{version}-{current_user.role.value}"',
+        "X-Catalog-Version": str(version),
+        "Cache-Control": "private, no-cache",
+    }
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
     products = await ProductService.get_products(
         skip=skip, 
         limit=limit, 
         search=search, 
         category=category, 
-        low_stock=low_stock
+        low_stock=low_stock,
+        projection=projection
     )
-    return products
+    response = lean_response(products)
+    response.headers.update(headers)
+    return response
+
+@api_router.get("/products/changes", response_model=CatalogDelta)
+async def get_product_changes(
+    changed_since: int = Query(..., ge=0, description="Catalog version the client last synced"),
+    current_user: User = Depends(get_current_user)
+):
+    """Delta sync: products written and ids deleted after changed_since.
+    
+    Pass the returned version as the next changed_since. Start from the
+    X-Catalog-Version header of a full /products listing, or from 0.
+    """
+    default = CashierProduct if current_user.role == UserRole.cashier else Product
+    delta = await ProductService.get_changes(changed_since, model_projection(default))
+    return ORJSONResponse(delta, headers={"X-Catalog-Version": str(delta["version"])})
 
 @api_router.post("/products", response_model=Product)
 async def create_product(
@@ -148,6 +222,27 @@ async def create_product(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@api_router.post("/products/import", response_model=ProductImportResult)
+async def import_products(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Upsert a supplier catalog (CSV or XLSX) by barcode and report rejected rows."""
+    try:
+        reader = RowReader(file.file, file.filename)
+        return await ProductService.import_products(reader)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/products/autocomplete", response_model=List[Product])
+async def autocomplete_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: User = Depends(get_current_user)
+):
+    """Ranked prefix search by name, brand or barcode for search-as-you-type."""
+    return await ProductService.autocomplete(q, limit)
+
 @api_router.get("/products/barcode/{barcode}", response_model=Product)
 async def get_product_by_barcode(
     barcode: str,
@@ -158,6 +253,13 @@ async def get_product_by_barcode(
         raise HTTPException(status_code=404, detail="Product not found")
     return product
 
+@api_router.get("/products/cache/stats")
+async def get_product_cache_stats(
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Hit/miss counters of the in-process product cache."""
+    return ProductService.get_cache_stats()
+
 @api_router.get("/products/{product_id}", response_model=Product)
 async def get_product(
     product_id: str,
@@ -207,20 +309,28 @@ async def get_stock_movements(
     limit: int = Query(100, ge=1, le=1000),
     product_id: Optional[str] = Query(None),
     movement_type: Optional[StockMovementType] = Query(None),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description=FIELDS_HELP),
     current_user: User = Depends(get_current_user)
 ):
-    movements = await StockService.get_movements(
-        skip=skip, 
-        limit=limit, 
-        product_id=product_id, 
-        movement_type=movement_type
-    )
-    return movements
+    try:
+        movements = await StockService.get_movements(
+            skip=skip, 
+            limit=limit, 
+            product_id=product_id, 
+            movement_type=movement_type,
+            cursor=cursor,
+            projection=fields_projection(StockMovement, fields, required=KEYSET_FIELDS)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return lean_response(movements, limit)
 
 @api_router.post("/stock/movement", response_model=StockMovement)
 async def create_stock_movement(
     movement_data: StockMovementCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     try:
         # Cashiers cannot set price/supplier; sanitize input for cashiers
@@ -228,10 +338,30 @@ async def create_stock_movement(
             clean = movement_data.dict()
             clean["unit_price"] = None
             clean["supplier"] = None
-            movement = await StockService.create_movement(StockMovementCreate(**clean), current_user.id)
+            movement = await StockService.create_movement(StockMovementCreate(**clean), current_user.id, idempotency_key)
         else:
-            movement = await StockService.create_movement(movement_data, current_user.id)
+            movement = await StockService.create_movement(movement_data, current_user.id, idempotency_key)
         return movement
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.post("/stock/receipts", response_model=GoodsReceipt)
+async def create_goods_receipt(
+    receipt_data: GoodsReceiptCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Record a multi-line delivery in one request."""
+    try:
+        # Cashiers cannot set price/supplier; sanitize input for cashiers
+        if current_user.role == UserRole.cashier:
+            clean = receipt_data.dict()
+            clean["supplier"] = None
+            for line in clean["lines"]:
+                line["unit_price"] = None
+            receipt_data = GoodsReceiptCreate(**clean)
+        return await StockService.create_receipt(receipt_data, current_user.id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -242,37 +372,55 @@ async def get_low_stock_products(
     return await StockService.get_low_stock_products()
 
 # Sales management endpoints
-@api_router.get("/sales", response_model=List[Sale])
+@api_router.get("/sales", response_model=List[Union[Sale, SaleSummary]])
 async def get_sales(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description=FIELDS_HELP),
     current_user: User = Depends(get_current_user)
 ):
     # Cashiers can only see their own sales
     cashier_id = None if current_user.role == UserRole.admin else current_user.id
     
-    sales = await SalesService.get_sales(
-        skip=skip,
-        limit=limit,
-        start_date=start_date,
-        end_date=end_date,
-        cashier_id=cashier_id
-    )
-    return sales
+    try:
+        sales = await SalesService.get_sales(
+            skip=skip,
+            limit=limit,
+            start_date=start_date,
+            end_date=end_date,
+            cashier_id=cashier_id,
+            cursor=cursor,
+            projection=fields_projection(Sale, fields, required=KEYSET_FIELDS)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return lean_response(sales, limit)
 
 @api_router.post("/sales", response_model=Sale)
 async def create_sale(
     sale_data: SaleCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     try:
-        sale = await SalesService.create_sale(sale_data, current_user.id)
+        sale = await SalesService.create_sale(sale_data, current_user.id, idempotency_key)
         return sale
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@api_router.post("/sales/sync", response_model=SaleSyncResponse)
+async def sync_sales(
+    sync_data: SaleSyncRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Upload sales a till queued while offline; outcomes are reported per sale."""
+    return await SalesService.sync_sales(sync_data, current_user.id)
+
 @api_router.get("/sales/{sale_id}", response_model=Sale)
 async def get_sale(
     sale_id: str,
@@ -295,6 +443,26 @@ async def get_daily_sales_report(
 ):
     return await SalesService.get_daily_stats(date)
 
+@api_router.get("/sales/reports/hourly")
+async def get_hourly_sales_report(
+    date: Optional[datetime] = Query(None),
+    current_user: User = Depends(get_current_admin_user)
+):
+    return await SalesRollupService.get_hourly(date)
+
+def artifact_response(handle, filename: str) -> StreamingResponse:
+    """Send an opened report artifact; the handle keeps it readable if it is replaced meanwhile"""
+    def chunks():
+        with handle:
+            while chunk := handle.read(64 * 1024):
+                yield chunk
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Content-Length": str(os.fstat(handle.fileno()).st_size),
+    }
+    return StreamingResponse(chunks(), media_type="application/pdf", headers=headers)
+
 # Irsaliye (Monthly/Range) PDF Report
 @api_router.get("/sales/reports/irsaliye")
 async def get_irsaliye_pdf(
@@ -306,102 +474,46 @@ async def get_irsaliye_pdf(
     If dates are omitted, defaults to current month.
     """
     try:
-        # Determine date range
-        now = datetime.utcnow()
-        if not start_date:
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if not end_date:
-            # End of month
-            if start_date.month == 12:
-                end_date = start_date.replace(year=start_date.year + 1, month=1)
-            else:
-                end_date = start_date.replace(month=start_date.month + 1)
-            end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        sales = await SalesService.get_sales(
-            skip=0, limit=10000, start_date=start_date, end_date=end_date, cashier_id=None if current_user.role == UserRole.admin else current_user.id
-        )
-
-        # Build PDF
-        from io import BytesIO
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib import colors
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.lib.units import mm
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=15*mm, rightMargin=15*mm, topMargin=12*mm, bottomMargin=12*mm)
-        styles = getSampleStyleSheet()
-
-        company_name = os.getenv("COMPANY_NAME", "Malatya Avize Aydınlatma")
-        company_address = os.getenv("COMPANY_ADDRESS", "Malatya, Türkiye")
-        period_text = f"Dönem: {start_date.strftime('%d.%m.%Y')} - {(end_date - timedelta(seconds=1)).strftime('%d.%m.%Y')}"
-
-        elements = []
-        elements.append(Paragraph(f"<b>{company_name}</b>", styles['Title']))
-        elements.append(Paragraph(company_address, styles['Normal']))
-        elements.append(Spacer(1, 6))
-        elements.append(Paragraph("<b>Sevk İrsaliyesi (Aylık Rapor)</b>", styles['Heading2']))
-        elements.append(Paragraph(period_text, styles['Normal']))
-        elements.append(Spacer(1, 8))
-
-        # Table header per typical irsaliye content
-        data = [["Tarih", "Satış No", "Ödeme", "Ürün Adedi", "Ara Toplam", "KDV", "Toplam"]]
-
-        total_sub = 0.0
-        total_tax = 0.0
-        total_sum = 0.0
-
-        def fmt_tr(amount: float) -> str:
-            try:
-                return f"{amount:,.2f}"
-            except Exception:
-                return str(round(amount, 2))
-
-        for s in sales:
-            item_count = sum([i.quantity for i in s.items])
-            data.append([
-                s.created_at.strftime('%d.%m.%Y %H:%M'),
-                s.id[-8:],
-                ("Nakit" if getattr(s, "payment_method", None) == "cash" else ("Kredi Kartı" if getattr(s, "payment_method", None) == "card" else "-")),
-                item_count,
-                fmt_tr(s.subtotal),
-                fmt_tr(s.tax_amount),
-                fmt_tr(s.total),
-            ])
-            total_sub += s.subtotal
-            total_tax += s.tax_amount
-            total_sum += s.total
-
-        # totals row
-        data.append(["", "TOPLAMLAR", "", "", fmt_tr(total_sub), fmt_tr(total_tax), fmt_tr(total_sum)])
-
-        table = Table(data, repeatRows=1)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-            # Right-align numeric columns starting at Ürün Adedi (index 3)
-            ('ALIGN', (3,1), (-1,-1), 'RIGHT'),
-            ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 6),
-        ]))
-        elements.append(table)
-
-        elements.append(Spacer(1, 12))
-        elements.append(Paragraph("Not: Bu çıktı sevk irsaliyesi formatında aylık satış özetidir.", styles['Italic']))
-
-        doc.build(elements)
-        buffer.seek(0)
-
-        filename = f"irsaliye_{start_date.strftime('%Y-%m')}.pdf"
-        headers = {"Content-Disposition": f"attachment; filename={filename}"}
-        return StreamingResponse(buffer, media_type="application/pdf", headers=headers)
+        handle, start_date = await ReportJobService.render_now(start_date, end_date, current_user)
+        return artifact_response(handle, f"irsaliye_{start_date.strftime('%Y-%m')}.pdf")
     except Exception as e:
         logger.error(f"Irsaliye PDF generation error: {e}")
         raise HTTPException(status_code=500, detail="Could not generate PDF")
 
+# Background report jobs
+@api_router.post("/reports/jobs", response_model=ReportJob)
+async def submit_report_job(
+    data: ReportJobCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Queue a report for rendering in the worker pool."""
+    return await ReportJobService.submit(data, current_user)
+
+@api_router.get("/reports/jobs/{job_id}", response_model=ReportJob)
+async def get_report_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    job = await ReportJobService.get_job(job_id, current_user)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job
+
+@api_router.get("/reports/jobs/{job_id}/download")
+async def download_report_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    job = await ReportJobService.get_job(job_id, current_user)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    if job.status != ReportJobStatus.done:
+        raise HTTPException(status_code=409, detail=f"Report is {job.status.value}")
+    handle = ReportJobService.open_artifact(job.artifact_key)
+    if handle is None:
+        raise HTTPException(status_code=410, detail="Report artifact expired")
+    return artifact_response(handle, f"{job.type.value}_{job.start_date.strftime('%Y-%m')}.pdf")
+
 # Finance endpoints
 @api_router.get("/finance/transactions", response_model=List[FinanceTransaction])
 async def get_finance_transactions(
@@ -411,10 +523,17 @@ async def get_finance_transactions(
     end_date: Optional[datetime] = Query(None),
     type: Optional[FinanceType] = Query(None),
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
+    response: Response = None,
     current_user: User = Depends(get_current_user)
 ):
     # _probe param allows frontend to check availability; ignore it
-    return await FinanceService.get_transactions(skip=skip, limit=limit, start_date=start_date, end_date=end_date, type=type, search=search)
+    try:
+        transactions = await FinanceService.get_transactions(skip=skip, limit=limit, start_date=start_date, end_date=end_date, type=type, search=search, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(response, transactions, limit, sort_field="date")
+    return transactions
 
 @api_router.post("/finance/transactions", response_model=FinanceTransaction)
 async def create_finance_transaction(
@@ -453,6 +572,87 @@ async def get_finance_summary(
 ):
     return await FinanceService.get_summary(start_date=start_date, end_date=end_date, type=type)
 
+# Export endpoints (streamed, admin only)
+def stream_export(name: str, rows, columns: List[str], format: ExportFormat) -> StreamingResponse:
+    headers = {"Content-Disposition": f"attachment; filename={exports.filename(name, format)}"}
+    return StreamingResponse(
+        exports.encode_rows(rows, columns, format),
+        media_type=exports.MEDIA_TYPES[format],
+        headers=headers
+    )
+
+@api_router.get("/exports/sales")
+async def export_sales(
+    format: ExportFormat = Query(ExportFormat.csv),
+    items: bool = Query(False, description="One row per sold line instead of per sale"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    current_user: User = Depends(get_current_admin_user)
+):
+    if items:
+        return stream_export("sale_items", exports.sale_item_rows(start_date, end_date), exports.SALE_ITEM_COLUMNS, format)
+    return stream_export("sales", exports.sale_rows(start_date, end_date), exports.SALE_COLUMNS, format)
+
+@api_router.get("/exports/stock-movements")
+async def export_stock_movements(
+    format: ExportFormat = Query(ExportFormat.csv),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    product_id: Optional[str] = Query(None),
+    type: Optional[StockMovementType] = Query(None),
+    current_user: User = Depends(get_current_admin_user)
+):
+    rows = exports.movement_rows(start_date, end_date, product_id, type.value if type else None)
+    return stream_export("stock_movements", rows, exports.MOVEMENT_COLUMNS, format)
+
+@api_router.get("/exports/finance")
+async def export_finance(
+    format: ExportFormat = Query(ExportFormat.csv),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    type: Optional[FinanceType] = Query(None),
+    current_user: User = Depends(get_current_admin_user)
+):
+    rows = exports.finance_rows(start_date, end_date, type.value if type else None)
+    return stream_export("finance", rows, exports.FINANCE_COLUMNS, format)
+
+# Live updates (Server-Sent Events)
+@api_router.post("/events/ticket")
+async def issue_stream_ticket(current_user: User = Depends(get_current_user)):
+    """Short-lived ticket for opening /events, so the access token stays out of URLs"""
+    return {"ticket": create_stream_ticket(current_user.username), "expires_in": STREAM_TICKET_TTL}
+
+@api_router.get("/events")
+async def stream_events(
+    request: Request,
+    types: Optional[str] = Query(None, description="Comma-separated event types: product, product_deleted, low_stock, sale, catalog"),
+    current_user: User = Depends(get_stream_user)
+):
+    """Push product, stock and sale changes instead of polling.
+    
+    EventSource cannot set headers, so a ticket from POST /events/ticket
+    may be passed as ?ticket= instead of the Authorization header.
+    """
+    subscriber = event_hub.subscribe(current_user, [t.strip() for t in types.split(",")] if types else None)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(
+        event_stream(subscriber, request.is_disconnected),
+        media_type="text/event-stream",
+        headers=headers
+    )
+
+@api_router.get("/events/stats")
+async def get_event_stats(
+    current_user: User = Depends(get_current_admin_user)
+):
+    return event_hub.stats()
+
+# Prometheus scrape endpoint
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(_: None = Depends(get_metrics_reader)):
+    """Request latency, status codes and MongoDB operations in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Dashboard endpoints
 @api_router.get("/dashboard/stats", response_model=DashboardStats)
 async def get_dashboard_stats(
@@ -463,9 +663,12 @@ async def get_dashboard_stats(
 @api_router.get("/dashboard/top-products", response_model=List[TopProduct])
 async def get_top_products(
     limit: int = Query(5, ge=1, le=20),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    category: Optional[str] = Query(None),
     current_user: User = Depends(get_current_user)
 ):
-    return await DashboardService.get_top_products(limit)
+    return await DashboardService.get_top_products(limit, start_date=start_date, end_date=end_date, category=category)
 
 @api_router.get("/dashboard/cashier-performance", response_model=List[CashierPerformance])
 async def get_cashier_performance(
@@ -483,6 +686,7 @@ async def startup_event():
     try:
         await connect_to_mongo()
         logger.info("Database connected successfully")
+        event_hub.start()
         
         # Create default admin user if none exists
         await create_default_admin()
@@ -495,13 +699,16 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    shutdown_executor()
+    await event_hub.stop()
+    await flush_releases()
     await close_mongo_connection()
     logger.info("Application shutdown complete")
 
 async def create_default_admin():
     """Create default admin user if none exists"""
     from .database import find_one, insert_one
-    from .auth import hash_password
+    from .auth import hash_password_async
     
     # Check if any admin user exists
     admin_user = await find_one("users", {"role": "admin"})
@@ -512,7 +719,7 @@ async def create_default_admin():
             {
                 "id": str(uuid.uuid4()),
                 "username": "admin",
-                "password_hash": hash_password("admin123"),
+                "password_hash": await hash_password_async("admin123"),
                 "full_name": "İbrahim Usta",
                 "email": "admin@elektrikdukkani.com",
                 "role": "admin",
@@ -522,7 +729,7 @@ async def create_default_admin():
             {
                 "id": str(uuid.uuid4()),
                 "username": "kasiyer1",
-                "password_hash": hash_password("kasiyer123"),
+                "password_hash": await hash_password_async("kasiyer123"),
                 "full_name": "Ahmet Yılmaz",
                 "email": "ahmet@elektrikdukkani.com",
                 "role": "cashier",
@@ -532,7 +739,7 @@ async def create_default_admin():
             {
                 "id": str(uuid.uuid4()),
                 "username": "kasiyer2",
-                "password_hash": hash_password("kasiyer456"),
+                "password_hash": await hash_password_async("kasiyer456"),
                 "full_name": "Mehmet Demir",
                 "email": "mehmet@elektrikdukkani.com",
                 "role": "cashier",
@@ -552,6 +759,7 @@ async def create_default_admin():
 async def create_sample_products():
     """Create sample products for testing"""
     from .database import insert_one
+    from .search import search_tokens
     
     sample_products = [
         {
@@ -632,6 +840,9 @@ async def create_sample_products():
     ]
     
     for product_data in sample_products:
+        product_data["search_tokens"] = search_tokens(product_data["name"], product_data["brand"], product_data["barcode"])
+        product_data["is_low"] = product_data["stock"] <= product_data["min_stock"]
+        product_data["catalog_version"] = 1
         await insert_one("products", product_data)
     
     logger.info("Sample products created successfully")
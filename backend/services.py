@@ -1,12 +1,43 @@
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from .models import *
 from .database import *
-from .auth import hash_password
+from .auth import hash_password_async, evict_principal
+from .cache import TTLCache
+from .search import search_tokens, query_terms, rank
+from .imports import RowReader
+from .idempotency import run_once
+from .catalog import catalog_write, catalog_version
+from .events import hub as event_hub
+from .metrics import db_call
+from pydantic import ValidationError
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+import asyncio
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Scan-path product cache, keyed by ("id", ...) and ("barcode", ...)
+product_cache = TTLCache(
+    maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "300")),
+)
+# Sequence number of the last invalidation per cache key. A read or write
+# only fills the cache if its key was not invalidated after it began, so a
+# slow read cannot put back a document that an update already replaced.
+product_invalidations = TTLCache(maxsize=product_cache.maxsize, ttl=60)
+
+# Catalog rows validated and written per bulk_write
+IMPORT_BATCH_SIZE = 1000
+
+# Minimum number of token matches ranked per autocomplete query
+AUTOCOMPLETE_CANDIDATES = 50
+
+# Dashboard top-products results per parameter set
+top_products_cache = TTLCache(maxsize=256, ttl=float(os.getenv("TOP_PRODUCTS_CACHE_TTL", "60")))
+
 class UserService:
     @staticmethod
     async def create_user(user_data: UserCreate) -> User:
@@ -18,7 +49,7 @@ class UserService:
         
         # Create user document
         user_dict = user_data.dict()
-        user_dict["password_hash"] = hash_password(user_dict.pop("password"))
+        user_dict["password_hash"] = await hash_password_async(user_dict.pop("password"))
         user_dict["created_at"] = datetime.utcnow()
         
         user = User(**user_dict)
@@ -45,19 +76,38 @@ class UserService:
         
         # Hash password if provided
         if "password" in update_dict:
-            update_dict["password_hash"] = hash_password(update_dict.pop("password"))
+            update_dict["password_hash"] = await hash_password_async(update_dict.pop("password"))
+        
+        current = await find_one("users", {"id": user_id})
+        if current:
+            evict_principal(current.get("username"))
         
         success = await update_one("users", {"id": user_id}, update_dict)
+        # Again after the write: lookups that began before it may have read the old user
+        if current:
+            evict_principal(current.get("username"))
         if success:
-            return await UserService.get_user_by_id(user_id)
+            user = await UserService.get_user_by_id(user_id)
+            if user:
+                evict_principal(user.username)
+            return user
         return None
     
     @staticmethod
     async def delete_user(user_id: str) -> bool:
         """Delete user"""
-        return await delete_one("users", {"id": user_id})
+        current = await find_one("users", {"id": user_id})
+        if current:
+            evict_principal(current.get("username"))
+        deleted = await delete_one("users", {"id": user_id})
+        if current:
+            evict_principal(current.get("username"))
+        return deleted
 
 class ProductService:
+    # Pipeline stage that keeps the denormalized is_low flag in sync with stock
+    LOW_FLAG_STAGE = {"$set": {"is_low": {"$lte": ["$stock", "$min_stock"]}}}
+    
     @staticmethod
     async def generate_unique_barcode(prefix: str = "869") -> str:
         """Generate a unique barcode not present in DB (CODE128-friendly)."""
@@ -67,7 +117,7 @@ class ProductService:
             ms = str(int(time.time() * 1000))[-9:]
             rand = str(random.randint(10, 99))
             candidate = f"{prefix}{ms}{rand}"
-            existing = await find_one("products", {"barcode": candidate})
+            existing = await find_one("products", {"barcode": candidate}, {"_id": 1})
             if not existing:
                 return candidate
             attempts += 1
@@ -80,16 +130,98 @@ class ProductService:
         # Normalize barcode
         normalized_barcode = str(product_data.barcode).strip()
         # Check if barcode already exists
-        existing_product = await find_one("products", {"barcode": normalized_barcode})
+        existing_product = await find_one("products", {"barcode": normalized_barcode}, {"_id": 1})
         if existing_product:
             raise ValueError("Barcode already exists")
         # Build product with normalized barcode
         data = product_data.dict()
         data["barcode"] = normalized_barcode
-        product = Product(**data)
-        await insert_one("products", product.dict())
+        mark = ProductService._cache_mark()
+        async with catalog_write() as version:
+            product = Product(**data, catalog_version=version)
+            doc = product.dict()
+            doc["search_tokens"] = search_tokens(product.name, product.brand, product.barcode)
+            doc["is_low"] = product.stock <= product.min_stock
+            await insert_one("products", doc)
         
-        return product
+        await ProductService._publish_product(doc)
+        return ProductService._cache_product(product, mark)
+    
+    @staticmethod
+    async def import_products(reader: RowReader, batch_size: int = IMPORT_BATCH_SIZE) -> ProductImportResult:
+        """Validate catalog rows in batches and upsert them by barcode"""
+        result = ProductImportResult()
+        seen: Dict[str, int] = {}
+        while True:
+            batch = await asyncio.to_thread(reader.read_batch, batch_size)
+            if not batch:
+                break
+            result.total_rows += len(batch)
+            rows: List[tuple] = []
+            for row_number, fields in batch:
+                try:
+                    product = ProductCreate(**fields)
+                except ValidationError as e:
+                    result.errors.append(ProductImportError(
+                        row=row_number,
+                        barcode=fields.get("barcode"),
+                        errors=[f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()]
+                    ))
+                    continue
+                barcode = product.barcode.strip()
+                if barcode in seen:
+                    result.errors.append(ProductImportError(row=row_number, barcode=barcode, errors=[f"Duplicate barcode in file (row {seen[barcode]})"]))
+                    continue
+                seen[barcode] = row_number
+                rows.append((row_number, barcode, product, set(fields)))
+            await ProductService._upsert_import_batch(rows, result)
+        result.failed = len(result.errors)
+        result.errors.sort(key=lambda err: err.row)
+        # Prices and stock may have changed for any cached product
+        ProductService._clear_product_cache()
+        if event_hub.active:
+            # Too many rows for per-product events; tills pull the delta instead
+            await event_hub.publish("catalog", {"version": await catalog_version()})
+        return result
+    
+    @staticmethod
+    async def _upsert_import_batch(rows: List[tuple], result: ProductImportResult) -> None:
+        if not rows:
+            return
+        now = datetime.utcnow()
+        async with catalog_write() as version:
+            operations = []
+            for _, barcode, product, columns in rows:
+                # Only the file's columns overwrite an existing product. Stock
+                # is an opening balance for new products; changing it on
+                # existing ones has to go through stock movements.
+                fields = product.dict(include=columns - {"stock"})
+                fields["barcode"] = barcode
+                fields["search_tokens"] = search_tokens(product.name, product.brand, barcode)
+                fields["updated_at"] = now
+                fields["catalog_version"] = version
+                update = ProductService._set_with_low_flag(fields)
+                # Pipeline updates have no $setOnInsert; keep existing values instead
+                update[0]["$set"].update({
+                    field: {"$ifNull": [f"${field}", {"$literal": value}]}
+                    for field, value in {
+                        "id": str(uuid.uuid4()),
+                        "created_at": now,
+                        "stock": product.stock,
+                        "supplier": product.supplier,
+                    }.items() if field not in fields
+                })
+                operations.append(UpdateOne({"barcode": barcode}, update, upsert=True))
+            try:
+                write = await bulk_write("products", operations, ordered=False)
+                details = {"nUpserted": write.upserted_count, "nModified": write.modified_count, "nMatched": write.matched_count}
+            except BulkWriteError as e:
+                details = e.details
+                for err in details.get("writeErrors", []):
+                    row_number, barcode, _, _ = rows[err["index"]]
+                    result.errors.append(ProductImportError(row=row_number, barcode=barcode, errors=[err.get("errmsg", "Write failed")]))
+        result.created += details.get("nUpserted", 0)
+        result.updated += details.get("nMatched", 0)
     
     @staticmethod
     async def get_products(
@@ -97,9 +229,10 @@ class ProductService:
         limit: int = 100, 
         search: str = None, 
         category: str = None,
-        low_stock: bool = False
+        low_stock: bool = False,
+        projection: dict = None
     ) -> List[Product]:
-        """Get products with filters"""
+        """Get products with filters; with a projection the raw rows are returned without building models"""
         filter_dict = {}
         
         if search:
@@ -113,22 +246,151 @@ class ProductService:
             filter_dict["category"] = category
         
         if low_stock:
-            filter_dict["$expr"] = {"$lte": ["$stock", "$min_stock"]}
+            filter_dict.update(ProductService.low_stock_filter())
         
+        if projection:
+            return await find_many("products", filter_dict, skip=skip, limit=limit, sort={"updated_at": -1}, projection=projection)
         products_data = await find_many("products", filter_dict, skip=skip, limit=limit, sort={"updated_at": -1})
         return [Product(**product) for product in products_data]
     
+    # Bumped by every invalidation; see product_invalidations
+    _invalidation_seq = 0
+    _cleared_seq = 0
+    
+    @staticmethod
+    def _cache_mark() -> int:
+        """Take before reading or writing a product that will be cached"""
+        return ProductService._invalidation_seq
+    
+    @staticmethod
+    def _invalidated_since(product: Product, mark: int) -> bool:
+        if ProductService._cleared_seq > mark:
+            return True
+        return any(
+            product_invalidations.get(key, 0) > mark
+            for key in (("id", product.id), ("barcode", product.barcode))
+        )
+    
+    @staticmethod
+    def _cache_product(product: Product, mark: int) -> Product:
+        """Store a product read after mark under both of its keys, unless it went stale meanwhile"""
+        if not ProductService._invalidated_since(product, mark):
+            product_cache.set(("id", product.id), product)
+            product_cache.set(("barcode", product.barcode), product)
+        return product
+    
+    @staticmethod
+    def _refresh_product(product: Product, mark: int) -> Product:
+        """Replace cached copies with a document just written; drop them if another write intervened"""
+        stale = ProductService._invalidated_since(product, mark)
+        ProductService._evict_product(product.id, product.barcode)
+        if not stale:
+            product_cache.set(("id", product.id), product)
+            product_cache.set(("barcode", product.barcode), product)
+        return product
+    
+    @staticmethod
+    def _evict_product(product_id: str, barcode: str = None) -> None:
+        """Drop a product from the scan cache and fence off reads already in flight"""
+        ProductService._invalidation_seq += 1
+        seq = ProductService._invalidation_seq
+        product_invalidations.set(("id", product_id), seq)
+        cached = product_cache.pop(("id", product_id))
+        if cached:
+            product_cache.pop(("barcode", cached.barcode))
+            product_invalidations.set(("barcode", cached.barcode), seq)
+        if barcode:
+            product_cache.pop(("barcode", barcode))
+            product_invalidations.set(("barcode", barcode), seq)
+    
+    @staticmethod
+    def _clear_product_cache() -> None:
+        ProductService._invalidation_seq += 1
+        ProductService._cleared_seq = ProductService._invalidation_seq
+        product_cache.clear()
+    
+    @staticmethod
+    def get_cache_stats() -> Dict[str, Any]:
+        """Hit/miss counters of the product cache"""
+        return product_cache.stats()
+    
+    @staticmethod
+    async def autocomplete(query: str, limit: int = 10) -> List[Product]:
+        """Ranked prefix search over name, brand and barcode tokens"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        # A scanned barcode is an exact hit that the candidate window below
+        # could miss, so look it up on the unique index alongside the token query.
+        # The token query walks (search_tokens, name) so the window is the first
+        # names alphabetically, not whatever order the index entries come in.
+        barcode = query.strip()
+        lookups = [find_many(
+            "products",
+            {"search_tokens": {"$all": terms}},
+            limit=max(limit * 5, AUTOCOMPLETE_CANDIDATES),
+            sort={"name": 1}
+        )]
+        if len(terms) == 1:
+            lookups.append(find_one("products", {"barcode": barcode}))
+        candidates, *exact = await asyncio.gather(*lookups)
+        exact = exact[0] if exact else None
+        if exact:
+            candidates = [exact] + [doc for doc in candidates if doc["id"] != exact["id"]]
+        candidates.sort(key=lambda doc: (-rank(doc, query, terms), doc.get("name", "")))
+        return [Product(**doc) for doc in candidates[:limit]]
+    
+    @staticmethod
+    async def backfill_search_tokens() -> int:
+        """Compute search tokens for products created before autocomplete existed"""
+        pipeline = [
+            {"$match": {"search_tokens": {"$exists": False}}},
+            {"$project": {"_id": 0, "id": 1, "name": 1, "brand": 1, "barcode": 1}}
+        ]
+        operations = []
+        count = 0
+        async for doc in iter_aggregate("products", pipeline):
+            tokens = search_tokens(doc.get("name", ""), doc.get("brand", ""), doc.get("barcode", ""))
+            operations.append(UpdateOne({"id": doc["id"]}, {"$set": {"search_tokens": tokens}}))
+            if len(operations) >= 500:
+                await bulk_write("products", operations, ordered=False)
+                count += len(operations)
+                operations = []
+        if operations:
+            await bulk_write("products", operations, ordered=False)
+            count += len(operations)
+        return count
+    
+    @staticmethod
+    async def load_products(product_ids: List[str]) -> Dict[str, dict]:
+        """Fetch the referenced products with a single $in query"""
+        docs = await find_many("products", {"id": {"$in": list(set(product_ids))}})
+        return {doc["id"]: doc for doc in docs}
+    
+    @staticmethod
+    def low_stock_filter() -> Dict[str, Any]:
+        """Match products at or below their minimum stock (indexed is_low flag)"""
+        return {"is_low": True}
+    
     @staticmethod
     async def get_product_by_id(product_id: str) -> Optional[Product]:
         """Get product by ID"""
+        cached = product_cache.get(("id", product_id))
+        if cached:
+            return cached
+        mark = ProductService._cache_mark()
         product_data = await find_one("products", {"id": product_id})
-        return Product(**product_data) if product_data else None
+        return ProductService._cache_product(Product(**product_data), mark) if product_data else None
     
     @staticmethod
     async def get_product_by_barcode(barcode: str) -> Optional[Product]:
         """Get product by barcode"""
+        cached = product_cache.get(("barcode", barcode))
+        if cached:
+            return cached
+        mark = ProductService._cache_mark()
         product_data = await find_one("products", {"barcode": barcode})
-        return Product(**product_data) if product_data else None
+        return ProductService._cache_product(Product(**product_data), mark) if product_data else None
     
     @staticmethod
     async def update_product(product_id: str, product_update: ProductUpdate) -> Optional[Product]:
@@ -137,62 +399,281 @@ class ProductService:
         # Normalize and check barcode uniqueness if changing
         if "barcode" in update_dict:
             update_dict["barcode"] = str(update_dict["barcode"]).strip()
-            other = await find_one("products", {"barcode": update_dict["barcode"]})
+            other = await find_one("products", {"barcode": update_dict["barcode"]}, {"_id": 0, "id": 1})
             if other and other.get("id") != product_id:
                 raise ValueError("Barcode already exists")
         
-        success = await update_one("products", {"id": product_id}, update_dict)
-        if success:
-            return await ProductService.get_product_by_id(product_id)
+        if {"name", "brand", "barcode"} & update_dict.keys():
+            current = await find_one("products", {"id": product_id})
+            if current:
+                # Forget the old barcode key before it changes
+                ProductService._evict_product(product_id, current.get("barcode"))
+                merged = {**current, **update_dict}
+                update_dict["search_tokens"] = search_tokens(merged["name"], merged["brand"], merged["barcode"])
+        
+        update_dict["updated_at"] = datetime.utcnow()
+        mark = ProductService._cache_mark()
+        async with catalog_write() as version:
+            update_dict["catalog_version"] = version
+            product_data = await find_one_and_update("products", {"id": product_id}, ProductService._set_with_low_flag(update_dict))
+        if product_data:
+            product = ProductService._refresh_product(Product(**product_data), mark)
+            await ProductService._publish_product(product_data)
+            return product
+        ProductService._evict_product(product_id)
         return None
     
     @staticmethod
     async def delete_product(product_id: str) -> bool:
-        """Delete product"""
-        return await delete_one("products", {"id": product_id})
+        """Delete product, leaving a tombstone so synced tills drop it too"""
+        current = await find_one("products", {"id": product_id})
+        ProductService._evict_product(product_id, current.get("barcode") if current else None)
+        async with catalog_write() as version:
+            deleted = await delete_one("products", {"id": product_id})
+            if deleted:
+                tombstones = await get_collection("product_tombstones")
+                with db_call("product_tombstones", "update_one"):
+                    await tombstones.update_one(
+                        {"id": product_id},
+                        {"$set": {"catalog_version": version, "deleted_at": datetime.utcnow()}},
+                        upsert=True
+                    )
+        # Again, in case a read that began before the delete cached it meanwhile
+        ProductService._evict_product(product_id, current.get("barcode") if current else None)
+        if deleted:
+            await event_hub.publish("product_deleted", {"id": product_id, "catalog_version": version})
+        return deleted
     
     @staticmethod
-    async def update_stock(product_id: str, quantity_change: int) -> Optional[Product]:
-        """Update product stock"""
-        product = await ProductService.get_product_by_id(product_id)
-        if not product:
-            return None
+    async def get_changes(since: int, projection: dict) -> Dict[str, Any]:
+        """Raw product rows written and ids deleted after catalog version since.
         
-        new_stock = max(0, product.stock + quantity_change)
-        update_dict = {"stock": new_stock, "updated_at": datetime.utcnow()}
+        The returned version is safe to pass back as the next since; rows
+        newer than it may be repeated on the next call.
+        """
+        version = await catalog_version()
+        products = await find_many(
+            "products", {"catalog_version": {"$gt": since}},
+            sort={"catalog_version": 1}, projection=projection
+        )
+        tombstones = await find_many(
+            "product_tombstones", {"catalog_version": {"$gt": since}},
+            sort={"catalog_version": 1}, projection={"_id": 0, "id": 1}
+        )
+        return {"version": version, "products": products, "deleted": [doc["id"] for doc in tombstones]}
+    
+    @staticmethod
+    async def _publish_product(doc: dict, stock_change: int = 0) -> None:
+        """Push a product's till-visible fields, plus a low-stock crossing if stock_change caused one"""
+        await event_hub.publish("product", {field: doc.get(field) for field in CashierProduct.model_fields})
+        if stock_change:
+            now_low = doc["stock"] <= doc["min_stock"]
+            was_low = doc["stock"] - stock_change <= doc["min_stock"]
+            if now_low != was_low:
+                await event_hub.publish("low_stock", {
+                    "id": doc["id"],
+                    "name": doc["name"],
+                    "stock": doc["stock"],
+                    "min_stock": doc["min_stock"],
+                    "low": now_low
+                })
+    
+    @staticmethod
+    async def _publish_stock_changes(changes: Dict[str, int]) -> None:
+        """Announce committed stock changes (product id -> signed quantity) with one read"""
+        if not event_hub.active:
+            return
+        try:
+            docs = await find_many("products", {"id": {"$in": list(changes)}}, projection=model_projection(CashierProduct))
+            for doc in docs:
+                await ProductService._publish_product(doc, changes[doc["id"]])
+        except Exception as e:
+            # The write has committed; a missed event only delays the screens
+            logger.error(f"Publishing stock changes failed: {e}")
+    
+    @staticmethod
+    def _stock_mutation(product_id: str, quantity_change: int, version: int, now: datetime = None) -> tuple:
+        """Filter and update for an atomic stock change.
         
-        await update_one("products", {"id": product_id}, update_dict)
-        return await ProductService.get_product_by_id(product_id)
+        Decrements are guarded with ``stock >= qty`` so stock never goes
+        negative and concurrent tills cannot oversell.
+        """
+        filter_dict: Dict[str, Any] = {"id": product_id}
+        if quantity_change < 0:
+            filter_dict["stock"] = {"$gte": -quantity_change}
+        update = [
+            {"$set": {
+                "stock": {"$add": ["$stock", quantity_change]},
+                "updated_at": now or datetime.utcnow(),
+                "catalog_version": version
+            }},
+            ProductService.LOW_FLAG_STAGE
+        ]
+        return filter_dict, update
+    
+    @staticmethod
+    def _set_with_low_flag(fields: Dict[str, Any]) -> list:
+        """Pipeline update setting literal field values, then recomputing is_low"""
+        return [
+            {"$set": {key: {"$literal": value} for key, value in fields.items()}},
+            ProductService.LOW_FLAG_STAGE
+        ]
+    
+    @staticmethod
+    async def _undo_stock_changes(changes: Dict[str, int], version: int) -> None:
+        """Revert stock changes (product id -> signed quantity) applied without a transaction"""
+        for product_id, quantity_change in changes.items():
+            filter_dict, update = ProductService._stock_mutation(product_id, -quantity_change, version)
+            # Unguarded: the reverted units were never really there (or gone)
+            filter_dict.pop("stock", None)
+            try:
+                await find_one_and_update("products", filter_dict, update)
+            except Exception as e:
+                logger.error(f"Reverting stock change {quantity_change:+d} of {product_id} failed: {e}")
+            ProductService._evict_product(product_id)
+    
+    @staticmethod
+    async def update_stock(product_id: str, quantity_change: int, version: int, session=None) -> Optional[Product]:
+        """Update product stock, stamping the catalog version allocated by the caller
+        
+        Returns None if the product does not exist and raises ValueError
+        when a decrement exceeds the available stock.
+        """
+        filter_dict, update = ProductService._stock_mutation(product_id, quantity_change, version)
+        mark = ProductService._cache_mark()
+        product_data = await find_one_and_update("products", filter_dict, update, session=session)
+        if product_data is None:
+            ProductService._evict_product(product_id)
+            if quantity_change < 0 and await find_one("products", {"id": product_id}, {"_id": 1}):
+                raise ValueError("Insufficient stock")
+            return None
+        return ProductService._refresh_product(Product(**product_data), mark)
 
 class StockService:
     @staticmethod
-    async def create_movement(movement_data: StockMovementCreate, user_id: str) -> StockMovement:
-        """Create stock movement"""
-        product = await ProductService.get_product_by_id(movement_data.product_id)
-        if not product:
-            raise ValueError("Product not found")
+    async def create_movement(movement_data: StockMovementCreate, user_id: str, idempotency_key: str = None, reservation: str = None) -> StockMovement:
+        """Create stock movement; a repeated idempotency_key replays the first result"""
+        if idempotency_key:
+            return await run_once(
+                "stock_movement", user_id, idempotency_key, movement_data.dict(),
+                lambda reservation: StockService.create_movement(movement_data, user_id, reservation=reservation),
+                StockMovement, "stock_movements"
+            )
         
         # Create movement
         movement_dict = movement_data.dict()
         movement_dict["created_by"] = user_id
         movement = StockMovement(**movement_dict)
         
-        await insert_one("stock_movements", movement.dict())
-        
-        # Update product stock
+        # Update product stock atomically, then record the movement
         quantity_change = movement.quantity if movement.type == StockMovementType.stock_in else -movement.quantity
-        await ProductService.update_stock(movement.product_id, quantity_change)
+        async def apply(session, version: int) -> Product:
+            product = await ProductService.update_stock(movement.product_id, quantity_change, version, session=session)
+            if not product:
+                raise ValueError("Product not found")
+            movement_doc = movement.dict()
+            if reservation:
+                movement_doc["idempotency_id"] = reservation
+            try:
+                await insert_one("stock_movements", movement_doc, session=session)
+            except Exception:
+                if session is None:
+                    # Standalone: nothing rolls the stock change back for us
+                    await ProductService._undo_stock_changes({movement.product_id: quantity_change}, version)
+                raise
+            return product
         
+        try:
+            async with catalog_write() as version:
+                product = await run_in_transaction(lambda session: apply(session, version))
+        except Exception:
+            ProductService._evict_product(movement.product_id)
+            raise
+        
+        await ProductService._publish_product(product.dict(), quantity_change)
         return movement
     
+    @staticmethod
+    async def create_receipt(receipt_data: GoodsReceiptCreate, user_id: str) -> GoodsReceipt:
+        """Record a whole delivery: one movement per line, stock incremented in one batch"""
+        products = await ProductService.load_products([line.product_id for line in receipt_data.lines])
+        for line in receipt_data.lines:
+            if line.product_id not in products:
+                raise ValueError(f"Product not found: {line.product_id}")
+        
+        receipt = GoodsReceipt(
+            supplier=receipt_data.supplier,
+            note=receipt_data.note,
+            created_by=user_id,
+            movements=[]
+        )
+        increments: Dict[str, int] = {}
+        for line in receipt_data.lines:
+            receipt.movements.append(StockMovement(
+                product_id=line.product_id,
+                type=StockMovementType.stock_in,
+                quantity=line.quantity,
+                unit_price=line.unit_price,
+                supplier=receipt_data.supplier,
+                note=receipt_data.note,
+                created_by=user_id,
+                receipt_id=receipt.id
+            ))
+            increments[line.product_id] = increments.get(line.product_id, 0) + line.quantity
+        
+        now = datetime.utcnow()
+        
+        async def apply(session, version: int) -> None:
+            operations = [
+                UpdateOne(*ProductService._stock_mutation(product_id, quantity, version, now))
+                for product_id, quantity in increments.items()
+            ]
+            applied: Dict[str, int] = {}
+            try:
+                try:
+                    result = await bulk_write("products", operations, session=session)
+                except BulkWriteError as e:
+                    # Ordered: the updates before the first error went through
+                    applied = dict(list(increments.items())[:e.details["writeErrors"][0]["index"]])
+                    raise
+                # Undoing an increment of a product that no longer exists matches nothing
+                applied = increments
+                if result.matched_count != len(operations):
+                    raise ValueError("Product not found")
+                await insert_many("stock_movements", [movement.dict() for movement in receipt.movements], session=session)
+            except Exception:
+                if session is None:
+                    # Standalone: nothing rolls the stock changes back for us
+                    await ProductService._undo_stock_changes(applied, version)
+                    try:
+                        await delete_many("stock_movements", {"receipt_id": receipt.id})
+                    except Exception as e:
+                        logger.error(f"Removing movements of failed receipt {receipt.id} failed: {e}")
+                raise
+        
+        try:
+            async with catalog_write() as version:
+                await run_in_transaction(lambda session: apply(session, version))
+        finally:
+            for product_id in increments:
+                ProductService._evict_product(product_id)
+        
+        await ProductService._publish_stock_changes(increments)
+        return receipt
+    
     @staticmethod
     async def get_movements(
         skip: int = 0, 
         limit: int = 100, 
         product_id: str = None,
-        movement_type: StockMovementType = None
+        movement_type: StockMovementType = None,
+        cursor: str = None,
+        projection: dict = None
     ) -> List[StockMovement]:
-        """Get stock movements"""
+        """Get stock movements, newest first; cursor continues after a previous page.
+        
+        With a projection the raw rows are returned without building models.
+        """
         filter_dict = {}
         
         if product_id:
@@ -201,7 +682,11 @@ class StockService:
         if movement_type:
             filter_dict["type"] = movement_type.value
         
-        movements_data = await find_many("stock_movements", filter_dict, skip=skip, limit=limit, sort={"created_at": -1})
+        filter_dict = keyset_filter(filter_dict, "created_at", cursor)
+        sort = {"created_at": -1, "id": -1}
+        if projection:
+            return await find_many("stock_movements", filter_dict, skip=skip, limit=limit, sort=sort, projection=projection)
+        movements_data = await find_many("stock_movements", filter_dict, skip=skip, limit=limit, sort=sort)
         return [StockMovement(**movement) for movement in movements_data]
     
     @staticmethod
@@ -211,21 +696,147 @@ class StockService:
 
 class SalesService:
     @staticmethod
-    async def create_sale(sale_data: SaleCreate, cashier_id: str) -> Sale:
-        """Create a new sale"""
-        # Validate and calculate totals
+    async def create_sale(sale_data: SaleCreate, cashier_id: str, idempotency_key: str = None, reservation: str = None) -> Sale:
+        """Create a new sale; a repeated idempotency_key replays the first result"""
+        if idempotency_key:
+            return await run_once(
+                "sale", cashier_id, idempotency_key, sale_data.dict(),
+                lambda reservation: SalesService.create_sale(sale_data, cashier_id, reservation=reservation),
+                Sale, "sales"
+            )
+        
+        # One query for every product in the basket
+        products = await ProductService.load_products([item.product_id for item in sale_data.items])
+        available = {product_id: doc["stock"] for product_id, doc in products.items()}
+        
+        sale = SalesService._build_sale(sale_data, cashier_id, products, available)
+        await SalesService._commit_sales([sale], reservation)
+        
+        return sale
+    
+    @staticmethod
+    async def sync_sales(sync_data: SaleSyncRequest, cashier_id: str) -> SaleSyncResponse:
+        """Replay a till's offline queue in order.
+        
+        Every queued sale is checked against one in-memory stock snapshot,
+        then the accepted ones are committed together. Sales whose
+        client_id this cashier already synced are reported as duplicates;
+        client ids are only unique per cashier, since tills number their
+        queues independently.
+        """
+        client_ids = [queued.client_id for queued in sync_data.sales]
+        synced = await find_many(
+            "sales",
+            {"cashier_id": cashier_id, "client_id": {"$type": "string", "$in": list(set(client_ids))}},
+            limit=len(client_ids),
+            projection={"_id": 0, "id": 1, "client_id": 1}
+        )
+        seen = {doc["client_id"]: doc["id"] for doc in synced}
+        
+        products = await ProductService.load_products(
+            [item.product_id for queued in sync_data.sales for item in queued.items]
+        )
+        available = {product_id: doc["stock"] for product_id, doc in products.items()}
+        now = datetime.utcnow()
+        
+        results: List[SaleSyncResult] = []
+        accepted: List[Sale] = []
+        for queued in sync_data.sales:
+            if queued.client_id in seen:
+                results.append(SaleSyncResult(
+                    client_id=queued.client_id, status=SaleSyncStatus.duplicate, sale_id=seen[queued.client_id]
+                ))
+                continue
+            missing = next((item.product_id for item in queued.items if item.product_id not in products), None)
+            if missing:
+                results.append(SaleSyncResult(
+                    client_id=queued.client_id, status=SaleSyncStatus.invalid, error=f"Product not found: {missing}"
+                ))
+                continue
+            try:
+                sale = SalesService._build_sale(queued, cashier_id, products, available)
+            except ValueError as e:
+                results.append(SaleSyncResult(
+                    client_id=queued.client_id, status=SaleSyncStatus.insufficient_stock, error=str(e)
+                ))
+                continue
+            sale.client_id = queued.client_id
+            sale.created_at = SalesService._captured_at(queued.created_at, now)
+            seen[queued.client_id] = sale.id
+            accepted.append(sale)
+            results.append(SaleSyncResult(client_id=queued.client_id, status=SaleSyncStatus.accepted, sale_id=sale.id))
+        
+        if accepted:
+            try:
+                await SalesService._commit_sales(accepted)
+            except (ValueError, BulkWriteError):
+                # Stock moved or another upload raced us: settle sale by sale.
+                # Without transactions part of the batch may already be in.
+                stored = await find_many(
+                    "sales", {"id": {"$in": [sale.id for sale in accepted]}}, projection={"_id": 0, "id": 1}
+                )
+                stored_ids = {doc["id"] for doc in stored}
+                outcomes = await SalesService._commit_one_by_one([sale for sale in accepted if sale.id not in stored_ids])
+                for result in results:
+                    if result.client_id in outcomes and result.status == SaleSyncStatus.accepted:
+                        result.status, result.error = outcomes[result.client_id]
+                        if result.status != SaleSyncStatus.accepted:
+                            result.sale_id = None
+        
+        response = SaleSyncResponse(results=results)
+        for result in results:
+            if result.status == SaleSyncStatus.accepted:
+                response.accepted += 1
+            elif result.status == SaleSyncStatus.duplicate:
+                response.duplicates += 1
+            else:
+                response.rejected += 1
+        return response
+    
+    @staticmethod
+    def _captured_at(created_at: Optional[datetime], now: datetime) -> datetime:
+        """Naive UTC sale time from the till, never later than the server clock"""
+        if created_at is None:
+            return now
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        return min(created_at, now)
+    
+    @staticmethod
+    async def _commit_one_by_one(sales: List[Sale]) -> Dict[str, tuple]:
+        """Fallback when the batch commit fails: map client_id to (status, error)"""
+        outcomes = {}
+        for sale in sales:
+            try:
+                await SalesService._commit_sales([sale])
+                outcomes[sale.client_id] = (SaleSyncStatus.accepted, None)
+            except BulkWriteError:
+                outcomes[sale.client_id] = (SaleSyncStatus.duplicate, "Sale already synced")
+            except ValueError as e:
+                outcomes[sale.client_id] = (SaleSyncStatus.insufficient_stock, str(e))
+        return outcomes
+    
+    @staticmethod
+    def _build_sale(sale_data: SaleCreate, cashier_id: str, products: Dict[str, dict], available: Dict[str, int]) -> Sale:
+        """Validate a basket against in-memory stock and calculate its totals.
+        
+        ``available`` maps product id to remaining stock and is only
+        decremented when the whole basket fits.
+        """
         subtotal = 0
         tax_amount = 0
         items = []
+        requested: Dict[str, int] = {}
         
         for item_data in sale_data.items:
             # Verify product exists and has enough stock
-            product = await ProductService.get_product_by_id(item_data.product_id)
+            product = products.get(item_data.product_id)
             if not product:
                 raise ValueError(f"Product not found: {item_data.product_id}")
             
-            if product.stock < item_data.quantity:
-                raise ValueError(f"Insufficient stock for {product.name}")
+            requested[item_data.product_id] = requested.get(item_data.product_id, 0) + item_data.quantity
+            if available.get(item_data.product_id, 0) < requested[item_data.product_id]:
+                raise ValueError(f"Insufficient stock for {product['name']}")
             
             # Calculate item totals (VAT-inclusive unit_price)
             gross_total = item_data.quantity * item_data.unit_price
@@ -244,8 +855,10 @@ class SalesService:
         
         total = subtotal + tax_amount
         
-        # Create sale
-        sale = Sale(
+        for product_id, quantity in requested.items():
+            available[product_id] -= quantity
+        
+        return Sale(
             cashier_id=cashier_id,
             items=items,
             subtotal=subtotal,
@@ -253,14 +866,114 @@ class SalesService:
             total=total,
             payment_method=getattr(sale_data, "payment_method", None)
         )
+    
+    @staticmethod
+    async def _commit_sales(sales: List[Sale], reservation: str = None) -> None:
+        """Insert sales and apply their stock decrements as one unit of work.
+        
+        reservation is the idempotency key a single sale is created under;
+        it is stored with the sale so a duplicate run fails on insert.
+        On a standalone server some sales of the batch may be rejected while
+        the rest commit; the committed ones are still rolled up and
+        announced before the insert error is raised.
+        """
+        decrements = SalesService._decrements(sales)
+        sale_docs = [sale.dict() for sale in sales]
+        if reservation:
+            sale_docs[0]["idempotency_id"] = reservation
+        now = datetime.utcnow()
+        rejected: List[BulkWriteError] = []
         
-        await insert_one("sales", sale.dict())
+        async def apply(session, version: int) -> None:
+            if session is None:
+                error = await SalesService._commit_without_transaction(sale_docs, decrements, version)
+                if error:
+                    rejected.append(error)
+                return
+            operations = [
+                UpdateOne(*ProductService._stock_mutation(product_id, -quantity, version, now))
+                for product_id, quantity in decrements.items()
+            ]
+            result = await bulk_write("products", operations, session=session)
+            if result.matched_count != len(operations):
+                raise ValueError("Insufficient stock")
+            await insert_many("sales", sale_docs, session=session)
         
-        # Update product stocks
-        for item in items:
-            await ProductService.update_stock(item.product_id, -item.quantity)
+        try:
+            async with catalog_write() as version:
+                await run_in_transaction(lambda session: apply(session, version))
+        finally:
+            for product_id in decrements:
+                ProductService._evict_product(product_id)
         
-        return sale
+        if rejected:
+            failed = {err["index"] for err in rejected[0].details.get("writeErrors", [])}
+            sales = [sale for index, sale in enumerate(sales) if index not in failed]
+            decrements = SalesService._decrements(sales)
+        
+        # After the commit: every sale increments the same day and hour
+        # buckets, so inside the transaction any two checkouts would conflict
+        try:
+            await SalesRollupService.apply(sales)
+        except Exception as e:
+            # The sale stands; rebuild_rollups repairs the counters
+            logger.error(f"Sales rollup update failed: {e}")
+        
+        await ProductService._publish_stock_changes({product_id: -quantity for product_id, quantity in decrements.items()})
+        for sale in sales:
+            # Admin dashboards see every sale; a cashier only their own
+            await event_hub.publish("sale", {
+                "id": sale.id,
+                "cashier_id": sale.cashier_id,
+                "total": sale.total,
+                "item_count": sum(item.quantity for item in sale.items),
+                "payment_method": sale.payment_method,
+                "created_at": sale.created_at
+            }, roles=[UserRole.admin.value], user_id=sale.cashier_id)
+        
+        if rejected:
+            raise rejected[0]
+    
+    @staticmethod
+    def _decrements(sales: List[Sale]) -> Dict[str, int]:
+        """Total quantity per product sold by sales"""
+        decrements: Dict[str, int] = {}
+        for sale in sales:
+            for item in sale.items:
+                decrements[item.product_id] = decrements.get(item.product_id, 0) + item.quantity
+        return decrements
+    
+    @staticmethod
+    async def _commit_without_transaction(sale_docs: List[dict], decrements: Dict[str, int], version: int) -> Optional[BulkWriteError]:
+        """Standalone fallback: guarded decrements, undone if a later step fails.
+        
+        Sales are inserted unordered, so one rejected sale (a client_id
+        synced by a racing upload) does not hold back the rest. When only
+        some are rejected their stock is given back and the insert error is
+        returned, so the caller can settle the committed ones.
+        """
+        applied: Dict[str, int] = {}
+        try:
+            for product_id, quantity in decrements.items():
+                if not await ProductService.update_stock(product_id, -quantity, version):
+                    raise ValueError(f"Product not found: {product_id}")
+                applied[product_id] = -quantity
+            await insert_many("sales", sale_docs, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            if len(failed) == len(sale_docs):
+                await ProductService._undo_stock_changes(applied, version)
+                raise
+            returned: Dict[str, int] = {}
+            for index in failed:
+                for item in sale_docs[index]["items"]:
+                    returned[item["product_id"]] = returned.get(item["product_id"], 0) - item["quantity"]
+            await ProductService._undo_stock_changes(returned, version)
+            return e
+        except Exception:
+            await ProductService._undo_stock_changes(applied, version)
+            raise
+        return None
     
     @staticmethod
     async def get_sales(
@@ -268,9 +981,14 @@ class SalesService:
         limit: int = 100,
         start_date: datetime = None,
         end_date: datetime = None,
-        cashier_id: str = None
+        cashier_id: str = None,
+        cursor: str = None,
+        projection: dict = None
     ) -> List[Sale]:
-        """Get sales with filters"""
+        """Get sales with filters, newest first; cursor continues after a previous page.
+        
+        With a projection the raw rows are returned without building models.
+        """
         filter_dict = {}
         
         if start_date or end_date:
@@ -284,7 +1002,11 @@ class SalesService:
         if cashier_id:
             filter_dict["cashier_id"] = cashier_id
         
-        sales_data = await find_many("sales", filter_dict, skip=skip, limit=limit, sort={"created_at": -1})
+        filter_dict = keyset_filter(filter_dict, "created_at", cursor)
+        sort = {"created_at": -1, "id": -1}
+        if projection:
+            return await find_many("sales", filter_dict, skip=skip, limit=limit, sort=sort, projection=projection)
+        sales_data = await find_many("sales", filter_dict, skip=skip, limit=limit, sort=sort)
         return [Sale(**sale) for sale in sales_data]
     
     @staticmethod
@@ -299,40 +1021,15 @@ class SalesService:
         if not date:
             date = datetime.utcnow()
         
-        start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + timedelta(days=1)
+        rollup = await find_one("sales_rollups", {"_id": SalesRollupService.bucket_key("day", date)})
         
-        pipeline = [
-            {
-                "$match": {
-                    "created_at": {
-                        "$gte": start_of_day,
-                        "$lt": end_of_day
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": None,
-                    "total_sales": {"$sum": 1},
-                    "total_revenue": {"$sum": "$total"},
-                    "total_items": {
-                        "$sum": {
-                            "$sum": "$items.quantity"
-                        }
-                    }
-                }
-            }
-        ]
-        
-        result = await aggregate("sales", pipeline)
-        
-        if result:
-            stats = result[0]
+        if rollup:
             return {
-                "total_sales": stats["total_sales"],
-                "total_revenue": stats["total_revenue"],
-                "total_items_sold": stats["total_items"],
+                "total_sales": rollup["total_sales"],
+                "total_revenue": rollup["total_revenue"],
+                "total_items_sold": rollup["total_items"],
+                "by_cashier": rollup.get("cashiers", {}),
+                "by_payment_method": rollup.get("payment_methods", {}),
                 "date": date.isoformat()
             }
         
@@ -340,50 +1037,238 @@ class SalesService:
             "total_sales": 0,
             "total_revenue": 0.0,
             "total_items_sold": 0,
+            "by_cashier": {},
+            "by_payment_method": {},
             "date": date.isoformat()
         }
 
-class DashboardService:
+class SalesRollupService:
+    """Pre-aggregated sales counters per day and hour bucket.
+    
+    Each bucket document holds totals plus per-cashier and per-payment-method
+    breakdowns, kept current by create_sale with $inc upserts.
+    """
+    
     @staticmethod
-    async def get_dashboard_stats() -> DashboardStats:
-        """Get dashboard statistics"""
-        # Get basic counts
-        total_products = await count_documents("products")
+    def bucket_start(granularity: str, moment: datetime) -> datetime:
+        if granularity == "hour":
+            return moment.replace(minute=0, second=0, microsecond=0)
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    @staticmethod
+    def bucket_key(granularity: str, moment: datetime) -> str:
+        fmt = "%Y-%m-%dT%H" if granularity == "hour" else "%Y-%m-%d"
+        return f"{granularity}:{moment.strftime(fmt)}"
+    
+    @staticmethod
+    def _accumulate(buckets: Dict[str, dict], created_at: datetime, cashier_id: str, payment_method: Optional[str], revenue: float, items: int) -> None:
+        """Add one sale to the in-memory increments of its day and hour buckets"""
+        method = payment_method or "unknown"
+        for granularity in ("day", "hour"):
+            key = SalesRollupService.bucket_key(granularity, created_at)
+            bucket = buckets.setdefault(key, {
+                "granularity": granularity,
+                "period": SalesRollupService.bucket_start(granularity, created_at),
+                "inc": {}
+            })
+            inc = bucket["inc"]
+            for field, value in (
+                ("total_sales", 1),
+                ("total_revenue", revenue),
+                ("total_items", items),
+                (f"cashiers.{cashier_id}.sales", 1),
+                (f"cashiers.{cashier_id}.revenue", revenue),
+                (f"cashiers.{cashier_id}.items", items),
+                (f"payment_methods.{method}.sales", 1),
+                (f"payment_methods.{method}.revenue", revenue),
+            ):
+                inc[field] = inc.get(field, 0) + value
+    
+    @staticmethod
+    async def apply(sales: List[Sale]) -> None:
+        """Fold new sales into their rollup buckets with one bulk_write"""
+        buckets: Dict[str, dict] = {}
+        for sale in sales:
+            payment_method = sale.payment_method.value if sale.payment_method else None
+            items = sum(item.quantity for item in sale.items)
+            SalesRollupService._accumulate(buckets, sale.created_at, sale.cashier_id, payment_method, sale.total, items)
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {"$inc": bucket["inc"], "$setOnInsert": {"granularity": bucket["granularity"], "period": bucket["period"]}},
+                upsert=True
+            )
+            for key, bucket in buckets.items()
+        ]
+        if operations:
+            await bulk_write("sales_rollups", operations, ordered=False)
+    
+    @staticmethod
+    async def get_hourly(date: datetime = None) -> List[Dict[str, Any]]:
+        """Hour buckets of one day, oldest first"""
+        if not date:
+            date = datetime.utcnow()
+        start_of_day = SalesRollupService.bucket_start("day", date)
+        return await find_many(
+            "sales_rollups",
+            {"granularity": "hour", "period": {"$gte": start_of_day, "$lt": start_of_day + timedelta(days=1)}},
+            sort={"period": 1}
+        )
+    
+    @staticmethod
+    async def rebuild(since: datetime = None) -> int:
+        """Regenerate rollup buckets from raw sales; returns the number of sales folded in.
+        
+        Safe against a live server: each bucket is replaced in place, so
+        dashboards never see it missing. A sale committed while its bucket
+        is being rebuilt may still be left out; running it again fixes that.
+        """
+        match: Dict[str, Any] = {}
+        bucket_filter: Dict[str, Any] = {}
+        if since:
+            since = SalesRollupService.bucket_start("day", since)
+            match["created_at"] = {"$gte": since}
+            bucket_filter["period"] = {"$gte": since}
         
-        # Get total stock
         pipeline = [
-            {"$group": {"_id": None, "total_stock": {"$sum": "$stock"}}}
+            {"$match": match},
+            {"$project": {
+                "_id": 0,
+                "created_at": 1,
+                "cashier_id": 1,
+                "payment_method": 1,
+                "total": 1,
+                "items": {"$sum": "$items.quantity"}
+            }}
         ]
-        stock_result = await aggregate("products", pipeline)
-        total_stock = stock_result[0]["total_stock"] if stock_result else 0
-        
-        # Get daily revenue
-        daily_stats = await SalesService.get_daily_stats()
-        daily_revenue = daily_stats["total_revenue"]
-        daily_items_sold = daily_stats["total_items_sold"]
+        buckets: Dict[str, dict] = {}
+        count = 0
+        async for sale in iter_aggregate("sales", pipeline):
+            SalesRollupService._accumulate(
+                buckets, sale["created_at"], sale["cashier_id"], sale.get("payment_method"),
+                sale.get("total") or 0.0, sale.get("items") or 0
+            )
+            count += 1
         
-        # Get low stock count
-        low_stock_products = await StockService.get_low_stock_products()
-        low_stock_count = len(low_stock_products)
+        docs = []
+        for key, bucket in buckets.items():
+            doc = {"_id": key, "granularity": bucket["granularity"], "period": bucket["period"]}
+            for path, value in bucket["inc"].items():
+                target = doc
+                *parents, leaf = path.split(".")
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[leaf] = value
+            docs.append(doc)
         
-        # Get total sales count
-        total_sales = await count_documents("sales")
+        if docs:
+            await bulk_write("sales_rollups", [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False)
+        # Buckets whose sales are all gone
+        await delete_many("sales_rollups", {**bucket_filter, "_id": {"$nin": [doc["_id"] for doc in docs]}})
+        return count
+
+class DashboardService:
+    @staticmethod
+    async def get_dashboard_stats() -> DashboardStats:
+        """Get dashboard statistics"""
+        # Product totals in one pass; low-stock count and sales side concurrently
+        product_stats, low_stock_count, daily_stats, total_sales = await asyncio.gather(
+            DashboardService._product_stats(),
+            count_documents("products", ProductService.low_stock_filter()),
+            SalesService.get_daily_stats(),
+            estimated_count("sales")
+        )
         
         return DashboardStats(
-            total_products=total_products,
-            total_stock=total_stock,
-            daily_revenue=daily_revenue,
+            total_products=product_stats["total_products"],
+            total_stock=product_stats["total_stock"],
+            daily_revenue=daily_stats["total_revenue"],
             low_stock_count=low_stock_count,
-            daily_items_sold=daily_items_sold,
+            daily_items_sold=daily_stats["total_items_sold"],
             total_sales=total_sales
         )
     
     @staticmethod
-    async def get_top_products(limit: int = 5) -> List[TopProduct]:
-        """Get top selling products"""
-        # This would require more complex aggregation in a real scenario
-        # For now, return empty list - can be implemented with sales data analysis
-        return []
+    async def _product_stats() -> Dict[str, int]:
+        """Product count and stock sum in a single aggregation"""
+        pipeline = [
+            {"$group": {"_id": None, "total_products": {"$sum": 1}, "total_stock": {"$sum": "$stock"}}}
+        ]
+        result = await aggregate("products", pipeline)
+        totals = result[0] if result else {}
+        return {
+            "total_products": totals.get("total_products", 0),
+            "total_stock": totals.get("total_stock", 0)
+        }
+    
+    @staticmethod
+    async def get_top_products(
+        limit: int = 5,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        category: str = None
+    ) -> List[TopProduct]:
+        """Get top selling products by quantity over an optional date range"""
+        cache_key = (limit, start_date, end_date, category)
+        cached = top_products_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        match: Dict[str, Any] = {}
+        if start_date or end_date:
+            date_filter: Dict[str, Any] = {}
+            if start_date:
+                date_filter["$gte"] = start_date
+            if end_date:
+                date_filter["$lte"] = end_date
+            match["created_at"] = date_filter
+        
+        pipeline = [
+            {"$match": match},
+            {"$project": {"_id": 0, "items.product_id": 1, "items.product_name": 1, "items.quantity": 1, "items.total_price": 1}},
+            {"$unwind": "$items"},
+            {
+                "$group": {
+                    "_id": "$items.product_id",
+                    "name": {"$last": "$items.product_name"},
+                    "quantity_sold": {"$sum": "$items.quantity"},
+                    "revenue": {"$sum": "$items.total_price"}
+                }
+            }
+        ]
+        lookup = [
+            {"$lookup": {"from": "products", "localField": "_id", "foreignField": "id", "as": "product"}},
+            {"$unwind": {"path": "$product", "preserveNullAndEmptyArrays": True}}
+        ]
+        ranking = [{"$sort": {"quantity_sold": -1, "revenue": -1}}, {"$limit": limit}]
+        if category:
+            # Category lives on the product, so join before filtering
+            pipeline += lookup + [{"$match": {"product.category": category}}] + ranking
+        else:
+            # Only join the handful of winners
+            pipeline += ranking + lookup
+        pipeline.append({
+            "$project": {
+                "product_id": "$_id",
+                "name": {"$ifNull": ["$product.name", "$name"]},
+                "category": {"$ifNull": ["$product.category", ""]},
+                "quantity_sold": 1,
+                "revenue": 1
+            }
+        })
+        
+        results = await aggregate("sales", pipeline)
+        top_products = [
+            TopProduct(
+                product_id=result["product_id"],
+                name=result["name"],
+                category=result["category"],
+                quantity_sold=result["quantity_sold"],
+                revenue=result["revenue"]
+            ) for result in results
+        ]
+        top_products_cache.set(cache_key, top_products)
+        return top_products
     
     @staticmethod
     async def get_cashier_performance() -> List[CashierPerformance]:
@@ -437,7 +1322,8 @@ class FinanceService:
         start_date: datetime = None,
         end_date: datetime = None,
         type: FinanceType = None,
-        search: str = None
+        search: str = None,
+        cursor: str = None
     ) -> List[FinanceTransaction]:
         filter_dict: Dict[str, Any] = {}
         if start_date or end_date:
@@ -456,7 +1342,8 @@ class FinanceService:
                 {"person": {"$regex": search, "$options": "i"}},
                 {"created_by_name": {"$regex": search, "$options": "i"}},
             ]
-        docs = await find_many("finance", filter_dict, skip=skip, limit=limit, sort={"date": -1})
+        filter_dict = keyset_filter(filter_dict, "date", cursor)
+        docs = await find_many("finance", filter_dict, skip=skip, limit=limit, sort={"date": -1, "id": -1})
         return [FinanceTransaction(**d) for d in docs]
 
     @staticmethod
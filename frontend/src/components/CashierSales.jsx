@@ -19,7 +19,7 @@ import { Input } from './ui/input';
 import { Card, CardContent, CardHeader, CardTitle } from './ui/card';
 import { Badge } from './ui/badge';
 import { Alert, AlertDescription } from './ui/alert';
-import { productsAPI, salesAPI } from '../services/api';
+import { productsAPI, salesAPI, newIdempotencyKey } from '../services/api';
 import { useToast } from '../hooks/use-toast';
 
 const CashierSales = ({ user }) => {
@@ -36,6 +36,8 @@ const CashierSales = ({ user }) => {
   const [revealCost, setRevealCost] = useState(false);
   const [showHelper, setShowHelper] = useState(false); // varsayılan gizli
   const barcodeInputRef = useRef(null);
+  // Same key for every retry of this basket; a changed cart is a new sale
+  const saleKeyRef = useRef(null);
   const { toast } = useToast();
 
   // Focus barcode input on component mount and after each scan
@@ -210,6 +212,10 @@ const CashierSales = ({ user }) => {
   };
 
   // Clear cart
+  useEffect(() => {
+    saleKeyRef.current = null;
+  }, [cart]);
+
   const clearCart = () => {
     setCart([]);
     setBarcodeInput('');
@@ -269,7 +275,8 @@ const CashierSales = ({ user }) => {
         payment_method: method
       };
 
-      const sale = await salesAPI.createSale(saleData);
+      if (!saleKeyRef.current) saleKeyRef.current = newIdempotencyKey();
+      const sale = await salesAPI.createSale(saleData, saleKeyRef.current);
       // Eğer backend aynen döndürmüyorsa ekle
       if (!sale.payment_method) sale.payment_method = method;
 
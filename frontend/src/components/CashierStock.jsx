@@ -41,7 +41,7 @@ const CashierStock = () => {
                 selectProduct(results[0]);
             } else {
                 // Query backend once if results are empty
-                const list = await productsAPI.getProducts({ search: term, limit: 10 });
+                const list = await productsAPI.autocomplete(term, 10);
                 if (Array.isArray(list) && list.length > 0) {
                     selectProduct(list[0]);
                 } else {
@@ -73,7 +73,7 @@ const CashierStock = () => {
             setSearching(true);
             debounceRef.current = setTimeout(async () => {
                 try {
-                    const list = await productsAPI.getProducts({ search: v.trim(), limit: 10 });
+                    const list = await productsAPI.autocomplete(v.trim(), 10);
                     setResults(Array.isArray(list) ? list : []);
                 } catch {
                     setResults([]);
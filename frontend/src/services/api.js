@@ -106,6 +106,12 @@ export const productsAPI = {
     return response.data;
   },
 
+  // Ranked search-as-you-type by name, brand or barcode prefix
+  autocomplete: async (q, limit = 10) => {
+    const response = await api.get('/products/autocomplete', { params: { q, limit } });
+    return response.data;
+  },
+
   getProductByBarcode: async (barcode) => {
     try {
       const response = await api.get(`/products/barcode/${barcode}`);
@@ -130,14 +136,22 @@ export const productsAPI = {
 };
 
 // Stock API
+// One key per logical write; reuse it when retrying the same request
+export const newIdempotencyKey = () =>
+  window.crypto?.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+
+const idempotencyHeaders = (key) => (key ? { headers: { 'Idempotency-Key': key } } : undefined);
+
 export const stockAPI = {
   getMovements: async (params = {}) => {
     const response = await api.get('/stock/movements', { params });
     return response.data;
   },
 
-  createMovement: async (movementData) => {
-    const response = await api.post('/stock/movement', movementData);
+  createMovement: async (movementData, idempotencyKey) => {
+    const response = await api.post('/stock/movement', movementData, idempotencyHeaders(idempotencyKey));
     return response.data;
   },
 
@@ -154,8 +168,8 @@ export const salesAPI = {
     return response.data;
   },
 
-  createSale: async (saleData) => {
-    const response = await api.post('/sales', saleData);
+  createSale: async (saleData, idempotencyKey) => {
+    const response = await api.post('/sales', saleData, idempotencyHeaders(idempotencyKey));
     return response.data;
   },
 
@@ -349,4 +363,52 @@ export const financeAPIBackend = {
     const response = await api.get('/finance/summary', { params });
     return response.data;
   }
-};
\ No newline at end of file
+};
+// Live updates over Server-Sent Events. handlers maps event type to a callback,
+// e.g. { product: (p) => ..., low_stock: (p) => ..., sale: (s) => ... }.
+// The stream is opened with a short-lived ticket rather than the access token,
+// so the token never appears in a URL; once the ticket has expired a failed
+// reconnect fetches a new one. Returns a handle; call .close() on unmount.
+export const eventsAPI = {
+  connect: (handlers = {}) => {
+    const types = Object.keys(handlers).filter((type) => type !== 'resync');
+    let source = null;
+    let closed = false;
+    let retry = null;
+
+    const reopen = () => {
+      if (!closed) retry = setTimeout(open, 5000);
+    };
+
+    const open = async () => {
+      let ticket;
+      try {
+        const response = await api.post('/events/ticket');
+        ticket = response.data.ticket;
+      } catch (error) {
+        reopen();
+        return;
+      }
+      if (closed) return;
+      const params = new URLSearchParams({ ticket });
+      if (types.length) params.set('types', types.join(','));
+      source = new EventSource(`${API_BASE_URL}/events?${params.toString()}`);
+      Object.entries(handlers).forEach(([type, handler]) => {
+        source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+      });
+      source.onerror = () => {
+        // EventSource gives up when its reconnect is refused (expired ticket)
+        if (source.readyState === EventSource.CLOSED) reopen();
+      };
+    };
+
+    open();
+    return {
+      close: () => {
+        closed = true;
+        clearTimeout(retry);
+        if (source) source.close();
+      }
+    };
+  }
+};
@@ -0,0 +1,61 @@
+"""Shared fixtures.
+
+Database tests run against the server in TEST_MONGO_URL (a scratch
+database is created and dropped per test) or, without it, against
+mongomock-motor when installed; otherwise they are skipped. Tests that
+need real server behaviour (explain plans, transactions) use
+``mongod_database`` and skip unless TEST_MONGO_URL is set.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from backend import database
+from backend.services import ProductService
+
+TEST_MONGO_URL = os.getenv("TEST_MONGO_URL")
+
+async def _connect(real_only: bool) -> None:
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    if TEST_MONGO_URL:
+        database.db.client = database.AsyncIOMotorClient(TEST_MONGO_URL)
+        hello = await database.db.client.admin.command("hello")
+        database.db.supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+    else:
+        if real_only:
+            pytest.skip("needs a MongoDB server in TEST_MONGO_URL")
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        database.db.client = mongomock_motor.AsyncMongoMockClient()
+        database.db.supports_transactions = False
+    database.db.database = database.db.client[name]
+
+async def _disconnect() -> None:
+    await database.db.client.drop_database(database.db.database.name)
+    database.db.client.close()
+    database.db.client = database.db.database = None
+
+def _runner(real_only: bool):
+    def run(scenario):
+        async def main():
+            await _connect(real_only)
+            ProductService._clear_product_cache()
+            try:
+                return await scenario()
+            finally:
+                await _disconnect()
+        return asyncio.run(main())
+    return run
+
+@pytest.fixture
+def with_database():
+    """Run an async scenario against a scratch database (mongod or mongomock)"""
+    return _runner(real_only=False)
+
+@pytest.fixture
+def mongod_database():
+    """Like with_database, but skipped unless TEST_MONGO_URL points at a server"""
+    if not TEST_MONGO_URL:
+        pytest.skip("needs a MongoDB server in TEST_MONGO_URL")
+    return _runner(real_only=True)
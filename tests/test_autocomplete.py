@@ -0,0 +1,35 @@
+"""Autocomplete finds exact barcodes and reads candidates in name order."""
+from backend.database import insert_many
+from backend.models import Product
+from backend.search import search_tokens
+from backend.services import AUTOCOMPLETE_CANDIDATES, ProductService
+
+def product_doc(barcode: str, name: str) -> dict:
+    doc = Product(barcode=barcode, name=name, category="Elektrik", brand="Viko",
+                  stock=10, min_stock=1, buy_price=5, sell_price=12, tax_rate=20).dict()
+    doc["search_tokens"] = search_tokens(doc["name"], doc["brand"], doc["barcode"])
+    return doc
+
+def test_exact_barcode_beyond_the_candidate_window(with_database):
+    # Barcodes longer than the indexed prefix all share their longest token
+    count = AUTOCOMPLETE_CANDIDATES * 2
+    docs = [product_doc(f"869123456789012{i:04d}", f"Anahtar {i:04d}") for i in range(count)]
+    docs[-1]["name"] = "Zil"
+    target = docs[-1]["barcode"]
+
+    async def scenario():
+        await insert_many("products", docs)
+        return await ProductService.autocomplete(target, limit=5)
+
+    results = with_database(scenario)
+    assert results[0].barcode == target
+    assert len(results) == 5
+
+def test_token_matches_come_in_name_order(with_database):
+    names = [f"Kablo {letter}" for letter in "edcba"] + ["Priz"]
+
+    async def scenario():
+        await insert_many("products", [product_doc(f"86900{i}", name) for i, name in enumerate(names)])
+        return await ProductService.autocomplete("kab", limit=3)
+
+    assert [product.name for product in with_database(scenario)] == ["Kablo a", "Kablo b", "Kablo c"]
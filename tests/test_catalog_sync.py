@@ -0,0 +1,89 @@
+"""Catalog versions: batched releases, ETag revalidation and delta sync."""
+import asyncio
+
+import orjson
+
+from backend import catalog
+from backend.catalog import catalog_version, catalog_write, flush_releases
+from backend.models import ProductCreate, ProductUpdate, User, UserRole
+from backend.server import get_product_changes, get_products
+from backend.services import ProductService
+
+ADMIN = User(username="admin", full_name="Admin", role=UserRole.admin, password_hash="x")
+
+def product(barcode: str) -> ProductCreate:
+    return ProductCreate(barcode=barcode, name=f"Kablo {barcode}", category="Kablo", brand="Öznur",
+                         stock=10, min_stock=1, buy_price=3, sell_price=10, tax_rate=20)
+
+async def listing(if_none_match=None):
+    return await get_products(skip=0, limit=100, search=None, category=None, low_stock=False,
+                              fields=None, if_none_match=if_none_match, current_user=ADMIN)
+
+async def changes(since: int) -> dict:
+    response = await get_product_changes(changed_since=since, current_user=ADMIN)
+    return orjson.loads(response.body)
+
+def test_release_rides_on_the_next_allocation(with_database, monkeypatch):
+    monkeypatch.setattr(catalog, "RELEASE_DELAY", 60)
+
+    async def scenario():
+        async with catalog_write() as first:
+            pass
+        # Finished, but not released to readers yet
+        assert await catalog_version() == first - 1
+        async with catalog_write() as second:
+            pass
+        assert await catalog_version() == first
+        await flush_releases()
+        assert await catalog_version() == second
+
+    with_database(scenario)
+
+def test_released_versions_are_flushed_without_another_write(with_database, monkeypatch):
+    monkeypatch.setattr(catalog, "RELEASE_DELAY", 0)
+
+    async def scenario():
+        async with catalog_write() as version:
+            pass
+        await asyncio.sleep(0.05)
+        return version, await catalog_version()
+
+    version, reported = with_database(scenario)
+    assert reported == version
+
+def test_listing_is_revalidated_by_catalog_etag(with_database):
+    async def scenario():
+        created = await ProductService.create_product(product("100"))
+        await flush_releases()
+        first = await listing()
+        unchanged = await listing(first.headers["ETag"])
+        await ProductService.update_product(created.id, ProductUpdate(sell_price=12))
+        await flush_releases()
+        changed = await listing(first.headers["ETag"])
+        return first, unchanged, changed
+
+    first, unchanged, changed = with_database(scenario)
+    assert first.status_code == 200
+    assert unchanged.status_code == 304
+    assert unchanged.headers["ETag"] == first.headers["ETag"]
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != first.headers["ETag"]
+    assert [row["sell_price"] for row in orjson.loads(changed.body)] == [12]
+
+def test_changes_return_only_later_writes_and_tombstones(with_database):
+    async def scenario():
+        kept = await ProductService.create_product(product("200"))
+        edited = await ProductService.create_product(product("201"))
+        removed = await ProductService.create_product(product("202"))
+        await flush_releases()
+        synced = (await changes(0))["version"]
+        await ProductService.update_product(edited.id, ProductUpdate(stock=4))
+        await ProductService.delete_product(removed.id)
+        await flush_releases()
+        return kept, edited, removed, synced, await changes(synced)
+
+    kept, edited, removed, synced, delta = with_database(scenario)
+    assert [row["id"] for row in delta["products"]] == [edited.id]
+    assert delta["products"][0]["stock"] == 4
+    assert delta["deleted"] == [removed.id]
+    assert delta["version"] > synced
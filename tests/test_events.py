@@ -0,0 +1,77 @@
+"""Live update hub: overflow, disconnects and stream tickets."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.auth import create_access_token, create_stream_ticket, get_stream_user, principal_cache, user_from_token
+from backend.database import insert_one
+from backend.events import RESYNC, EventHub, event_stream, hub
+from backend.models import User, UserRole
+
+def cashier() -> User:
+    return User(username="kasiyer1", full_name="Kasiyer Bir", role=UserRole.cashier, password_hash="x")
+
+def event(number: int) -> dict:
+    return {"type": "product", "data": {"n": number}, "roles": None, "user_id": None}
+
+async def connected() -> bool:
+    return False
+
+async def disconnected() -> bool:
+    return True
+
+def test_overflowing_subscriber_gets_a_single_resync():
+    events = EventHub(change_stream=False)
+    subscriber = events.subscribe(cashier())
+    subscriber.queue = asyncio.Queue(maxsize=3)
+
+    for number in range(10):
+        events.dispatch(event(number))
+
+    assert subscriber.overflowed
+    assert subscriber.queue.qsize() == 1
+    assert subscriber.queue.get_nowait() is RESYNC
+    events.unsubscribe(subscriber)
+    assert events.stats()["dropped"] == 1
+
+def test_stream_ends_after_resync_and_unsubscribes():
+    subscriber = hub.subscribe(cashier())
+    subscriber.queue = asyncio.Queue(maxsize=1)
+
+    async def scenario():
+        hub.dispatch(event(1))
+        hub.dispatch(event(2))
+        return [chunk async for chunk in event_stream(subscriber, connected)]
+
+    chunks = asyncio.run(scenario())
+    assert chunks[-1].startswith("event: resync")
+    assert subscriber not in hub.subscribers
+
+def test_disconnected_client_is_unsubscribed(monkeypatch):
+    monkeypatch.setattr("backend.events.HEARTBEAT_SECONDS", 0.01)
+    subscriber = hub.subscribe(cashier())
+
+    async def scenario():
+        return [chunk async for chunk in event_stream(subscriber, disconnected)]
+
+    assert asyncio.run(scenario()) == ["retry: 5000\n\n"]
+    assert subscriber not in hub.subscribers
+
+def test_stream_ticket_opens_the_stream_only(with_database):
+    user = cashier()
+    ticket = create_stream_ticket(user.username)
+    access_token = create_access_token({"sub": user.username})
+
+    async def scenario():
+        principal_cache.clear()
+        await insert_one("users", user.dict())
+        streamer = await get_stream_user(ticket=ticket, credentials=None)
+        # A ticket is not an access token, and the access token is not a ticket
+        with pytest.raises(HTTPException):
+            await user_from_token(ticket)
+        with pytest.raises(HTTPException):
+            await get_stream_user(ticket=access_token, credentials=None)
+        return streamer
+
+    assert with_database(scenario).id == user.id
@@ -0,0 +1,17 @@
+"""Sales export rows."""
+from backend import exports
+from backend.database import insert_one
+from backend.models import Sale, SaleItem
+
+def test_sale_item_count_is_units_sold(with_database):
+    lines = [SaleItem(product_id=f"p{n}", barcode=f"86900{n}", product_name="Sigorta",
+                      quantity=quantity, unit_price=5, tax_rate=20, total_price=5 * quantity)
+             for n, quantity in enumerate((3, 2))]
+    sale = Sale(cashier_id="c1", items=lines, subtotal=25, tax_amount=5, total=30, payment_method="cash")
+
+    async def scenario():
+        await insert_one("sales", sale.dict())
+        return [row async for row in exports.sale_rows()]
+
+    rows = with_database(scenario)
+    assert [row["item_count"] for row in rows] == [5]
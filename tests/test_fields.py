@@ -0,0 +1,41 @@
+"""Sparse fieldsets (?fields=) on listings."""
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from backend.database import fields_projection
+from backend.models import CashierProduct, Product, ProductCreate, User, UserRole
+from backend.server import get_products
+from backend.services import ProductService
+
+ADMIN = User(username="admin", full_name="Admin", role=UserRole.admin, password_hash="x")
+
+async def listing(fields: str):
+    return await get_products(skip=0, limit=100, search=None, category=None, low_stock=False,
+                              fields=fields, if_none_match=None, current_user=ADMIN)
+
+def test_projection_always_keeps_id():
+    assert fields_projection(Product, "name, stock") == {"name": 1, "stock": 1, "id": 1, "_id": 0}
+    assert fields_projection(Product, "name", required=("id", "created_at")) == \
+        {"name": 1, "id": 1, "created_at": 1, "_id": 0}
+
+def test_projection_defaults_to_the_callers_model():
+    assert set(fields_projection(Product, None, default=CashierProduct)) == set(CashierProduct.model_fields) | {"_id"}
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(ValueError, match="password_hash"):
+        fields_projection(Product, "name,password_hash")
+
+def test_listing_returns_only_requested_fields_plus_id(with_database):
+    async def scenario():
+        await ProductService.create_product(ProductCreate(
+            barcode="869333", name="Buat", category="Tesisat", brand="Mutlusan",
+            stock=40, min_stock=5, buy_price=1, sell_price=2, tax_rate=20))
+        response = await listing("name")
+        with pytest.raises(HTTPException) as rejected:
+            await listing("name,nope")
+        return orjson.loads(response.body), rejected.value.status_code
+
+    rows, status = with_database(scenario)
+    assert [set(row) for row in rows] == [{"id", "name"}]
+    assert status == 400
@@ -0,0 +1,117 @@
+"""Idempotency-Key replays, conflicts, released keys and crashed requests."""
+from datetime import datetime
+
+import pytest
+
+from backend import database, idempotency
+from backend.database import count_documents, find_one, insert_one
+from backend.idempotency import IdempotencyConflict, fingerprint
+from backend.migrations import _idempotency_ids
+from backend.models import Product, SaleCreate
+from backend.services import ProductService, SalesService
+
+def product() -> Product:
+    return Product(barcode="869777", name="Priz", category="Elektrik", brand="Viko",
+                   stock=20, min_stock=1, buy_price=3, sell_price=10, tax_rate=20)
+
+def order(item: Product, quantity: int = 2) -> SaleCreate:
+    return SaleCreate(items=[{"product_id": item.id, "barcode": item.barcode, "product_name": item.name,
+                              "quantity": quantity, "unit_price": 10, "tax_rate": 20}],
+                      payment_method="cash")
+
+async def setup(item: Product) -> None:
+    idempotency.response_cache.clear()
+    await _idempotency_ids(database.db.database)
+    await insert_one("products", item.dict())
+
+async def stock(item: Product) -> int:
+    return (await find_one("products", {"id": item.id}))["stock"]
+
+def test_same_key_replays_the_first_sale(with_database):
+    item = product()
+
+    async def scenario():
+        await setup(item)
+        first = await SalesService.create_sale(order(item), "c1", "k-1")
+        # Past the in-memory cache, the stored response answers
+        idempotency.response_cache.clear()
+        second = await SalesService.create_sale(order(item), "c1", "k-1")
+        return first, second, await count_documents("sales", {}), await stock(item)
+
+    first, second, sales, left = with_database(scenario)
+    assert second.id == first.id
+    assert sales == 1
+    assert left == 18
+
+def test_same_key_with_a_different_payload_conflicts(with_database):
+    item = product()
+
+    async def scenario():
+        await setup(item)
+        await SalesService.create_sale(order(item), "c1", "k-1")
+        with pytest.raises(IdempotencyConflict):
+            await SalesService.create_sale(order(item, 3), "c1", "k-1")
+        return await count_documents("sales", {}), await stock(item)
+
+    assert with_database(scenario) == (1, 18)
+
+def test_failed_operation_releases_the_key(with_database):
+    item = product()
+
+    async def scenario():
+        await setup(item)
+        with pytest.raises(ValueError):
+            await SalesService.create_sale(order(item, 50), "c1", "k-1")
+        released = await find_one("idempotency_keys", {"_id": "sale:c1:k-1"})
+        retried = await SalesService.create_sale(order(item), "c1", "k-1")
+        return released, retried, await stock(item)
+
+    released, retried, left = with_database(scenario)
+    assert released is None
+    assert retried.total > 0
+    assert left == 18
+
+def test_stale_pending_key_with_a_committed_sale_is_not_run_again(with_database):
+    item = product()
+
+    async def scenario():
+        await setup(item)
+        # The first request committed its sale, then died before recording the response
+        first = await SalesService.create_sale(order(item), "c1", reservation="sale:c1:k-1")
+        await insert_one("idempotency_keys", {
+            "_id": "sale:c1:k-1", "fingerprint": fingerprint(order(item).dict()),
+            "status": "pending", "created_at": datetime(2020, 1, 1)
+        })
+        replayed = await SalesService.create_sale(order(item), "c1", "k-1")
+        key = await find_one("idempotency_keys", {"_id": "sale:c1:k-1"})
+        return first, replayed, key, await count_documents("sales", {}), await stock(item)
+
+    first, replayed, key, sales, left = with_database(scenario)
+    assert replayed.id == first.id
+    assert key["status"] == "done"
+    assert sales == 1
+    assert left == 18
+
+def test_taken_over_request_that_commits_late_is_replayed(with_database, monkeypatch):
+    item = product()
+
+    async def scenario():
+        await setup(item)
+        real_load = ProductService.load_products
+
+        async def load_then_race(product_ids):
+            # The request whose key was taken over commits while we run
+            products = await real_load(product_ids)
+            monkeypatch.setattr(ProductService, "load_products", real_load)
+            await SalesService.create_sale(order(item), "c1", reservation="sale:c1:k-1")
+            return products
+
+        monkeypatch.setattr(ProductService, "load_products", load_then_race)
+        replayed = await SalesService.create_sale(order(item), "c1", "k-1")
+        committed = await find_one("sales", {"idempotency_id": "sale:c1:k-1"})
+        return replayed, committed, await count_documents("sales", {}), await stock(item)
+
+    replayed, committed, sales, left = with_database(scenario)
+    assert replayed.id == committed["id"]
+    assert sales == 1
+    assert left == 18
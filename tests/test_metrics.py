@@ -0,0 +1,67 @@
+"""Prometheus metrics: route labels and cursor round trips."""
+import asyncio
+
+from backend import auth, metrics
+from backend.server import app
+
+async def call(path: str, headers: dict = None):
+    """Send one GET through the full ASGI app; returns (status, body)"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    status = next(message["status"] for message in sent if message["type"] == "http.response.start")
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return status, body.decode()
+
+def test_metrics_label_requests_by_route_template(monkeypatch):
+    monkeypatch.setattr(auth, "METRICS_TOKEN", "scrape-me")
+
+    async def scenario():
+        # Rejected before any database access, but the route still matched
+        await call("/api/products/5f1c7a9e-0000-4000-8000-000000000abc")
+        return await call("/api/metrics", {"Authorization": "Bearer scrape-me"})
+
+    status, body = asyncio.run(scenario())
+    assert status == 200
+    assert 'route="/api/products/{product_id}"' in body
+    assert "5f1c7a9e" not in body
+
+class BatchedCursor:
+    """Serves documents in server-sized batches through the public cursor API"""
+
+    def __init__(self, documents: list):
+        self.documents = documents
+        self.fetches = 0
+
+    @property
+    def alive(self) -> bool:
+        return bool(self.documents)
+
+    async def to_list(self, length: int) -> list:
+        self.fetches += 1
+        batch, self.documents = self.documents[:length], self.documents[length:]
+        return batch
+
+def test_each_cursor_batch_counts_as_a_round_trip():
+    cursor = BatchedCursor(list(range(5)))
+
+    async def scenario():
+        with metrics.count_db_calls() as stats:
+            documents = [document async for document in metrics.timed_iter("sales", "find", cursor, 2)]
+        return documents, stats.calls
+
+    documents, calls = asyncio.run(scenario())
+    assert documents == [0, 1, 2, 3, 4]
+    assert calls == cursor.fetches == 3
@@ -0,0 +1,71 @@
+"""Keyset pagination over sales and finance with tied sort keys."""
+from datetime import datetime, timedelta
+
+import orjson
+import pytest
+from fastapi import HTTPException, Response
+
+from backend.database import insert_many
+from backend.models import FinanceTransaction, FinanceType, Sale, SaleItem, User, UserRole
+from backend.server import get_finance_transactions, get_sales
+
+ADMIN = User(username="admin", full_name="Admin", role=UserRole.admin, password_hash="x")
+# Three rows on each timestamp, so pages split inside a tie
+MOMENTS = [datetime(2024, 5, 1, 10) + timedelta(minutes=minute) for minute in range(4) for _ in range(3)]
+
+def sale(created_at: datetime) -> dict:
+    line = SaleItem(product_id="p1", barcode="869001", product_name="Anahtar",
+                    quantity=1, unit_price=10, tax_rate=20, total_price=10)
+    return Sale(cashier_id="c1", items=[line], subtotal=10, tax_amount=2, total=12,
+                payment_method="cash", created_at=created_at).dict()
+
+def finance(date: datetime) -> dict:
+    return FinanceTransaction(type=FinanceType.income, amount=50, date=date).dict()
+
+async def sales_page(cursor=None, limit: int = 5):
+    response = await get_sales(skip=0, limit=limit, start_date=None, end_date=None,
+                               cursor=cursor, fields=None, current_user=ADMIN)
+    return [row["id"] for row in orjson.loads(response.body)], response.headers.get("X-Next-Cursor")
+
+async def finance_page(cursor=None, limit: int = 5):
+    response = Response()
+    rows = await get_finance_transactions(skip=0, limit=limit, start_date=None, end_date=None, type=None,
+                                          search=None, cursor=cursor, response=response, current_user=ADMIN)
+    return [row.id for row in rows], response.headers.get("X-Next-Cursor")
+
+async def walk(page) -> list:
+    ids, cursor = await page()
+    while cursor:
+        more, cursor = await page(cursor)
+        ids += more
+    return ids
+
+def expected_order(docs: list, field: str) -> list:
+    return [doc["id"] for doc in sorted(docs, key=lambda doc: (doc[field], doc["id"]), reverse=True)]
+
+def test_sales_pages_have_no_duplicates_or_gaps_across_ties(with_database):
+    docs = [sale(moment) for moment in MOMENTS]
+
+    async def scenario():
+        await insert_many("sales", docs)
+        return await walk(sales_page)
+
+    assert with_database(scenario) == expected_order(docs, "created_at")
+
+def test_finance_pages_have_no_duplicates_or_gaps_across_ties(with_database):
+    docs = [finance(moment) for moment in MOMENTS]
+
+    async def scenario():
+        await insert_many("finance", docs)
+        return await walk(finance_page)
+
+    assert with_database(scenario) == expected_order(docs, "date")
+
+@pytest.mark.parametrize("page", [sales_page, finance_page])
+def test_malformed_cursor_is_a_bad_request(with_database, page):
+    async def scenario():
+        with pytest.raises(HTTPException) as rejected:
+            await page("not-a-cursor")
+        return rejected.value.status_code
+
+    assert with_database(scenario) == 400
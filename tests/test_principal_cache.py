@@ -0,0 +1,68 @@
+"""A deactivated or deleted user's token stops working at once."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend import auth
+from backend.auth import create_access_token, principal_cache, user_from_token
+from backend.database import insert_one
+from backend.models import User, UserRole, UserUpdate
+from backend.services import UserService
+
+def cashier() -> User:
+    return User(username="kasiyer1", full_name="Kasiyer Bir", role=UserRole.cashier, password_hash="x")
+
+def test_deactivated_user_is_rejected_on_next_request(with_database):
+    user = cashier()
+    token = create_access_token({"sub": user.username})
+
+    async def scenario():
+        principal_cache.clear()
+        await insert_one("users", user.dict())
+        assert (await user_from_token(token)).id == user.id
+        await UserService.update_user(user.id, UserUpdate(active=False))
+        with pytest.raises(HTTPException) as rejected:
+            await user_from_token(token)
+        return rejected.value.status_code
+
+    assert with_database(scenario) == 401
+
+def test_deleted_user_is_rejected_on_next_request(with_database):
+    user = cashier()
+    token = create_access_token({"sub": user.username})
+
+    async def scenario():
+        principal_cache.clear()
+        await insert_one("users", user.dict())
+        await user_from_token(token)
+        await UserService.delete_user(user.id)
+        with pytest.raises(HTTPException):
+            await user_from_token(token)
+
+    with_database(scenario)
+
+def test_lookup_racing_a_deactivation_is_not_cached(monkeypatch):
+    user = cashier()
+    token = create_access_token({"sub": user.username})
+    read_started = asyncio.Event()
+    release_read = asyncio.Event()
+
+    async def slow_find_one(collection, filter_dict, projection=None):
+        # The lookup still sees the active user, but finishes after the update
+        read_started.set()
+        await release_read.wait()
+        return user.dict()
+
+    async def scenario():
+        principal_cache.clear()
+        monkeypatch.setattr(auth, "find_one", slow_find_one)
+        lookup = asyncio.create_task(user_from_token(token))
+        await read_started.wait()
+        # update_user's eviction after its write
+        auth.evict_principal(user.username)
+        release_read.set()
+        await lookup
+        return principal_cache.get(user.username)
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,59 @@
+"""Scan cache must not be refilled with a document an update already replaced."""
+import asyncio
+
+from backend import services
+from backend.models import Product
+from backend.services import ProductService, product_cache
+
+def product_doc(price: float) -> dict:
+    return Product(
+        id="p1", barcode="869000000001", name="Avize", category="Aydınlatma", brand="Malatya",
+        stock=5, min_stock=1, buy_price=10, sell_price=price, tax_rate=20
+    ).dict()
+
+def test_slow_read_does_not_cache_replaced_document(monkeypatch):
+    product_cache.clear()
+    read_started = asyncio.Event()
+    release_read = asyncio.Event()
+
+    async def slow_find_one(collection, filter_dict, projection=None):
+        # The read sees the old price, but finishes after the update
+        doc = product_doc(100)
+        read_started.set()
+        await release_read.wait()
+        return doc
+
+    async def scenario():
+        monkeypatch.setattr(services, "find_one", slow_find_one)
+        reader = asyncio.create_task(ProductService.get_product_by_barcode("869000000001"))
+        await read_started.wait()
+        # update_product's write path: evict, then refresh with the new document
+        mark = ProductService._cache_mark()
+        ProductService._refresh_product(Product(**product_doc(120)), mark)
+        release_read.set()
+        stale = await reader
+        assert stale.sell_price == 100
+        cached = product_cache.get(("barcode", "869000000001"))
+        assert cached is not None and cached.sell_price == 120
+
+    asyncio.run(scenario())
+
+def test_interleaved_writers_leave_no_stale_copy():
+    product_cache.clear()
+    first = ProductService._cache_mark()
+    second = ProductService._cache_mark()
+    # The second write lands and refreshes first, then the older one finishes
+    ProductService._refresh_product(Product(**product_doc(120)), second)
+    ProductService._refresh_product(Product(**product_doc(100)), first)
+    assert product_cache.get(("id", "p1")) is None
+
+def test_read_after_invalidation_is_cached(monkeypatch):
+    product_cache.clear()
+    ProductService._evict_product("p1", "869000000001")
+
+    async def find_one(collection, filter_dict, projection=None):
+        return product_doc(120)
+
+    monkeypatch.setattr(services, "find_one", find_one)
+    asyncio.run(ProductService.get_product_by_id("p1"))
+    assert product_cache.get(("id", "p1")).sell_price == 120
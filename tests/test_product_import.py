@@ -0,0 +1,53 @@
+"""Catalog imports upsert by barcode without touching stock or absent columns."""
+import io
+
+from backend.database import find_one, insert_one
+from backend.imports import RowReader
+from backend.models import Product
+from backend.services import ProductService
+
+HEADER = "barkod;ad;kategori;marka;stok;min_stok;alis_fiyati;satis_fiyati;kdv"
+
+def reader(*lines: str) -> RowReader:
+    return RowReader(io.BytesIO("\n".join(lines).encode()), "urunler.csv")
+
+def test_import_keeps_stock_and_supplier_of_existing_products(with_database):
+    existing = Product(barcode="869100", name="Priz", category="Elektrik", brand="Viko",
+                       stock=40, min_stock=5, buy_price=5, sell_price=12, tax_rate=20, supplier="Toptanci A")
+
+    async def scenario():
+        await insert_one("products", existing.dict())
+        result = await ProductService.import_products(reader(
+            HEADER,
+            "869100;Priz Beyaz;Elektrik;Viko;3;50;6;14,50;20",
+            "869200;Anahtar;Elektrik;Viko;7;2;4;9;20",
+        ))
+        return result, await find_one("products", {"barcode": "869100"}), await find_one("products", {"barcode": "869200"})
+
+    result, updated, created = with_database(scenario)
+    assert (result.created, result.updated, result.failed) == (1, 1, 0)
+    assert updated["id"] == existing.id
+    assert updated["name"] == "Priz Beyaz"
+    assert updated["sell_price"] == 14.5
+    assert updated["stock"] == 40
+    assert updated["supplier"] == "Toptanci A"
+    # New minimum against the kept stock
+    assert updated["is_low"] is True
+    assert created["stock"] == 7
+    assert created["supplier"] is None
+    assert created["is_low"] is False
+    assert created["id"] and created["created_at"]
+
+def test_import_sets_supplier_when_the_file_has_the_column(with_database):
+    existing = Product(barcode="869100", name="Priz", category="Elektrik", brand="Viko",
+                       stock=40, min_stock=5, buy_price=5, sell_price=12, tax_rate=20, supplier="Toptanci A")
+
+    async def scenario():
+        await insert_one("products", existing.dict())
+        await ProductService.import_products(reader(
+            HEADER + ";tedarikci",
+            "869100;Priz;Elektrik;Viko;40;5;5;12;20;Toptanci B",
+        ))
+        return await find_one("products", {"barcode": "869100"})
+
+    assert with_database(scenario)["supplier"] == "Toptanci B"
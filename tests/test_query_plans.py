@@ -0,0 +1,143 @@
+"""Every query the services build is answered from an index.
+
+The database helpers are wrapped so each service call records the filters
+and sorts it really sends; each recorded query is then explained on a
+migrated scratch database and must not plan a collection scan. Needs a
+real server (TEST_MONGO_URL): mongomock has no query planner.
+"""
+from datetime import datetime, timedelta
+import inspect
+
+from backend import reports, services
+from backend.migrations import run_migrations, scans_collection
+from backend.models import (
+    FinanceTransactionCreate, FinanceTransactionUpdate, FinanceType, Product, SaleCreate, SaleSyncRequest,
+    StockMovementType, User, UserRole,
+)
+from backend.reports import ReportJobService
+from backend.services import (
+    DashboardService, FinanceService, ProductService, SalesRollupService, SalesService,
+    StockService, UserService,
+)
+
+# Helpers whose calls carry a filter (or a pipeline) worth explaining
+HELPERS = [
+    "find_one", "find_many", "iter_find", "count_documents", "aggregate", "iter_aggregate",
+    "update_one", "update_many", "delete_one", "delete_many", "find_one_and_update",
+]
+
+def record_queries(monkeypatch, queries: list) -> None:
+    """Wrap the helpers services.py and reports.py call to collect (collection, filter, sort)"""
+    def recorder(real):
+        signature = inspect.signature(real)
+
+        def note(args, kwargs):
+            bound = signature.bind(*args, **kwargs).arguments
+            collection = bound["collection_name"]
+            if "pipeline" in bound:
+                stages = bound["pipeline"]
+                # A leading $match (and a $sort right after it) is what can use an index
+                if stages and "$match" in stages[0]:
+                    sort = stages[1].get("$sort") if len(stages) > 1 else None
+                    queries.append((collection, stages[0]["$match"], sort))
+            else:
+                queries.append((collection, bound.get("filter_dict") or {}, bound.get("sort")))
+
+        if inspect.isasyncgenfunction(real):
+            async def wrapper(*args, **kwargs):
+                note(args, kwargs)
+                async for item in real(*args, **kwargs):
+                    yield item
+        else:
+            async def wrapper(*args, **kwargs):
+                note(args, kwargs)
+                return await real(*args, **kwargs)
+        return wrapper
+
+    for module in (services, reports):
+        for name in HELPERS:
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, recorder(getattr(module, name)))
+
+async def exercise_services() -> None:
+    """Call every read path with each optional filter set at least once"""
+    now = datetime.utcnow()
+    week_ago = now - timedelta(days=7)
+    admin = User(username="admin", full_name="Admin", role=UserRole.admin, password_hash="x")
+    cashier = User(username="kasiyer", full_name="Kasiyer", role=UserRole.cashier, password_hash="x")
+
+    await UserService.get_users()
+    await UserService.get_user_by_id("missing")
+
+    product = Product(barcode="869000000001", name="Kablo 3x1.5", category="Kablolar", brand="Öznur",
+                      stock=100, min_stock=5, buy_price=10, sell_price=20, tax_rate=20)
+    await services.insert_one("products", product.dict())
+    await ProductService.get_products()
+    await ProductService.get_products(search="kab")
+    await ProductService.get_products(category="Kablolar")
+    await ProductService.get_products(low_stock=True)
+    await ProductService.get_products(search="kab", category="Kablolar", low_stock=True)
+    await ProductService.autocomplete("kablo")
+    await ProductService.autocomplete(product.barcode)
+    await ProductService.get_product_by_id(product.id)
+    await ProductService.get_product_by_barcode(product.barcode)
+    await ProductService.load_products([product.id, "missing"])
+    await ProductService.get_changes(0, {"_id": 0})
+
+    await StockService.get_movements()
+    cursor = services.encode_cursor(now, "x")
+    await StockService.get_movements(product_id=product.id)
+    await StockService.get_movements(movement_type=StockMovementType.stock_in, cursor=cursor)
+    await StockService.get_low_stock_products()
+
+    line = {"product_id": product.id, "barcode": product.barcode, "product_name": product.name,
+            "quantity": 1, "unit_price": 20, "tax_rate": 20}
+    sale = await SalesService.create_sale(SaleCreate(items=[line], payment_method="cash"), cashier.id)
+    await SalesService.sync_sales(SaleSyncRequest(sales=[
+        {"client_id": "till-1-1", "items": [line], "payment_method": "card"}
+    ]), cashier.id)
+    await SalesService.get_sales()
+    await SalesService.get_sales(start_date=week_ago, end_date=now)
+    await SalesService.get_sales(cashier_id=cashier.id, cursor=cursor)
+    await SalesService.get_sale_by_id(sale.id)
+    await SalesService.get_daily_stats()
+    await SalesRollupService.get_hourly()
+
+    await DashboardService.get_dashboard_stats()
+    await DashboardService.get_top_products(start_date=week_ago, end_date=now)
+    await DashboardService.get_top_products(start_date=week_ago, category="Kablolar")
+    await DashboardService.get_cashier_performance()
+
+    tx = await FinanceService.create_transaction(
+        FinanceTransactionCreate(type=FinanceType.expense, amount=50, date=now, category="Kira"), admin)
+    await FinanceService.get_transactions()
+    await FinanceService.get_transactions(search="kira")
+    await FinanceService.get_transactions(type=FinanceType.income, search="kira", cursor=cursor)
+    await FinanceService.get_transactions(start_date=week_ago, end_date=now)
+    await FinanceService.get_summary(start_date=week_ago, end_date=now)
+    await FinanceService.get_summary(type=FinanceType.expense)
+    await FinanceService.update_transaction(tx.id, FinanceTransactionUpdate(amount=60))
+
+    await ReportJobService.data_version(week_ago, datetime.utcnow(), cashier.id)
+    await ReportJobService.get_job("missing", cashier)
+    await ReportJobService.get_job("missing", admin)
+
+def test_service_queries_use_indexes(mongod_database, monkeypatch):
+    queries = []
+
+    async def scenario():
+        await run_migrations()
+        record_queries(monkeypatch, queries)
+        await exercise_services()
+        scans = []
+        for collection, filter_dict, sort in queries:
+            # Whole-collection reads (dashboard totals, unfiltered counts) scan by design
+            if not filter_dict and not sort:
+                continue
+            if await scans_collection(collection, filter_dict, sort):
+                scans.append(f"{collection}: filter={filter_dict} sort={sort}")
+        return scans
+
+    scans = mongod_database(scenario)
+    assert len(queries) > 40
+    assert scans == []
@@ -0,0 +1,135 @@
+"""Report artifacts do not pile up and dead jobs do not block re-rendering."""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from backend import reports
+from backend.database import find_one, insert_one
+from backend.models import ReportJob, ReportJobStatus, ReportType, Sale, SaleItem, User, UserRole
+from backend.reports import ReportJobService
+
+PERIOD = (datetime(2024, 5, 1), datetime(2024, 6, 1))
+
+def render(tmp_path, name: str) -> str:
+    path = tmp_path / name
+    path.write_bytes(b"%PDF-1.4")
+    return str(path)
+
+def test_new_version_replaces_old_artifact(tmp_path, monkeypatch):
+    monkeypatch.setattr(reports, "REPORTS_DIR", tmp_path / "cache")
+    old = ReportJobService.artifact_key(ReportType.irsaliye, *PERIOD, None, "3:a:10.00")
+    new = ReportJobService.artifact_key(ReportType.irsaliye, *PERIOD, None, "4:b:12.00")
+    other = ReportJobService.artifact_key(ReportType.irsaliye, *PERIOD, "cashier", "1:c:2.00")
+
+    ReportJobService.store_artifact(render(tmp_path, "a.pdf"), old)
+    ReportJobService.store_artifact(render(tmp_path, "b.pdf"), other)
+    ReportJobService.store_artifact(render(tmp_path, "c.pdf"), new)
+
+    cached = sorted(p.stem for p in (tmp_path / "cache").glob("*.pdf"))
+    assert cached == sorted([new, other])
+
+def test_prune_drops_expired_artifacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(reports, "REPORTS_DIR", tmp_path)
+    stale, fresh = tmp_path / "stale.pdf", tmp_path / "fresh.pdf"
+    stale.write_bytes(b"x")
+    fresh.write_bytes(b"x")
+    past = time.time() - 3600
+    os.utime(stale, (past, past))
+    assert ReportJobService.prune_artifacts(max_age=60) == 1
+    assert not stale.exists() and fresh.exists()
+
+def test_replaced_artifact_stays_readable_from_an_open_handle(tmp_path, monkeypatch):
+    monkeypatch.setattr(reports, "REPORTS_DIR", tmp_path)
+    old = ReportJobService.artifact_key(ReportType.irsaliye, *PERIOD, None, "3:a:10.00")
+    new = ReportJobService.artifact_key(ReportType.irsaliye, *PERIOD, None, "4:b:12.00")
+    (tmp_path / "old.tmp").write_bytes(b"%PDF-old" * 1000)
+    ReportJobService.store_artifact(str(tmp_path / "old.tmp"), old)
+
+    handle = ReportJobService.open_artifact(old)
+    # A sale changes the data version while the old PDF is being sent
+    (tmp_path / "new.tmp").write_bytes(b"%PDF-new")
+    ReportJobService.store_artifact(str(tmp_path / "new.tmp"), new)
+    with handle:
+        assert handle.read() == b"%PDF-old" * 1000
+    assert ReportJobService.open_artifact(old) is None
+
+def test_prune_keeps_artifacts_rendered_after_the_period_closed(tmp_path, monkeypatch):
+    monkeypatch.setattr(reports, "REPORTS_DIR", tmp_path)
+    key = ReportJobService.artifact_key(ReportType.irsaliye, *PERIOD, None, "3:a:10.00")
+    open_key = ReportJobService.artifact_key(ReportType.irsaliye, *PERIOD, "cashier", "1:c:2.00")
+    closed, rendered_open, leftover = tmp_path / f"{key}.pdf", tmp_path / f"{open_key}.pdf", tmp_path / "x.tmp"
+    for path in (closed, rendered_open, leftover):
+        path.write_bytes(b"x")
+    old = time.time() - 3600
+    os.utime(closed, (old, old))
+    os.utime(leftover, (old, old))
+    # Rendered on the last day of the period, so later sales may be missing
+    during = (PERIOD[1] - timedelta(days=1) - datetime(1970, 1, 1)).total_seconds()
+    os.utime(rendered_open, (during, during))
+
+    assert ReportJobService.prune_artifacts(max_age=60) == 2
+    assert closed.exists()
+    assert not rendered_open.exists() and not leftover.exists()
+
+def test_dead_job_is_expired_not_reused(with_database):
+    long_ago = datetime.utcnow() - reports.REPORT_JOB_TIMEOUT - timedelta(minutes=1)
+    dead = ReportJob(
+        type=ReportType.irsaliye, start_date=PERIOD[0], end_date=PERIOD[1],
+        artifact_key="k", created_by="u", status=ReportJobStatus.running, started_at=long_ago
+    )
+    live = ReportJob(
+        type=ReportType.irsaliye, start_date=PERIOD[0], end_date=PERIOD[1],
+        artifact_key="k", created_by="u"
+    )
+
+    async def scenario():
+        await insert_one("report_jobs", dead.dict())
+        await insert_one("report_jobs", live.dict())
+        expired = await ReportJobService.expire_stale_jobs({"artifact_key": "k"})
+        cutoff = datetime.utcnow() - reports.REPORT_JOB_TIMEOUT
+        in_flight = await find_one("report_jobs", {"artifact_key": "k", **ReportJobService._live_filter(cutoff)})
+        return expired, await find_one("report_jobs", {"id": dead.id}), in_flight
+
+    expired, dead_doc, in_flight = with_database(scenario)
+    assert expired == 1
+    assert dead_doc["status"] == "failed"
+    assert in_flight["id"] == live.id
+
+def test_render_now_shares_one_pool_job(with_database, tmp_path, monkeypatch):
+    renders = []
+
+    def fake_render(mongo_url, db_name, start_date, end_date, cashier_id, path):
+        renders.append(path)
+        time.sleep(0.05)
+        with open(path, "wb") as f:
+            f.write(b"%PDF-irsaliye")
+        return 1
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(reports, "REPORTS_DIR", tmp_path)
+    monkeypatch.setattr(reports, "render_irsaliye_file", fake_render)
+    monkeypatch.setattr(reports, "get_executor", lambda: executor)
+    monkeypatch.setenv("MONGO_URL", "mongodb://unused")
+    monkeypatch.setenv("DB_NAME", "unused")
+    admin = User(username="admin", full_name="Admin", role=UserRole.admin, password_hash="x")
+    item = SaleItem(product_id="p", barcode="b", product_name="Priz", quantity=1, unit_price=10, tax_rate=20, total_price=10)
+
+    async def scenario():
+        await insert_one("sales", Sale(cashier_id="c", items=[item], subtotal=8.33, tax_amount=1.67, total=10,
+                                       payment_method="cash", created_at=datetime(2024, 5, 10)).dict())
+        downloads = await asyncio.gather(*(ReportJobService.render_now(*PERIOD, admin) for _ in range(3)))
+        again, _ = await ReportJobService.render_now(*PERIOD, admin)
+        bodies = []
+        for handle, _ in downloads + [(again, None)]:
+            with handle:
+                bodies.append(handle.read())
+        return bodies
+
+    try:
+        bodies = with_database(scenario)
+    finally:
+        executor.shutdown()
+    assert bodies == [b"%PDF-irsaliye"] * 4
+    assert len(renders) == 1
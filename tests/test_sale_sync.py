@@ -0,0 +1,63 @@
+"""Offline queue sync settles partial batches and scopes client ids per cashier."""
+from backend import database
+from backend.database import find_one, find_many, insert_one
+from backend.migrations import _sale_client_ids_per_cashier
+from backend.models import Product, Sale, SaleItem, SaleSyncRequest, SaleSyncStatus
+from backend.services import ProductService, SalesService
+
+def product() -> Product:
+    return Product(barcode="869555", name="Duy", category="Aydınlatma", brand="Viko",
+                   stock=20, min_stock=1, buy_price=3, sell_price=10, tax_rate=20)
+
+def queue(product: Product, *client_ids: str) -> SaleSyncRequest:
+    line = {"product_id": product.id, "barcode": product.barcode, "product_name": product.name,
+            "quantity": 2, "unit_price": 10, "tax_rate": 20}
+    return SaleSyncRequest(sales=[{"client_id": client_id, "items": [line], "payment_method": "cash"}
+                                  for client_id in client_ids])
+
+def test_racing_upload_only_rejects_its_own_sale(with_database, monkeypatch):
+    item = product()
+
+    async def scenario():
+        await _sale_client_ids_per_cashier(database.db.database)
+        await insert_one("products", item.dict())
+        real_load = ProductService.load_products
+
+        async def load_then_race(product_ids):
+            # Another upload of the same queue commits q-2 after our duplicate check
+            products = await real_load(product_ids)
+            racing = Sale(cashier_id="c1", client_id="q-2", subtotal=0, tax_amount=0, total=0, payment_method="cash",
+                          items=[SaleItem(product_id=item.id, barcode=item.barcode, product_name=item.name,
+                                          quantity=2, unit_price=10, tax_rate=20, total_price=20)])
+            await insert_one("sales", racing.dict())
+            return products
+
+        monkeypatch.setattr(ProductService, "load_products", load_then_race)
+        response = await SalesService.sync_sales(queue(item, "q-1", "q-2", "q-3"), "c1")
+        stock = (await find_one("products", {"id": item.id}))["stock"]
+        day = await find_one("sales_rollups", {"granularity": "day"})
+        return response, stock, day
+
+    response, stock, day = with_database(scenario)
+    statuses = {result.client_id: result.status for result in response.results}
+    assert statuses == {"q-1": SaleSyncStatus.accepted, "q-2": SaleSyncStatus.duplicate, "q-3": SaleSyncStatus.accepted}
+    assert (response.accepted, response.duplicates, response.rejected) == (2, 1, 0)
+    # Only the two committed sales took stock and reached the rollups
+    assert stock == 16
+    assert day["total_sales"] == 2
+
+def test_client_ids_are_unique_per_cashier(with_database):
+    item = product()
+
+    async def scenario():
+        await _sale_client_ids_per_cashier(database.db.database)
+        await insert_one("products", item.dict())
+        first = await SalesService.sync_sales(queue(item, "1"), "till-a")
+        second = await SalesService.sync_sales(queue(item, "1"), "till-b")
+        again = await SalesService.sync_sales(queue(item, "1"), "till-a")
+        return first, second, again, await find_many("sales", {"client_id": "1"})
+
+    first, second, again, sales = with_database(scenario)
+    assert first.accepted == 1 and second.accepted == 1
+    assert again.duplicates == 1
+    assert {sale["cashier_id"] for sale in sales} == {"till-a", "till-b"}
@@ -0,0 +1,53 @@
+"""Rollups are applied after checkout and rebuilt in place."""
+from datetime import datetime
+
+from backend.database import find_one, find_many, insert_one, insert_many
+from backend.models import Product, Sale, SaleCreate, SaleItem
+from backend.services import SalesRollupService, SalesService
+
+def sale(created_at: datetime, total: float, quantity: int = 1) -> dict:
+    item = SaleItem(product_id="p", barcode="b", product_name="Priz", quantity=quantity,
+                    unit_price=total / quantity, tax_rate=20, total_price=total)
+    return Sale(cashier_id="c1", items=[item], subtotal=total / 1.2, tax_amount=total - total / 1.2,
+                total=total, payment_method="cash", created_at=created_at).dict()
+
+def test_checkout_updates_rollups(with_database):
+    product = Product(barcode="869123", name="Priz", category="Elektrik", brand="Viko",
+                      stock=10, min_stock=1, buy_price=5, sell_price=12, tax_rate=20)
+
+    async def scenario():
+        await insert_one("products", product.dict())
+        basket = SaleCreate(items=[{
+            "product_id": product.id, "barcode": product.barcode, "product_name": product.name,
+            "quantity": 2, "unit_price": 12, "tax_rate": 20,
+        }], payment_method="card")
+        created = await SalesService.create_sale(basket, "c1")
+        return await find_one("sales_rollups", {"_id": SalesRollupService.bucket_key("day", created.created_at)})
+
+    day = with_database(scenario)
+    assert day["total_sales"] == 1
+    assert day["total_items"] == 2
+    assert day["payment_methods"]["card"]["revenue"] == 24
+
+def test_rebuild_replaces_buckets_and_drops_empty_ones(with_database):
+    async def scenario():
+        await insert_many("sales", [
+            sale(datetime(2024, 3, 1, 10, 5), 100, 2),
+            sale(datetime(2024, 3, 1, 10, 40), 50),
+            sale(datetime(2024, 3, 2, 9, 0), 30),
+        ])
+        # Drifted counters and a bucket with no sales left
+        await insert_one("sales_rollups", {"_id": "day:2024-03-01", "granularity": "day",
+                                           "period": datetime(2024, 3, 1), "total_sales": 99})
+        await insert_one("sales_rollups", {"_id": "day:2024-03-05", "granularity": "day",
+                                           "period": datetime(2024, 3, 5), "total_sales": 1})
+        count = await SalesRollupService.rebuild()
+        return count, {doc["_id"]: doc for doc in await find_many("sales_rollups", {})}
+
+    count, buckets = with_database(scenario)
+    assert count == 3
+    assert buckets["day:2024-03-01"]["total_sales"] == 2
+    assert buckets["day:2024-03-01"]["total_revenue"] == 150
+    assert buckets["hour:2024-03-01T10"]["total_items"] == 3
+    assert buckets["day:2024-03-02"]["total_sales"] == 1
+    assert "day:2024-03-05" not in buckets
@@ -0,0 +1,128 @@
+"""Parallel stock decrements never oversell or lose updates."""
+import asyncio
+
+from backend.database import delete_one, find_one, insert_one
+from backend.models import GoodsReceiptCreate, Product, StockMovementCreate, StockMovementType
+from backend.services import ProductService, StockService
+
+async def seed_product(stock: int) -> str:
+    product = Product(
+        barcode="869000000042", name="Sigorta 16A", category="Sigortalar", brand="ABB",
+        stock=stock, min_stock=2, buy_price=20, sell_price=35, tax_rate=20
+    )
+    await insert_one("products", product.dict())
+    return product.id
+
+async def decrement(product_id: str, quantity: int):
+    return await ProductService.update_stock(product_id, -quantity, version=1)
+
+def test_parallel_decrements_stop_at_zero(with_database):
+    async def scenario():
+        product_id = await seed_product(50)
+        outcomes = await asyncio.gather(*(decrement(product_id, 1) for _ in range(80)), return_exceptions=True)
+        rejected = [o for o in outcomes if isinstance(o, ValueError)]
+        accepted = [o for o in outcomes if isinstance(o, Product)]
+        doc = await find_one("products", {"id": product_id})
+        return len(accepted), len(rejected), doc
+
+    accepted, rejected, doc = with_database(scenario)
+    assert (accepted, rejected) == (50, 30)
+    assert doc["stock"] == 0
+    assert doc["is_low"] is True
+
+def test_parallel_mixed_quantities_never_go_negative(with_database):
+    quantities = [3, 5, 7, 2, 4, 6, 1, 8] * 5
+
+    async def scenario():
+        product_id = await seed_product(60)
+        outcomes = await asyncio.gather(*(decrement(product_id, q) for q in quantities), return_exceptions=True)
+        sold = sum(q for q, o in zip(quantities, outcomes) if isinstance(o, Product))
+        rejected = sum(1 for o in outcomes if isinstance(o, ValueError))
+        doc = await find_one("products", {"id": product_id})
+        return sold, rejected, doc["stock"]
+
+    sold, rejected, stock = with_database(scenario)
+    # Every accepted decrement is reflected exactly once
+    assert stock == 60 - sold
+    assert stock >= 0 and rejected > 0
+
+def test_parallel_movements_record_only_accepted(with_database):
+    async def scenario():
+        product_id = await seed_product(10)
+        movement = StockMovementCreate(product_id=product_id, type=StockMovementType.stock_out, quantity=1)
+        outcomes = await asyncio.gather(
+            *(StockService.create_movement(movement, "tester") for _ in range(15)), return_exceptions=True
+        )
+        recorded = await StockService.get_movements(product_id=product_id)
+        doc = await find_one("products", {"id": product_id})
+        return outcomes, recorded, doc
+
+    outcomes, recorded, doc = with_database(scenario)
+    assert sum(1 for o in outcomes if isinstance(o, ValueError)) == 5
+    assert len(recorded) == 10
+    assert doc["stock"] == 0
+
+def test_failed_movement_insert_restores_stock(with_database, monkeypatch):
+    from backend import services
+
+    async def failing_insert(collection, document, session=None):
+        raise RuntimeError("insert failed")
+
+    async def scenario():
+        product_id = await seed_product(10)
+        monkeypatch.setattr(services, "insert_one", failing_insert)
+        movement = StockMovementCreate(product_id=product_id, type=StockMovementType.stock_out, quantity=4)
+        try:
+            await StockService.create_movement(movement, "tester")
+        except RuntimeError:
+            pass
+        return await find_one("products", {"id": product_id})
+
+    doc = with_database(scenario)
+    assert doc["stock"] == 10
+
+def test_failed_receipt_restores_stock(with_database, monkeypatch):
+    from backend import services
+
+    async def failing_insert_many(collection, documents, ordered=True, session=None):
+        raise RuntimeError("insert failed")
+
+    async def scenario():
+        product_id = await seed_product(10)
+        monkeypatch.setattr(services, "insert_many", failing_insert_many)
+        receipt = GoodsReceiptCreate(supplier="Toptanci", lines=[{"product_id": product_id, "quantity": 5}])
+        try:
+            await StockService.create_receipt(receipt, "tester")
+        except RuntimeError:
+            pass
+        return await find_one("products", {"id": product_id})
+
+    assert with_database(scenario)["stock"] == 10
+
+def test_receipt_for_deleted_product_restores_other_lines(with_database, monkeypatch):
+    async def scenario():
+        product_id = await seed_product(10)
+        other = Product(barcode="869000000043", name="Sigorta 25A", category="Sigortalar", brand="ABB",
+                        stock=3, min_stock=2, buy_price=20, sell_price=35, tax_rate=20)
+        await insert_one("products", other.dict())
+        receipt = GoodsReceiptCreate(supplier="Toptanci", lines=[
+            {"product_id": product_id, "quantity": 5}, {"product_id": other.id, "quantity": 2}
+        ])
+        real_load = ProductService.load_products
+
+        async def load_then_delete(product_ids):
+            # The product disappears between the existence check and the write
+            products = await real_load(product_ids)
+            await delete_one("products", {"id": other.id})
+            return products
+
+        monkeypatch.setattr(ProductService, "load_products", load_then_delete)
+        try:
+            await StockService.create_receipt(receipt, "tester")
+        except ValueError:
+            pass
+        return await find_one("products", {"id": product_id}), await StockService.get_movements()
+
+    doc, movements = with_database(scenario)
+    assert doc["stock"] == 10
+    assert movements == []
@@ -0,0 +1,107 @@
+"""run_in_transaction retries write conflicts and unknown commit results."""
+import asyncio
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from backend import database
+
+def labelled(label: str) -> OperationFailure:
+    return OperationFailure("conflict", 112, {"errorLabels": [label], "code": 112})
+
+class FakeSession:
+    def __init__(self, commit_errors=()):
+        self.commit_errors = list(commit_errors)
+        self.in_transaction = False
+        self.started = self.commits = self.aborts = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def start_transaction(self):
+        self.in_transaction = True
+        self.started += 1
+
+    async def abort_transaction(self):
+        self.in_transaction = False
+        self.aborts += 1
+
+    async def commit_transaction(self):
+        self.commits += 1
+        if self.commit_errors:
+            raise self.commit_errors.pop(0)
+        self.in_transaction = False
+
+class FakeClient:
+    def __init__(self, session):
+        self.session = session
+
+    async def start_session(self):
+        return self.session
+
+@pytest.fixture
+def replica_set(monkeypatch):
+    def install(session):
+        monkeypatch.setattr(database.db, "client", FakeClient(session))
+        monkeypatch.setattr(database.db, "supports_transactions", True)
+        monkeypatch.setattr(database, "TRANSACTION_BACKOFF", 0)
+    return install
+
+def test_write_conflict_reruns_body(replica_set):
+    session = FakeSession()
+    replica_set(session)
+    calls = []
+
+    async def body(s):
+        calls.append(s)
+        if len(calls) < 3:
+            raise labelled("TransientTransactionError")
+        return "done"
+
+    assert asyncio.run(database.run_in_transaction(body)) == "done"
+    assert len(calls) == 3
+    assert session.aborts == 2 and session.commits == 1
+
+def test_retries_are_bounded(replica_set):
+    replica_set(FakeSession())
+
+    async def body(s):
+        raise labelled("TransientTransactionError")
+
+    with pytest.raises(OperationFailure):
+        asyncio.run(database.run_in_transaction(body, attempts=2))
+
+def test_other_errors_abort_without_retry(replica_set):
+    session = FakeSession()
+    replica_set(session)
+    calls = []
+
+    async def body(s):
+        calls.append(s)
+        raise ValueError("Insufficient stock")
+
+    with pytest.raises(ValueError):
+        asyncio.run(database.run_in_transaction(body))
+    assert len(calls) == 1 and session.aborts == 1
+
+def test_unknown_commit_result_retries_commit_only(replica_set):
+    session = FakeSession(commit_errors=[labelled("UnknownTransactionCommitResult")])
+    replica_set(session)
+    calls = []
+
+    async def body(s):
+        calls.append(s)
+
+    asyncio.run(database.run_in_transaction(body))
+    assert len(calls) == 1 and session.commits == 2
+
+def test_standalone_runs_body_once_without_session(monkeypatch):
+    monkeypatch.setattr(database.db, "supports_transactions", False)
+
+    async def body(s):
+        return s
+
+    assert asyncio.run(database.run_in_transaction(body)) is None